@@ -0,0 +1,64 @@
+"""Composite keys for sql summaries
+
+Revision ID: 3c5a1e8f2b74
+Revises: 799310dca712
+Create Date: 2026-10-17 10:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5a1e8f2b74'
+down_revision = '799310dca712'
+branch_labels = None
+depends_on = None
+
+
+SUMMARY_KEYS = ('url', 'remote', 'useragent', 'language', 'server')
+PERIODS = ('hourly', 'daily', 'monthly')
+
+
+def _summary_tables():
+    inspector = sa.inspect(op.get_bind())
+    existing = inspector.get_table_names()
+    for key in SUMMARY_KEYS:
+        for period in PERIODS:
+            table = 'flask_usage_{}_{}'.format(key, period)
+            if table in existing:
+                pk_name = inspector.get_pk_constraint(table).get('name')
+                yield table, key, pk_name
+
+
+def upgrade():
+    for table, key, pk_name in list(_summary_tables()):
+        # keys are part of the primary key and can no longer be NULL
+        summary = sa.table(table, sa.column(key))
+        op.execute(
+            summary.update().where(
+                summary.c[key].is_(None)).values({key: ''}))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                key, existing_type=sa.String(128), nullable=False)
+            if pk_name:
+                batch_op.drop_constraint(pk_name, type_='primary')
+            batch_op.create_primary_key(
+                '{}_pkey'.format(table), ['date', key])
+        op.create_index(
+            'ix_{}_{}_date'.format(table, key), table, [key, 'date'])
+
+
+def downgrade():
+    # Fails if more than one key was summarized for the same date
+    for table, key, pk_name in list(_summary_tables()):
+        op.drop_index('ix_{}_{}_date'.format(table, key), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            if pk_name:
+                batch_op.drop_constraint(pk_name, type_='primary')
+            batch_op.create_primary_key('{}_pkey'.format(table), ['date'])
+            batch_op.alter_column(
+                key, existing_type=sa.String(128), nullable=True)
+        summary = sa.table(table, sa.column(key))
+        op.execute(
+            summary.update().where(summary.c[key] == '').values({key: None}))
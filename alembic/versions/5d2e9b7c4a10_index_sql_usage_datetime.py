@@ -0,0 +1,45 @@
+"""Index sql usage datetime
+
+Revision ID: 5d2e9b7c4a10
+Revises: 3c5a1e8f2b74
+Create Date: 2026-10-17 16:03:27.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e9b7c4a10'
+down_revision = '3c5a1e8f2b74'
+branch_labels = None
+depends_on = None
+
+
+TABLE = 'flask_usage'
+INDEX = 'ix_flask_usage_datetime'
+
+
+def _has_index():
+    inspector = sa.inspect(op.get_bind())
+    if TABLE not in inspector.get_table_names():
+        return None
+    return INDEX in [i['name'] for i in inspector.get_indexes(TABLE)]
+
+
+def upgrade():
+    if _has_index() is not False:
+        return
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY does not block writes but can not run in a
+        # transaction
+        with op.get_context().autocommit_block():
+            op.create_index(
+                INDEX, TABLE, ['datetime'], postgresql_concurrently=True)
+    else:
+        op.create_index(INDEX, TABLE, ['datetime'])
+
+
+def downgrade():
+    if _has_index():
+        op.drop_index(INDEX, table_name=TABLE)
@@ -0,0 +1,89 @@
+"""
+Compares rows/sec of SQLStorage.store against SQLStorage.store_many on a
+SQLite file database.
+
+Usage::
+
+    $ PYTHONPATH=src python bench/bench_sql_store.py [rows] [batch_size]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import sqlalchemy as sql
+
+from flask_track_usage.storage.sql import SQLStorage
+
+
+UserAgent = namedtuple(
+    'UserAgent', ['browser', 'language', 'platform', 'version', 'string'])
+
+
+def make_data(i):
+    """
+    Builds the same data TrackUsage.after_request would.
+    """
+    return {
+        'url': 'http://localhost/page/{}'.format(i % 50),
+        'user_agent': UserAgent(
+            'firefox', 'en-US', 'linux', '60.0', 'Mozilla/5.0'),
+        'server_name': 'bench',
+        'blueprint': None,
+        'view_args': {},
+        'status': 200,
+        'remote_addr': '127.0.0.1',
+        'xforwardedfor': None,
+        'authorization': False,
+        'ip_info': None,
+        'path': '/page/{}'.format(i % 50),
+        'speed': 0.001,
+        'date': int(time.time()),
+        'content_length': 6,
+        'username': None,
+        'track_var': {},
+    }
+
+
+def make_storage(directory, name):
+    """
+    Creates a storage backed by a fresh SQLite file.
+    """
+    engine = sql.create_engine(
+        'sqlite:///' + os.path.join(directory, name + '.db'))
+    return SQLStorage(engine=engine, metadata=sql.MetaData(bind=engine))
+
+
+def run(rows, batch_size):
+    directory = tempfile.mkdtemp()
+    try:
+        records = [make_data(i) for i in range(rows)]
+
+        storage = make_storage(directory, 'single')
+        start = time.time()
+        for data in records:
+            storage.store(data)
+        single = rows / (time.time() - start)
+
+        storage = make_storage(directory, 'batched')
+        start = time.time()
+        for i in range(0, rows, batch_size):
+            storage.store_many(records[i:i + batch_size])
+        batched = rows / (time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+    print('rows: {}  batch size: {}'.format(rows, batch_size))
+    print('store        {:>12.0f} rows/sec'.format(single))
+    print('store_many   {:>12.0f} rows/sec'.format(batched))
+    print('speedup      {:>12.1f}x'.format(batched / single))
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+    )
@@ -0,0 +1,55 @@
+"""
+Compares the per call overhead of a summary hook resolving its backend
+function on every call (through ``_caller``) against the function bound
+in ``set_up``.
+
+Usage::
+
+    $ PYTHONPATH=src python bench/bench_summary_dispatch.py [calls]
+"""
+
+import sys
+import timeit
+import types
+
+from flask_track_usage import summarization
+from flask_track_usage.summarization import _caller, sumUrl
+
+
+class BenchStorage(object):
+    """
+    Stands in for a storage class supporting summaries.
+    """
+
+
+def run(calls):
+    # A backend doing nothing so only the dispatch is measured
+    backend = types.ModuleType('benchstorage')
+    backend.sumUrl = lambda **kwargs: None
+    summarization.benchstorage = backend
+
+    kwargs = {
+        '_parent_class_name': BenchStorage.__name__,
+        '_parent_self': BenchStorage(),
+        'url': 'http://localhost/',
+        'date': 0,
+        'content_length': 6,
+    }
+    hook = sumUrl()
+    hook.set_up(**kwargs)
+    # What storages call for each request
+    bound_call = hook.bind(BenchStorage.__name__)
+
+    lookup = min(timeit.repeat(
+        lambda: _caller('sumUrl', **kwargs), number=calls, repeat=5))
+    bound = min(timeit.repeat(
+        lambda: bound_call(**kwargs), number=calls, repeat=5))
+
+    print('calls: {}'.format(calls))
+    print('lookup per call  {:>8.0f} ns'.format(lookup / calls * 1e9))
+    print('bound per call   {:>8.0f} ns'.format(bound / calls * 1e9))
+    print('speedup          {:>8.1f}x'.format(lookup / bound))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
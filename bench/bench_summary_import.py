@@ -0,0 +1,50 @@
+"""
+Measures the cold import time of flask_track_usage.summarization, which
+loads its backend modules on demand, against importing it together with
+every backend module as it did before.
+
+Each measurement runs in a fresh interpreter.
+
+Usage::
+
+    $ PYTHONPATH=src python bench/bench_summary_import.py [runs]
+"""
+
+import subprocess
+import sys
+
+TIMER = """
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+"""
+
+LAZY = "import flask_track_usage.summarization"
+EAGER = (
+    "import flask_track_usage.summarization\n"
+    "import flask_track_usage.summarization.mongoenginestorage\n"
+    "import flask_track_usage.summarization.sqlstorage"
+)
+
+
+def measure(statement, runs):
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', TIMER.format(statement)])
+        times.append(float(output))
+    return min(times)
+
+
+def run(runs):
+    lazy = measure(LAZY, runs)
+    eager = measure(EAGER, runs)
+    print('runs: {}'.format(runs))
+    print('all backends   {:>8.1f} ms'.format(eager * 1000))
+    print('on demand      {:>8.1f} ms'.format(lazy * 1000))
+    print('speedup        {:>8.1f}x'.format(eager / lazy))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -32,24 +32,40 @@
 Basic metrics tracking with Flask.
 """
 
-import datetime
-import json
+import calendar
+import logging
 import time
-from six.moves.urllib_parse import quote_plus
-from six.moves.urllib.request import urlopen
 
 import six
 
 from flask import _request_ctx_stack, g
+
+from flask_track_usage.dispatch import BackgroundDispatcher
+from flask_track_usage.event import UsageEvent
+from flask_track_usage.geoip import (
+    CachedResolver, CIDRResolver, HTTPResolver, ResolveError)
+from flask_track_usage.sampling import Sampler
 try:
     from flask_login import current_user
 except Exception:
     pass
 
+try:
+    _perf_counter_ns = time.perf_counter_ns
+    _time_ns = time.time_ns
+except AttributeError:  # Python < 3.7
+    def _perf_counter_ns():
+        return int(getattr(time, 'perf_counter', time.time)() * 1e9)
+
+    def _time_ns():
+        return int(time.time() * 1e9)
+
 __version__ = '2.0.0'
 __author__ = 'Steve Milner'
 __license__ = 'MBSD'
 
+log = logging.getLogger(__name__)
+
 
 class TrackUsage(object):
     """
@@ -71,6 +87,12 @@ class TrackUsage(object):
         #
         self._exclude_views = set()
         self._include_views = set()
+        self._exclude_endpoints = set()
+        self._include_endpoints = set()
+        self._exclude_prefixes = set()
+        self._include_prefixes = set()
+        self._decisions = {}
+        self._decisions_views = 0
 
         if callable(storage):
             storage = [storage]
@@ -96,12 +118,64 @@ class TrackUsage(object):
             'TRACK_USAGE_FREEGEOIP_ENDPOINT',
             "http://extreme-ip-lookup.com/json/{ip}"
         )
+        self._ip_resolver = app.config.get('TRACK_USAGE_IP_RESOLVER', None)
+        if self._ip_resolver is None:
+            if app.config.get('TRACK_USAGE_GEOIP_DATABASE'):
+                self._ip_resolver = CIDRResolver(
+                    app.config['TRACK_USAGE_GEOIP_DATABASE'])
+            elif self._use_freegeoip:
+                self._ip_resolver = HTTPResolver(self._freegeoip_endpoint)
+        cache_size = app.config.get('TRACK_USAGE_IP_CACHE_SIZE', 1024)
+        if self._ip_resolver is not None and cache_size:
+            self._ip_resolver = CachedResolver(
+                self._ip_resolver,
+                maxsize=cache_size,
+                ttl=app.config.get('TRACK_USAGE_IP_CACHE_TTL', 3600)
+            )
         self._type = app.config.get(
             'TRACK_USAGE_INCLUDE_OR_EXCLUDE_VIEWS', 'exclude')
 
         if self._type not in ('include', 'exclude'):
             raise NotImplementedError(
                 'You must set include or exclude type.')
+
+        self._fields = self._needed_fields()
+
+        self._sampler = None
+        rate = app.config.get('TRACK_USAGE_SAMPLE_RATE', 1.0)
+        rates = app.config.get('TRACK_USAGE_SAMPLE_RATES', None)
+        if rate < 1 or rates:
+            self._sampler = Sampler(
+                rate,
+                rates,
+                keep_errors=app.config.get(
+                    'TRACK_USAGE_SAMPLE_KEEP_ERRORS', True),
+                keep_slower_than=app.config.get(
+                    'TRACK_USAGE_SAMPLE_KEEP_SLOWER_THAN', None)
+            )
+
+        self.dispatcher = None
+        dispatch = app.config.get('TRACK_USAGE_DISPATCH', 'sync')
+        if dispatch == 'background':
+            self.dispatcher = BackgroundDispatcher(
+                self._store,
+                queue_size=app.config.get(
+                    'TRACK_USAGE_DISPATCH_QUEUE_SIZE', 1000),
+                workers=app.config.get('TRACK_USAGE_DISPATCH_WORKERS', 1),
+                overflow=app.config.get(
+                    'TRACK_USAGE_DISPATCH_OVERFLOW', 'drop'),
+                block_timeout=app.config.get(
+                    'TRACK_USAGE_DISPATCH_BLOCK_TIMEOUT', None)
+            )
+        elif dispatch != 'sync':
+            raise NotImplementedError(
+                'You must set sync or background dispatch.')
+        self._timing_phases = app.config.get(
+            'TRACK_USAGE_TIMING_PHASES', False)
+        if self._timing_phases:
+            # Runs before any before_request function
+            app.url_value_preprocessor(self._mark_start)
+            app.dispatch_request = self._timed_dispatch(app.dispatch_request)
         app.before_request(self.before_request)
         app.after_request(self.after_request)
 
@@ -109,18 +183,14 @@ class TrackUsage(object):
         """
         Done before every request that is in scope.
         """
+        if not self._tracked():
+            return
+        # Timing is kept on the request context; g may be shared by
+        # several requests of an outer app context
         ctx = _request_ctx_stack.top
-        view_func = self.app.view_functions.get(ctx.request.endpoint)
-        if self._type == 'exclude':
-            if view_func in self._exclude_views:
-                return
-        elif self._type == 'include':
-            if view_func not in self._include_views:
-                return
-        else:
-            raise NotImplementedError(
-                'You must set include or exclude type.')
-        g.start_time = datetime.datetime.utcnow()
+        if not hasattr(ctx, '_track_usage_start'):
+            # Not already marked by _mark_start
+            ctx._track_usage_start = _perf_counter_ns()
         if not hasattr(g, "track_var"):
             g.track_var = {}
 
@@ -133,80 +203,267 @@ class TrackUsage(object):
            - `response`: The response on it's way to the client.
         """
         ctx = _request_ctx_stack.top
-        view_func = self.app.view_functions.get(ctx.request.endpoint)
-        if self._type == 'exclude':
-            if view_func in self._exclude_views:
+        if not self._tracked():
+            return response
+
+        now = _perf_counter_ns()
+        # Missing when a before_request function ended the request early
+        speed_ns = now - getattr(ctx, '_track_usage_start', now)
+        speed = speed_ns / 1e9
+
+        sample_weight = 1.0
+        if self._sampler is not None:
+            sample_weight = self._sampler.weight(
+                ctx.request.endpoint, response.status_code, speed)
+            if sample_weight is None:
+                # Not sampled, skip collecting anything else
                 return response
-        elif self._type == 'include':
-            if view_func not in self._include_views:
-                return response
-        else:
-            raise NotImplementedError(
-                'You must set include or exclude type.')
-
-        now = datetime.datetime.utcnow()
-        speed = None
-        try:
-            speed = (now - g.start_time).total_seconds()
-        except:
-            # Older python versions don't have total_seconds()
-            speed_result = (now - g.start_time)
-            speed = float("%s.%s" % (
-                speed_result.seconds, speed_result.microseconds))
 
         if self._fake_time:
-            current_time = self._fake_time
+            timestamp_ns = calendar.timegm(
+                self._fake_time.timetuple()) * 1000000000
         else:
-            current_time = now
-
-        data = {
-            'url': ctx.request.url,
-            'user_agent': ctx.request.user_agent,
-            'server_name': ctx.app.name,
-            'blueprint': ctx.request.blueprint,
-            'view_args': ctx.request.view_args,
-            'status': response.status_code,
-            'remote_addr': ctx.request.remote_addr,
-            'xforwardedfor': ctx.request.headers.get(
-                'X-Forwarded-For', None),
-            'authorization': bool(ctx.request.authorization),
-            'ip_info': None,
-            'path': ctx.request.path,
-            'speed': float(speed),
-            'date': int(time.mktime(current_time.timetuple())),
-            'content_length': response.content_length,
-            'request': "{} {} {}".format(
-                ctx.request.method,
-                ctx.request.url,
-                ctx.request.environ.get('SERVER_PROTOCOL')
-            ),
-            'url_args': dict(
-                [(k, ctx.request.args[k]) for k in ctx.request.args]
-            ),
-            'username': None,
-            'track_var': g.track_var
-        }
+            timestamp_ns = _time_ns()
+
+        timing = None
+        if self._timing_phases:
+            timing = self._phases(now)
+
+        username = None
         if ctx.request.authorization:
-            data['username'] = str(ctx.request.authorization.username)
+            username = str(ctx.request.authorization.username)
         elif getattr(self.app, 'login_manager', None) and current_user and not current_user.is_anonymous:
-            data['username'] = str(current_user)
-        if self._use_freegeoip:
-            clean_ip = quote_plus(str(ctx.request.remote_addr))
-            if '{ip}' in self._freegeoip_endpoint:
-                url = self._freegeoip_endpoint.format(ip=clean_ip)
-            else:
-                url = self._freegeoip_endpoint + clean_ip
-            # seperate capture and conversion to aid in debugging
-            text = urlopen(url).read()
-            ip_info = json.loads(text)
-            if url.startswith("http://extreme-ip-lookup.com/"):
-                del ip_info["businessWebsite"]
-                del ip_info["status"]
-            data['ip_info'] = ip_info
+            username = str(current_user)
+
+        data = UsageEvent(
+            ctx.request,
+            response,
+            server_name=ctx.app.name,
+            status=response.status_code,
+            ip_info=None,
+            speed=speed,
+            speed_ns=speed_ns,
+            date=timestamp_ns // 1000000000,
+            timestamp_ns=timestamp_ns,
+            timing=timing,
+            username=username,
+            track_var=getattr(g, 'track_var', {}),
+            sample_weight=sample_weight
+        )
+        if self._fields is None:
+            # Some storage did not declare the fields it reads
+            data = dict(data)
+
+        if self.dispatcher is not None:
+            if self._fields is not None:
+                data.detach(self._fields)
+            self.dispatcher.dispatch(data)
+        else:
+            self._store(data)
+            if self._fields is not None:
+                # Storages may keep the event, such as BatchStorage
+                data.detach(self._fields)
+        if timing is not None:
+            timing['storage'] = _perf_counter_ns() - now
+        return response
 
+    def _mark_start(self, endpoint, values):
+        """
+        Marks the start of a request before any before_request function
+        runs when TRACK_USAGE_TIMING_PHASES is enabled.
+
+        :Parameters:
+           - `endpoint`: The endpoint of the request.
+           - `values`: The view arguments of the request.
+
+        .. versionadded:: 2.1.0
+        """
+        _request_ctx_stack.top._track_usage_start = _perf_counter_ns()
+
+    @staticmethod
+    def _timed_dispatch(dispatch_request):
+        """
+        Wraps Flask.dispatch_request to mark when the view starts and ends.
+
+        :Parameters:
+           - `dispatch_request`: The bound dispatch_request of the app.
+
+        .. versionadded:: 2.1.0
+        """
+        def timed_dispatch_request(*args, **kwargs):
+            ctx = _request_ctx_stack.top
+            ctx._track_usage_view_start = _perf_counter_ns()
+            try:
+                return dispatch_request(*args, **kwargs)
+            finally:
+                ctx._track_usage_view_end = _perf_counter_ns()
+        return timed_dispatch_request
+
+    @staticmethod
+    def _phases(now):
+        """
+        Returns nanoseconds spent in each phase of the current request.
+        The storage phase is added once the data has been handed to the
+        storages.
+
+        :Parameters:
+           - `now`: perf counter value when after_request started.
+
+        .. versionadded:: 2.1.0
+        """
+        ctx = _request_ctx_stack.top
+        start = getattr(ctx, '_track_usage_start', now)
+        view_start = getattr(ctx, '_track_usage_view_start', now)
+        view_end = getattr(ctx, '_track_usage_view_end', view_start)
+        timing = {
+            'before_request': view_start - start,
+            'view': view_end - view_start,
+            'after_request': now - view_end,
+        }
+        # Readable with the storage phase by the app, for example in
+        # teardown_request
+        g.track_usage_timing = timing
+        return timing
+
+    def _store(self, data):
+        """
+        Passes the collected data to every storage. When using background
+        dispatch this happens after the response has been returned.
+
+        :Parameters:
+           - `data`: The data collected for a single request.
+        """
+        if self._ip_resolver is not None and data['ip_info'] is None and (
+                self._fields is None or 'ip_info' in self._fields):
+            try:
+                data['ip_info'] = self._ip_resolver(data['remote_addr'])
+            except ResolveError:
+                log.exception(
+                    'Unable to look up %s', data['remote_addr'])
         for storage in self._storages:
             storage(data)
-        return response
+
+    def _needed_fields(self):
+        """
+        Returns the names of the fields read by the storages and their
+        hooks or None if any of them did not declare its fields.
+
+        .. versionadded:: 2.1.0
+        """
+        fields = set()
+        for storage in self._storages:
+            hooks = getattr(storage, '_post_storage_hooks', [])
+            for item in [storage] + list(hooks):
+                declared = getattr(item, 'fields', None)
+                if declared is None:
+                    return None
+                fields.update(declared)
+        if 'ip_info' in fields and self._ip_resolver is not None:
+            fields.add('remote_addr')
+        return frozenset(fields)
+
+    def shutdown(self, timeout=None):
+        """
+        Waits for queued data to be stored when using background dispatch.
+
+        :Parameters:
+           - `timeout`: Seconds to wait for each worker. None waits forever.
+
+        .. versionadded:: 2.1.0
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown(timeout)
+
+    def _tracked(self):
+        """
+        Returns if the current request should be tracked. The decision is
+        made once per endpoint and URL rule and kept on the request context,
+        not on `g` which may outlive the request, so `before_request` and
+        `after_request` only look it up once.
+
+        .. versionadded:: 2.1.0
+        """
+        ctx = _request_ctx_stack.top
+        decisions = getattr(ctx, '_track_usage_decisions', None)
+        if decisions is None:
+            decisions = {}
+            ctx._track_usage_decisions = decisions
+        tracked = decisions.get(self)
+        if tracked is None:
+            request = ctx.request
+            rule = request.url_rule.rule if request.url_rule else None
+            key = (request.endpoint, rule)
+            cache = self._decisions
+            if self._decisions_views != len(self.app.view_functions):
+                # New views were registered since the decisions were made
+                cache = {}
+            tracked = cache.get(key)
+            if tracked is None:
+                tracked = self._decide(request.endpoint, rule)
+                # Readers never see a partially updated dictionary
+                cache = dict(cache)
+                cache[key] = tracked
+                self._decisions = cache
+                self._decisions_views = len(self.app.view_functions)
+            decisions[self] = tracked
+        return tracked
+
+    def _decide(self, endpoint, rule):
+        """
+        Decides if requests for an endpoint should be tracked.
+
+        :Parameters:
+           - `endpoint`: The endpoint name of the request.
+           - `rule`: The URL rule string of the request.
+
+        .. versionadded:: 2.1.0
+        """
+        view_func = self.app.view_functions.get(endpoint)
+        if self._type == 'exclude':
+            return not (
+                view_func in self._exclude_views or
+                self._matches(endpoint, rule, self._exclude_endpoints,
+                              self._exclude_prefixes))
+        elif self._type == 'include':
+            return (
+                view_func in self._include_views or
+                self._matches(endpoint, rule, self._include_endpoints,
+                              self._include_prefixes))
+        raise NotImplementedError(
+            'You must set include or exclude type.')
+
+    @staticmethod
+    def _matches(endpoint, rule, endpoints, prefixes):
+        """
+        Checks an endpoint and URL rule against endpoint and prefix rules.
+
+        :Parameters:
+           - `endpoint`: The endpoint name of the request.
+           - `rule`: The URL rule string of the request.
+           - `endpoints`: Endpoint names. Names ending with a "." match
+             every endpoint of a blueprint.
+           - `prefixes`: URL rule prefixes.
+        """
+        if endpoint is not None:
+            if endpoint in endpoints:
+                return True
+            # Blueprint rules such as "admin." also match nested blueprints
+            dot = endpoint.find('.')
+            while dot != -1:
+                if endpoint[:dot + 1] in endpoints:
+                    return True
+                dot = endpoint.find('.', dot + 1)
+        if rule is not None:
+            for prefix in prefixes:
+                if rule.startswith(prefix):
+                    return True
+        return False
+
+    def _invalidate(self):
+        """
+        Forgets every cached tracking decision.
+        """
+        self._decisions = {}
 
     def exclude(self, view):
         """
@@ -216,6 +473,7 @@ class TrackUsage(object):
            - `view`: The view to exclude.
         """
         self._exclude_views.add(view)
+        self._invalidate()
 
     def include(self, view):
         """
@@ -225,6 +483,61 @@ class TrackUsage(object):
            - `view`: The view to include.
         """
         self._include_views.add(view)
+        self._invalidate()
+
+    def exclude_endpoint(self, endpoint):
+        """
+        Excludes an endpoint by name from tracking if we are in exclude
+        mode. A name ending with a "." such as "admin." excludes every
+        endpoint of that blueprint.
+
+        :Parameters:
+           - `endpoint`: The endpoint name to exclude.
+
+        .. versionadded:: 2.1.0
+        """
+        self._exclude_endpoints.add(endpoint)
+        self._invalidate()
+
+    def include_endpoint(self, endpoint):
+        """
+        Includes an endpoint by name for tracking if we are in include
+        mode. A name ending with a "." such as "api." includes every
+        endpoint of that blueprint.
+
+        :Parameters:
+           - `endpoint`: The endpoint name to include.
+
+        .. versionadded:: 2.1.0
+        """
+        self._include_endpoints.add(endpoint)
+        self._invalidate()
+
+    def exclude_prefix(self, prefix):
+        """
+        Excludes every URL rule starting with a prefix from tracking if we
+        are in exclude mode.
+
+        :Parameters:
+           - `prefix`: The URL rule prefix to exclude, such as "/static/".
+
+        .. versionadded:: 2.1.0
+        """
+        self._exclude_prefixes.add(prefix)
+        self._invalidate()
+
+    def include_prefix(self, prefix):
+        """
+        Includes every URL rule starting with a prefix for tracking if we
+        are in include mode.
+
+        :Parameters:
+           - `prefix`: The URL rule prefix to include, such as "/api/".
+
+        .. versionadded:: 2.1.0
+        """
+        self._include_prefixes.add(prefix)
+        self._invalidate()
 
     def _modify_blueprint(self, blueprint, include_type):
         """
@@ -256,6 +569,16 @@ class TrackUsage(object):
             else:
                 raise NotImplementedError(
                     'You must set include or exclude type for the blueprint.')
+        # Also match by endpoint name so views added to the blueprint later
+        # are covered
+        if include_type.lower() == 'include':
+            self._include_endpoints.add(blueprint.name + '.')
+        elif include_type.lower() == 'exclude':
+            self._exclude_endpoints.add(blueprint.name + '.')
+        else:
+            raise NotImplementedError(
+                'You must set include or exclude type for the blueprint.')
+        self._invalidate()
         return blueprint
 
     def include_blueprint(self, blueprint):
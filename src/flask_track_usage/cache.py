@@ -0,0 +1,113 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Small in-process caches.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache with an optional time to live.
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `maxsize`: Maximum amount of items kept.
+           - `ttl`: Seconds an item is kept. None keeps items until they
+             are the least recently used.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value or `default` when missing or expired.
+
+        :Parameters:
+           - `key`: Key of the item.
+           - `default`: Value returned when the key is not cached.
+        """
+        with self._lock:
+            try:
+                value, expires = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+            # Reinsert to mark as most recently used
+            self._items[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Caches a value evicting the least recently used item when full.
+
+        :Parameters:
+           - `key`: Key of the item.
+           - `value`: Value to cache.
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every item.
+        """
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,268 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Background dispatching of usage data to storages.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from six.moves import queue
+
+
+log = logging.getLogger(__name__)
+
+# Placed on the queue once per worker to tell it to exit
+_STOP = object()
+
+# Serializes starting threads; replaced in forked children where it may
+# have been copied while held
+_start_lock = threading.Lock()
+
+
+def _reset_start_lock():
+    global _start_lock
+    _start_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_start_lock)
+
+
+class ProcessThreads(object):
+    """
+    Base for objects running background threads. Threads do not survive a
+    fork, so they are started on first use in every process. Objects
+    created before a server forks its workers, such as uWSGI by default
+    or gunicorn with --preload, then get threads of their own in each
+    worker.
+
+    .. versionadded:: 2.1.0
+    """
+
+    _pid = None
+
+    def _start(self):
+        """
+        Creates the locks, queues and threads of the current process.
+        Must be overridden.
+        """
+        raise NotImplementedError('_start must be overridden')
+
+    def _started(self):
+        """
+        Checks if the threads were started in the current process.
+        """
+        return self._pid == os.getpid()
+
+    def _ensure_started(self):
+        """
+        Starts the threads unless they were started in this process.
+        """
+        if not self._started():
+            with _start_lock:
+                if not self._started():
+                    self._start()
+                    self._pid = os.getpid()
+
+
+class BackgroundDispatcher(ProcessThreads):
+    """
+    Hands usage data off to a pool of worker threads so that storages are
+    called outside of the request/response cycle.
+
+    .. versionadded:: 2.1.0
+    """
+
+    #: Valid values for the `overflow` policy.
+    OVERFLOW_POLICIES = ('drop', 'block', 'spill')
+
+    def __init__(self, handler, queue_size=1000, workers=1,
+                 overflow='drop', block_timeout=None):
+        """
+        Create the instance. The worker threads start with the first
+        dispatched item of every process.
+
+        :Parameters:
+           - `handler`: Callable invoked with each queued data item.
+           - `queue_size`: Maximum amount of items waiting in the queue.
+           - `workers`: Amount of worker threads draining the queue.
+           - `overflow`: What to do when the queue is full. *drop* discards
+             the item, *block* waits for room in the queue and *spill*
+             calls the handler in the caller's thread.
+           - `block_timeout`: Seconds to wait for room when `overflow` is
+             *block*. The item is dropped once exceeded. None waits forever.
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                'overflow must be one of: {}'.format(
+                    ', '.join(self.OVERFLOW_POLICIES)))
+        self._handler = handler
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+        self._queue_size = queue_size
+        self._worker_count = max(1, workers)
+        atexit.register(self.shutdown)
+
+    def _start(self):
+        """
+        Creates the queue and starts the worker threads.
+        """
+        self._queue = queue.Queue(maxsize=self._queue_size)
+        self._lock = threading.Lock()
+        # Guards _running and counts the callers queueing an item so that
+        # shutdown queues _STOP behind them
+        self._state = threading.Condition(threading.Lock())
+        self._producers = 0
+        self._running = True
+        self.counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'failed': 0,
+            'processed': 0,
+        }
+        self._workers = []
+        for i in range(self._worker_count):
+            worker = threading.Thread(
+                target=self._work, name='flask-track-usage-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _count(self, name):
+        """
+        Increments one of the counters.
+
+        :Parameters:
+           - `name`: Name of the counter.
+        """
+        with self._lock:
+            self.counters[name] += 1
+
+    def _run(self, data):
+        """
+        Calls the handler making sure a failure does not escape.
+
+        :Parameters:
+           - `data`: Data to pass to the handler.
+        """
+        try:
+            self._handler(data)
+        except Exception:
+            self._count('failed')
+            log.exception('Unable to store usage data')
+        else:
+            self._count('processed')
+
+    def _work(self):
+        """
+        Worker thread loop.
+        """
+        while True:
+            data = self._queue.get()
+            try:
+                if data is _STOP:
+                    return
+                self._run(data)
+            finally:
+                self._queue.task_done()
+
+    def dispatch(self, data):
+        """
+        Queues data for the workers applying the overflow policy when
+        the queue is full.
+
+        :Parameters:
+           - `data`: Data to queue.
+        """
+        self._ensure_started()
+        with self._state:
+            running = self._running
+            if running:
+                self._producers += 1
+        if not running:
+            # Nothing is draining the queue any longer
+            self._count('spilled')
+            self._run(data)
+            return
+        try:
+            if self._overflow == 'block':
+                self._queue.put(data, timeout=self._block_timeout)
+            else:
+                self._queue.put_nowait(data)
+        except queue.Full:
+            if self._overflow == 'spill':
+                self._count('spilled')
+                self._run(data)
+            else:
+                self._count('dropped')
+            return
+        finally:
+            with self._state:
+                self._producers -= 1
+                if not self._producers:
+                    self._state.notify_all()
+        self._count('enqueued')
+
+    def stats(self):
+        """
+        Returns a copy of the counters along with the current queue size.
+        """
+        self._ensure_started()
+        with self._lock:
+            result = dict(self.counters)
+        result['queued'] = self._queue.qsize()
+        return result
+
+    def shutdown(self, timeout=None):
+        """
+        Stops accepting new work and waits for the queue to drain.
+
+        :Parameters:
+           - `timeout`: Seconds to wait for each worker. None waits forever.
+        """
+        if not self._started():
+            # Nothing was dispatched in this process
+            return
+        with self._state:
+            if not self._running:
+                return
+            self._running = False
+            # The workers keep draining the queue meanwhile
+            while self._producers:
+                self._state.wait()
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
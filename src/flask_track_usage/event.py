@@ -0,0 +1,190 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+The record of a single tracked request.
+"""
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # pragma: no cover
+    from collections import MutableMapping
+
+from flask_track_usage.useragent import parse_user_agent
+
+
+def _request_line(request, response):
+    return "{} {} {}".format(
+        request.method,
+        request.url,
+        request.environ.get('SERVER_PROTOCOL')
+    )
+
+
+#: Fields computed from the request or response on first access.
+LAZY_FIELDS = {
+    'url': lambda request, response: request.url,
+    'user_agent': lambda request, response: parse_user_agent(request),
+    'blueprint': lambda request, response: request.blueprint,
+    'view_args': lambda request, response: request.view_args,
+    'remote_addr': lambda request, response: request.remote_addr,
+    'xforwardedfor': lambda request, response: request.headers.get(
+        'X-Forwarded-For', None),
+    'authorization': lambda request, response: bool(request.authorization),
+    'path': lambda request, response: request.path,
+    'content_length': lambda request, response: response.content_length,
+    'request': _request_line,
+    'url_args': lambda request, response: dict(
+        [(k, request.args[k]) for k in request.args]),
+}
+
+#: Every field of a usage event in the order of the classic data dict.
+FIELDS = (
+    'url', 'user_agent', 'server_name', 'blueprint', 'view_args', 'status',
+    'remote_addr', 'xforwardedfor', 'authorization', 'ip_info', 'path',
+    'speed', 'date', 'content_length', 'request', 'url_args', 'username',
+    'track_var', 'sample_weight', 'speed_ns', 'timestamp_ns', 'timing',
+)
+
+_FIELD_SET = frozenset(FIELDS)
+
+# Marks a field removed with del
+_DELETED = object()
+
+
+class UsageEvent(MutableMapping):
+    """
+    Dictionary like record of a tracked request. Fields taken from the
+    request or response are computed on first access and kept, so fields
+    no storage reads are never computed. Keys which are not fields, such
+    as those added by storages for their hooks, are kept in a dictionary.
+
+    Use `dict(event)` for a plain dictionary with every field.
+
+    .. versionadded:: 2.1.0
+    """
+
+    __slots__ = ('_request', '_response', '_extra') + FIELDS
+
+    def __init__(self, request, response, **values):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `request`: The request being tracked.
+           - `response`: The response to the request.
+           - `values`: Values of the fields which are not computed lazily.
+        """
+        self._request = request
+        self._response = response
+        self._extra = {}
+        for key, value in values.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            return self._extra[key]
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            if key not in LAZY_FIELDS:
+                raise KeyError(key)
+            if self._request is None:
+                raise KeyError(
+                    '{} was not collected for this event'.format(key))
+            value = LAZY_FIELDS[key](self._request, self._response)
+            setattr(self, key, value)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            self[key]
+            setattr(self, key, _DELETED)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for key in FIELDS:
+            if key in self:
+                yield key
+        for key in self._extra:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key not in _FIELD_SET:
+            return key in self._extra
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            return key in LAZY_FIELDS and self._request is not None
+        return value is not _DELETED
+
+    def __repr__(self):
+        return '<UsageEvent {!r}>'.format(dict(self))
+
+    def select(self, fields):
+        """
+        Returns a dictionary of only some fields and every extra key.
+
+        :Parameters:
+           - `fields`: Names of the fields to include.
+        """
+        selected = dict(self._extra)
+        for key in fields:
+            selected[key] = self[key]
+        return selected
+
+    def detach(self, fields=None):
+        """
+        Computes fields and lets go of the request and response. Fields
+        which were not computed can not be read afterwards.
+
+        :Parameters:
+           - `fields`: Names of the fields to compute. None computes every
+             field.
+        """
+        if self._request is None:
+            return
+        for key in FIELDS if fields is None else fields:
+            if key in LAZY_FIELDS and key in self:
+                self[key]
+        self._request = None
+        self._response = None
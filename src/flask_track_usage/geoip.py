@@ -0,0 +1,261 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Resolvers mapping a remote IP address to geography information.
+
+A resolver is any callable which accepts an IP address string and returns
+a dictionary of information or None. Resolvers raise `ResolveError` when
+the lookup itself failed so that the failure is not cached.
+"""
+
+import json
+import logging
+import mmap
+import socket
+import struct
+
+from six.moves.urllib_parse import quote_plus
+from six.moves.urllib.request import urlopen
+
+from flask_track_usage.cache import LRUCache
+
+
+log = logging.getLogger(__name__)
+
+# Database layout (all integers are unsigned, big endian):
+#
+#   header:  8 byte magic, 4 byte record count
+#   records: 4 byte first address, 4 byte last address,
+#            4 byte payload offset, 4 byte payload length
+#            sorted by first address and not overlapping
+#   payload: UTF-8 JSON documents
+_MAGIC = b'FTUIPDB1'
+_HEADER = struct.Struct('>8sI')
+_RECORD = struct.Struct('>IIII')
+
+_MISSING = object()
+
+
+class ResolveError(Exception):
+    """
+    Raised by a resolver when an address could not be looked up, as
+    opposed to an address without information.
+
+    .. versionadded:: 2.1.0
+    """
+
+
+def _ip_to_int(ip):
+    """
+    Converts a dotted IPv4 address into an integer.
+
+    :Parameters:
+       - `ip`: IPv4 address string.
+    """
+    return struct.unpack('>I', socket.inet_aton(ip))[0]
+
+
+def _network_range(network):
+    """
+    Returns the first and last address of a network in CIDR notation.
+
+    :Parameters:
+       - `network`: Network such as 192.0.2.0/24.
+    """
+    address, _, bits = network.partition('/')
+    bits = int(bits or 32)
+    mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+    first = _ip_to_int(address) & mask
+    return first, first | (~mask & 0xFFFFFFFF)
+
+
+class HTTPResolver(object):
+    """
+    Looks up IP addresses with a RESTful JSON service.
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, endpoint="http://extreme-ip-lookup.com/json/{ip}",
+                 timeout=None):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `endpoint`: URL of the service. "{ip}" is replaced with the
+             address, otherwise the address is appended.
+           - `timeout`: Optional seconds to wait for the service.
+        """
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def __call__(self, ip):
+        clean_ip = quote_plus(str(ip))
+        if '{ip}' in self.endpoint:
+            url = self.endpoint.format(ip=clean_ip)
+        else:
+            url = self.endpoint + clean_ip
+        try:
+            # seperate capture and conversion to aid in debugging
+            if self.timeout is None:
+                text = urlopen(url).read()
+            else:
+                text = urlopen(url, timeout=self.timeout).read()
+            ip_info = json.loads(text)
+        except (IOError, ValueError) as e:
+            raise ResolveError('Unable to look up {}: {}'.format(ip, e))
+        if url.startswith("http://extreme-ip-lookup.com/"):
+            ip_info.pop("businessWebsite", None)
+            ip_info.pop("status", None)
+        return ip_info
+
+
+class CIDRResolver(object):
+    """
+    Looks up IPv4 addresses in a local database of address ranges. The
+    file is memory mapped and searched with a binary search so lookups do
+    not touch the network and the file is never read into memory.
+
+    Create the database with `CIDRResolver.build`.
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, path):
+        """
+        Opens the database.
+
+        :Parameters:
+           - `path`: Path of a file created by `build`.
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError('{} is not an IP range database'.format(path))
+
+    @staticmethod
+    def build(path, networks):
+        """
+        Writes a database file.
+
+        :Parameters:
+           - `path`: Path of the file to write.
+           - `networks`: Iterable of (network, info) pairs where network is
+             a CIDR string such as "192.0.2.0/24" or a (first, last) pair of
+             address strings and info is a JSON serializable dictionary.
+        """
+        ranges = []
+        payloads = {}
+        payload = bytearray()
+        for network, info in networks:
+            if isinstance(network, tuple):
+                first, last = (_ip_to_int(ip) for ip in network)
+            else:
+                first, last = _network_range(network)
+            blob = json.dumps(info, sort_keys=True).encode('utf-8')
+            if blob not in payloads:
+                payloads[blob] = len(payload)
+                payload.extend(blob)
+            ranges.append((first, last, payloads[blob], len(blob)))
+        ranges.sort()
+        for previous, current in zip(ranges, ranges[1:]):
+            if current[0] <= previous[1]:
+                raise ValueError('IP ranges must not overlap')
+
+        base = _HEADER.size + _RECORD.size * len(ranges)
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(ranges)))
+            for first, last, offset, length in ranges:
+                f.write(_RECORD.pack(first, last, base + offset, length))
+            f.write(bytes(payload))
+
+    def __call__(self, ip):
+        try:
+            address = _ip_to_int(ip)
+        except (socket.error, TypeError):
+            # Not an IPv4 address
+            return None
+        low, high = 0, self._count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            first, last, offset, length = _RECORD.unpack_from(
+                self._map, _HEADER.size + middle * _RECORD.size)
+            if address < first:
+                high = middle - 1
+            elif address > last:
+                low = middle + 1
+            else:
+                return json.loads(
+                    self._map[offset:offset + length].decode('utf-8'))
+        return None
+
+    def close(self):
+        """
+        Closes the memory map.
+        """
+        self._map.close()
+
+
+class CachedResolver(object):
+    """
+    Caches the results of another resolver, including addresses without
+    information. Failed lookups are not cached.
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, resolver, maxsize=1024, ttl=3600):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `resolver`: The resolver to cache.
+           - `maxsize`: Maximum amount of addresses kept.
+           - `ttl`: Seconds a result is kept. None keeps results until
+             they are the least recently used.
+        """
+        self.resolver = resolver
+        self.cache = LRUCache(maxsize, ttl)
+
+    def __call__(self, ip):
+        ip_info = self.cache.get(ip, _MISSING)
+        if ip_info is _MISSING:
+            try:
+                ip_info = self.resolver(ip)
+            except ResolveError:
+                log.exception('Unable to look up %s', ip)
+                return None
+            self.cache.set(ip, ip_info)
+        if ip_info is not None:
+            # storages may modify what they are given
+            ip_info = dict(ip_info)
+        return ip_info
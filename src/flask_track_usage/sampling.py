@@ -0,0 +1,137 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Request sampling.
+"""
+
+import random
+
+
+def scale(value, weight):
+    """
+    Scales a count by a sample weight. The fraction is rounded up or down
+    at random so the sum of many scaled counts stays unbiased.
+
+    :Parameters:
+       - `value`: The count to scale.
+       - `weight`: The sample weight of the request.
+
+    .. versionadded:: 2.1.0
+    """
+    scaled = value * weight
+    whole = int(scaled)
+    if random.random() < scaled - whole:
+        whole += 1
+    return whole
+
+
+class Sampler(object):
+    """
+    Decides which requests are stored.
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, rate=1.0, rates=None, keep_errors=True,
+                 keep_slower_than=None):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `rate`: Fraction of requests stored, between 0 and 1.
+           - `rates`: Optional dictionary of rates by endpoint name. Names
+             ending with a "." such as "api." apply to every endpoint of a
+             blueprint.
+           - `keep_errors`: If requests with a status outside of 2xx are
+             always stored.
+           - `keep_slower_than`: Optional seconds after which requests are
+             always stored.
+        """
+        self.rate = rate
+        self.rates = dict(rates or {})
+        self.keep_errors = keep_errors
+        self.keep_slower_than = keep_slower_than
+        for value in [rate] + list(self.rates.values()):
+            if not 0 <= value <= 1:
+                raise ValueError('Sample rates must be between 0 and 1.')
+        self._endpoint_rates = {}
+
+    def endpoint_rate(self, endpoint):
+        """
+        Returns the rate used for an endpoint.
+
+        :Parameters:
+           - `endpoint`: The endpoint name of the request.
+        """
+        try:
+            return self._endpoint_rates[endpoint]
+        except KeyError:
+            pass
+        rate = self.rate
+        if endpoint is not None:
+            if endpoint in self.rates:
+                rate = self.rates[endpoint]
+            else:
+                # The most specific blueprint wins
+                dot = endpoint.rfind('.')
+                while dot != -1:
+                    if endpoint[:dot + 1] in self.rates:
+                        rate = self.rates[endpoint[:dot + 1]]
+                        break
+                    dot = endpoint.rfind('.', 0, dot)
+        # Readers never see a partially updated dictionary
+        rates = dict(self._endpoint_rates)
+        rates[endpoint] = rate
+        self._endpoint_rates = rates
+        return rate
+
+    def weight(self, endpoint, status, speed):
+        """
+        Returns the sample weight of a request or None if it should not be
+        stored. The weight is the amount of requests the stored request
+        stands for.
+
+        :Parameters:
+           - `endpoint`: The endpoint name of the request.
+           - `status`: The response status code.
+           - `speed`: Seconds taken to respond.
+        """
+        if self.keep_errors and not 200 <= status < 300:
+            return 1.0
+        if self.keep_slower_than is not None and \
+                speed >= self.keep_slower_than:
+            return 1.0
+        rate = self.endpoint_rate(endpoint)
+        if rate >= 1:
+            return 1.0
+        if rate > 0 and random.random() < rate:
+            return 1.0 / rate
+        return None
@@ -32,7 +32,54 @@
 Simple storage callables package.
 """
 
+import base64
+import calendar
+import datetime
 import inspect
+import json
+import numbers
+
+from flask_track_usage.event import UsageEvent
+from flask_track_usage.useragent import ParsedUserAgent
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_cursor(date, id):
+    """
+    Returns the opaque cursor of a position in the usage records.
+
+    :Parameters:
+       - `date`: datetime.datetime of the record
+       - `id`: Unique id of the record. Ids which are not numbers are
+         stored as strings.
+
+    .. versionadded:: 2.1.0
+    """
+    if not isinstance(id, numbers.Number):
+        id = str(id)
+    micros = calendar.timegm(date.utctimetuple()) * 10**6 + date.microsecond
+    text = json.dumps([micros, id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (datetime.datetime, id) position of a cursor created by
+    `encode_cursor`. Raises ValueError for invalid cursors.
+
+    :Parameters:
+       - `cursor`: Cursor string
+
+    .. versionadded:: 2.1.0
+    """
+    try:
+        text = base64.urlsafe_b64decode(str(cursor).encode('ascii'))
+        micros, id = json.loads(text.decode('utf-8'))
+        date = _EPOCH + datetime.timedelta(microseconds=micros)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+    return date, id
 
 
 class _BaseWritable(object):
@@ -41,6 +88,13 @@ class _BaseWritable(object):
     Base class for writable callables.
     """
 
+    #: Names of the data fields read by `store`. None means any field may
+    #: be read. When every storage and hook declares its fields the other
+    #: fields are never computed.
+    #:
+    #: .. versionadded:: 2.1.0
+    fields = None
+
     def __init__(self, *args, **kwargs):
         """
         Creates the instance and calls set_up.
@@ -64,6 +118,14 @@ class _BaseWritable(object):
         # call setup for each hook
         for hook in self._post_storage_hooks:
             hook.set_up(**kwargs)
+        # resolve what to call for each hook once instead of per request
+        self._hook_calls = []
+        for hook in self._post_storage_hooks:
+            call = hook
+            if hasattr(hook, 'bind'):
+                call = hook.bind(kwargs["_parent_class_name"])
+            self._hook_calls.append(
+                (call, getattr(hook, 'fields', None)))
         self._temp_hooks = None
 
     def set_up(self, *args, **kwargs):
@@ -89,6 +151,20 @@ class _BaseWritable(object):
         """
         raise NotImplementedError('store must be implemented.')
 
+    def store_many(self, records):
+        """
+        Stores multiple records at once. Can be overridden by storages which
+        support bulk writes. By default `store` is called for each record.
+
+        :Parameters:
+           - `records`: List of data items to store.
+        :Returns:
+           A list with the result of `store` for each record.
+
+        .. versionadded:: 2.1.0
+        """
+        return [self.store(data) for data in records]
+
     def get_sum(
         self,
         hook,
@@ -96,7 +172,8 @@ class _BaseWritable(object):
         end_date=None,
         limit=500,
         page=1,
-        target=None
+        target=None,
+        **kwargs
     ):
         """
         Queries a subtending hook for summarization data. Can be overridden.
@@ -108,10 +185,32 @@ class _BaseWritable(object):
            - `limit`: The max amount of results to return
            - `page`: Result page number limited by `limit` number in a page
            - 'target': search string to limit results; meaning depend on hook
+           - `kwargs`: Storage specific options passed to the hook
 
         .. versionchanged:: 2.0.0
+
+        .. versionchanged:: 2.1.0
+           Finds the hook instead of doing nothing.
         """
-        pass
+        if inspect.isclass(hook):
+            hook_name = hook.__name__
+        else:
+            hook_name = str(hook)
+        for h in self._post_storage_hooks:
+            if h.__class__.__name__ == hook_name:
+                return h.get_sum(
+                    start_date=start_date,
+                    end_date=end_date,
+                    limit=limit,
+                    page=page,
+                    target=target,
+                    _parent_class_name=self.__class__.__name__,
+                    _parent_self=self,
+                    **kwargs
+                )
+        raise NotImplementedError(
+            'Cannot find hook named "{}"'.format(hook_name)
+        )
 
     def __call__(self, data):
         """
@@ -121,10 +220,22 @@ class _BaseWritable(object):
            - `data`: Data to store.
         """
         self.store(data)
+        return self._run_hooks(data)
+
+    def _run_hooks(self, data):
+        """
+        Calls the post storage hooks for data which has been stored.
+
+        :Parameters:
+           - `data`: Data that was stored.
+        """
         data["_parent_class_name"] = self.__class__.__name__
         data['_parent_self'] = self
-        for hook in self._post_storage_hooks:
-            hook(**data)
+        for call, fields in self._hook_calls:
+            if fields is not None and isinstance(data, UsageEvent):
+                call(**data.select(fields))
+            else:
+                call(**data)
         return data
 
 
@@ -135,6 +246,18 @@ class Writer(_BaseWritable):
     pass
 
 
+class UsagePage(list):
+    """
+    List of usage records returned by `Storage.get_usage`.
+
+    .. versionadded:: 2.1.0
+    """
+
+    #: Cursor to pass as *after* to get the next records, or None when
+    #: there are no more records or the storage does not support cursors.
+    next_cursor = None
+
+
 class Storage(_BaseWritable):
     """
     Subclass for a more intellegent storage callable.
@@ -152,7 +275,27 @@ class Storage(_BaseWritable):
         """
         raise NotImplementedError('get_usage must be implemented.')
 
-    def get_usage(self, start_date=None, end_date=None, limit=500, page=1):
+    def _get_usage_after(self, start_date=None, end_date=None, limit=500,
+                         after=None):
+        """
+        Implements usage information by criteria for the records following a
+        position, newest first. Should return a UsagePage with next_cursor
+        set when more records may follow.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `limit`: The max amount of results to return
+           - `after`: (datetime.datetime, id) position of the last record
+             already returned
+
+        .. versionadded:: 2.1.0
+        """
+        raise NotImplementedError(
+            'get_usage with a cursor is not implemented for this Storage.')
+
+    def get_usage(self, start_date=None, end_date=None, limit=500, page=1,
+                  after=None):
         """
         Returns simple usage information by criteria in a standard list form.
 
@@ -161,17 +304,36 @@ class Storage(_BaseWritable):
            If *page* is not incremented you will always receive the
            first *limit* amount of results.
 
+        Deep pages are slow as the skipped records are still read. The
+        ``next_cursor`` of the returned list can instead be passed as
+        *after* to seek directly to the following records::
+
+            usage = storage.get_usage(limit=1000)
+            while usage.next_cursor:
+                usage = storage.get_usage(limit=1000, after=usage.next_cursor)
+
         :Parameters:
            - `start_date`: datetime.datetime representation of starting date
            - `end_date`: datetime.datetime representation of ending date
            - `limit`: The max amount of results to return
            - `page`: Result page number limited by `limit` number in a page
+           - `after`: Cursor from ``next_cursor`` of a previous result.
+             *page* is ignored when given.
 
         .. versionadded:: 1.0.0
            The *page* parameter.
+
+        .. versionchanged:: 2.1.0
+           Returns a UsagePage and accepts *after*.
         """
-        raw_data = self._get_usage(start_date, end_date, limit, page)
-        if type(raw_data) != list:
+        if after is None:
+            raw_data = self._get_usage(start_date, end_date, limit, page)
+        else:
+            if not limit:
+                raise ValueError('after requires a limit')
+            raw_data = self._get_usage_after(
+                start_date, end_date, limit, decode_cursor(after))
+        if not isinstance(raw_data, list):
             raise Exception(
                 'Container returned from _get_usage '
                 'does not conform to the spec.')
@@ -180,4 +342,116 @@ class Storage(_BaseWritable):
                 raise Exception(
                     'An item returned from _get_usage '
                     'does not conform to the spec.')
+        if not isinstance(raw_data, UsagePage):
+            raw_data = UsagePage(raw_data)
         return raw_data
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the usage records stored before a date. Records are deleted
+        *batch_size* at a time so that no long running statement locks the
+        storage. Must be overridden.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which records are
+             deleted
+           - `batch_size`: Amount of records deleted at a time
+           - `downsample`: Optional list of summary hooks, or their names,
+             the records are added to before they are deleted. Only use it
+             for records which were stored without these hooks as they are
+             counted again otherwise.
+
+        :Returns:
+           The amount of deleted records.
+
+        .. versionadded:: 2.1.0
+        """
+        raise NotImplementedError('purge is not implemented for this Storage.')
+
+    def _downsample(self, hooks, items):
+        """
+        Adds usage items to summary hooks. Summaries of values which are
+        not stored with the items, such as the transfer of storages
+        without content_length, are incomplete.
+
+        :Parameters:
+           - `hooks`: List of summary hooks or their names
+           - `items`: Items accepted by `_downsample_data`
+
+        .. versionadded:: 2.1.0
+        """
+        calls = []
+        for hook in hooks:
+            if inspect.isclass(hook):
+                hook_name = hook.__name__
+            else:
+                hook_name = str(hook)
+            for h in self._post_storage_hooks:
+                if h.__class__.__name__ == hook_name:
+                    calls.append(h)
+                    break
+            else:
+                raise NotImplementedError(
+                    'Cannot find hook named "{}"'.format(hook_name))
+        for item in items:
+            data = self._downsample_data(item)
+            data['_parent_class_name'] = self.__class__.__name__
+            data['_parent_self'] = self
+            for call in calls:
+                call(**data)
+
+    def _downsample_data(self, item):
+        """
+        Returns the data summary hooks are called with for an item to
+        downsample. Can be overridden by storages whose summaries need
+        more than the data of a request.
+
+        :Parameters:
+           - `item`: Item in the form returned by `get_usage`
+
+        .. versionadded:: 2.1.0
+        """
+        user_agent = item.get('user_agent') or {}
+        return {
+            'url': item.get('url'),
+            'remote_addr': item.get('remote_addr'),
+            'server_name': item.get('server_name'),
+            'content_length': item.get('content_length') or 0,
+            'user_agent': ParsedUserAgent(
+                user_agent.get('string'),
+                user_agent.get('platform'),
+                user_agent.get('browser'),
+                user_agent.get('version'),
+                user_agent.get('language')),
+            'date': calendar.timegm(item['date'].utctimetuple()),
+            'sample_weight': 1,
+        }
+
+    def iter_usage(self, start_date=None, end_date=None, batch_size=1000):
+        """
+        Generates the usage information by criteria one item at a time,
+        newest first, in the form returned by `get_usage`. Items are read
+        *batch_size* at a time so exports use constant memory. Can be
+        overridden by storages which can stream results.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `batch_size`: Amount of items read per round trip
+
+        .. versionadded:: 2.1.0
+        """
+        usage = self.get_usage(start_date, end_date, batch_size)
+        page = 1
+        while True:
+            for item in usage:
+                yield item
+            if len(usage) < batch_size:
+                return
+            page += 1
+            if usage.next_cursor:
+                usage = self.get_usage(
+                    start_date, end_date, batch_size,
+                    after=usage.next_cursor)
+            else:
+                usage = self.get_usage(start_date, end_date, batch_size, page)
@@ -0,0 +1,212 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Batching wrapper for storages.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from flask_track_usage.dispatch import ProcessThreads
+
+
+log = logging.getLogger(__name__)
+
+
+class BatchStorage(ProcessThreads):
+    """
+    Wraps a storage so that records are collected in memory and written
+    with a single `store_many` call once enough records are waiting or the
+    oldest one is old enough. Post storage hooks are called for every
+    record after the batch is written.
+
+    Any other attribute, such as `get_usage`, is looked up on the wrapped
+    storage. For example: ::
+
+        storage = BatchStorage(SQLStorage(db=db), size=500, max_age=2)
+        t = TrackUsage(app, [storage])
+        storage.get_usage()
+
+    .. versionadded:: 2.1.0
+    """
+
+    def __init__(self, storage, size=100, max_age=1.0):
+        """
+        Create the instance.
+
+        :Parameters:
+           - `storage`: The storage instance to write batches to.
+           - `size`: Amount of records which triggers a write.
+           - `max_age`: Seconds a record may wait before a write is
+             triggered. None only writes by `size` or on `flush`.
+        """
+        self.storage = storage
+        self.size = max(1, size)
+        self.max_age = max_age
+        #: Amount of records which could not be written or whose hooks
+        #: failed
+        self.failed = 0
+        atexit.register(self.close)
+
+    def _start(self):
+        """
+        Creates the batch and starts the background writer.
+        """
+        self._records = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+        if self.max_age is not None:
+            self._flusher = threading.Thread(
+                target=self._flush_aged, name='flask-track-usage-batch')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def __getattr__(self, name):
+        """
+        Looks up anything not found on the wrapper on the storage.
+
+        :Parameters:
+           - `name`: Attribute name.
+        """
+        if name == 'storage':
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def __call__(self, data):
+        """
+        Adds data to the batch, writing the batch if it is due.
+
+        :Parameters:
+           - `data`: Data to store.
+        """
+        self._ensure_started()
+        records = None
+        with self._lock:
+            if not self._records:
+                self._oldest = time.time()
+            self._records.append(data)
+            if len(self._records) >= self.size or self._is_aged():
+                records = self._take()
+        if records:
+            self._write(records)
+        return data
+
+    def _is_aged(self):
+        """
+        Checks if the oldest waiting record has waited long enough.
+        """
+        return (
+            self.max_age is not None and self._records and
+            time.time() - self._oldest >= self.max_age)
+
+    def _take(self):
+        """
+        Removes and returns the waiting records. Must hold the lock.
+        """
+        records = self._records
+        self._records = []
+        self._oldest = None
+        return records
+
+    def _write(self, records):
+        """
+        Writes records to the storage and calls its hooks.
+
+        :Parameters:
+           - `records`: List of data items to write.
+        """
+        if not hasattr(self.storage, 'store_many'):
+            # A plain callable storage
+            for data in records:
+                try:
+                    self.storage(data)
+                except Exception:
+                    self._failed([data])
+            return
+        try:
+            self.storage.store_many(records)
+        except Exception:
+            self._failed(records)
+            return
+        for data in records:
+            try:
+                self.storage._run_hooks(data)
+            except Exception:
+                self._failed(
+                    [data], 'Unable to run the hooks of %d usage records')
+
+    def _failed(self, records, message='Unable to store %d usage records'):
+        """
+        Counts and logs records which could not be written.
+
+        :Parameters:
+           - `records`: List of data items which were not written.
+           - `message`: Log message formatted with the amount of records.
+        """
+        with self._lock:
+            self.failed += len(records)
+        log.exception(message, len(records))
+
+    def _flush_aged(self):
+        """
+        Background loop writing batches which have waited too long.
+        """
+        while not self._stopped.wait(self.max_age):
+            records = None
+            with self._lock:
+                if self._is_aged():
+                    records = self._take()
+            if records:
+                self._write(records)
+
+    def flush(self):
+        """
+        Writes all waiting records.
+        """
+        self._ensure_started()
+        with self._lock:
+            records = self._take()
+        if records:
+            self._write(records)
+
+    def close(self):
+        """
+        Stops the background writer and writes all waiting records.
+        """
+        if not self._started():
+            # Nothing was stored in this process
+            return
+        self._stopped.set()
+        self.flush()
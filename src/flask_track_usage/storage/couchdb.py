@@ -76,15 +76,44 @@ class _CouchDBStorage(Storage):
     Parent storage class for CouchDB storage.
     """
 
+    fields = (
+        'url', 'user_agent', 'blueprint', 'view_args', 'status', 'remote_addr',
+        'authorization', 'ip_info', 'path', 'speed', 'date', 'username',
+        'track_var',
+    )
+
     def store(self, data):
         """
         Executed on "function call".
 
+        :Parameters:
+           - `data`: Data to store.
+        """
+        self._make_document(data).store(self.db)
+
+    def store_many(self, records):
+        """
+        Stores multiple records with a single bulk update.
+
+        :Parameters:
+           - `records`: List of data items to store.
+
+        .. versionadded:: 2.1.0
+        """
+        docs = [self._make_document(data) for data in records]
+        if docs:
+            self.db.update(docs)
+        return records
+
+    def _make_document(self, data):
+        """
+        Creates an unsaved document from data.
+
         :Parameters:
            - `data`: Data to store.
         """
         user_agent = data['user_agent']
-        utcdatetime = datetime.fromtimestamp(data['date'])
+        utcdatetime = datetime.utcfromtimestamp(data['date'])
         usage_data = UsageData(url=data['url'],
                                ua_browser=user_agent.browser,
                                ua_language=user_agent.language,
@@ -102,7 +131,7 @@ class _CouchDBStorage(Storage):
                                username=data["username"],
                                track_var=data["track_var"],
                                datetime=utcdatetime)
-        usage_data.store(self.db)
+        return usage_data
 
     def _get_usage(self, start_date=None, end_date=None, limit=500, page=1):
         """
@@ -120,6 +149,74 @@ class _CouchDBStorage(Storage):
                              limit=limit)
         return [row.value for row in data]
 
+    def iter_usage(self, start_date=None, end_date=None, batch_size=1000):
+        """
+        Generates the usage information by criteria one item at a time,
+        newest first. The date view is read *batch_size* rows at a time.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `batch_size`: Amount of rows read per request
+
+        .. versionadded:: 2.1.0
+        """
+        options = {'descending': True}
+        # keys are in the format of DateTimeField
+        if end_date is not None:
+            options['startkey'] = end_date.replace(
+                microsecond=0).isoformat() + 'Z'
+        if start_date is not None:
+            options['endkey'] = start_date.replace(
+                microsecond=0).isoformat()
+        for row in self.db.iterview(self._by_date(), batch_size, **options):
+            yield row.value
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the documents stored before a date with bulk updates of
+        *batch_size* documents.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which documents are
+             deleted
+           - `batch_size`: Amount of documents deleted per request
+           - `downsample`: Not supported as there are no CouchDB summaries.
+
+        :Returns:
+           The amount of deleted documents.
+
+        .. versionadded:: 2.1.0
+        """
+        if downsample:
+            raise NotImplementedError(
+                'downsample is not supported by this Storage.')
+        view = self._by_date()
+        purged = 0
+        while True:
+            rows = list(self.db.view(
+                view, endkey=older_than.replace(microsecond=0).isoformat(),
+                limit=batch_size))
+            if not rows:
+                break
+            results = self.db.update([
+                {'_id': row.id, '_rev': row.value['_rev'], '_deleted': True}
+                for row in rows])
+            deleted = sum(1 for success, _, _ in results if success)
+            purged += deleted
+            # stop rather than retrying documents which can not be deleted
+            if not deleted or len(rows) < batch_size:
+                break
+        return purged
+
+    def _by_date(self):
+        """
+        Returns the name of the view of the documents by date, creating
+        it if needed.
+        """
+        UsageData.by_date.sync(self.db)
+        return '{}/{}'.format(UsageData.by_date.design, UsageData.by_date.name)
+
 
 class CouchDBStorage(_CouchDBStorage):
     """
@@ -33,9 +33,8 @@ Simple mongodb storage.
 """
 
 import datetime
-import inspect
 
-from flask_track_usage.storage import Storage
+from flask_track_usage.storage import Storage, UsagePage, encode_cursor
 
 
 class _MongoStorage(Storage):
@@ -53,15 +52,38 @@ class _MongoStorage(Storage):
         .. versionchanged:: 1.1.0
            xforwardfor item added directly after remote_addr
         """
+        self.collection.insert_one(self._prepare(data))
+
+    def store_many(self, records):
+        """
+        Stores multiple records with a single bulk insert.
+
+        :Parameters:
+           - `records`: List of data items to store.
+
+        .. versionadded:: 2.1.0
+        """
+        docs = [self._prepare(data) for data in records]
+        if docs:
+            self.collection.insert_many(docs)
+        return records
+
+    def _prepare(self, data):
+        """
+        Converts data into the form stored in the collection.
+
+        :Parameters:
+           - `data`: Data to store.
+        """
         ua_dict = {
             'browser': data['user_agent'].browser,
             'language': data['user_agent'].language,
             'platform': data['user_agent'].platform,
             'version': data['user_agent'].version,
         }
-        data['date'] = datetime.datetime.fromtimestamp(data['date'])
+        data['date'] = datetime.datetime.utcfromtimestamp(data['date'])
         data['user_agent'] = ua_dict
-        print(self.collection.insert(data))
+        return data
 
     def _get_usage(self, start_date=None, end_date=None, limit=500, page=1):
         """
@@ -76,6 +98,126 @@ class _MongoStorage(Storage):
         .. versionchanged:: 1.1.0
            xforwardfor item added directly after remote_addr
         """
+        cursor = self._find(start_date, end_date)
+        if limit:
+            cursor = cursor.skip(limit * (page - 1)).limit(limit)
+        return self._usage_page(cursor, limit)
+
+    def _get_usage_after(self, start_date=None, end_date=None, limit=500,
+                         after=None):
+        """
+        Implements the usage information following a position.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `limit`: The max amount of results to return
+           - `after`: (datetime.datetime, id) of the last document returned
+
+        .. versionadded:: 2.1.0
+        """
+        from bson.objectid import ObjectId
+
+        after_date, after_id = after
+        cursor = self._find(start_date, end_date, {'$or': [
+            {'date': {'$lt': after_date}},
+            {'date': after_date, '_id': {'$gt': ObjectId(after_id)}},
+        ]}).limit(limit)
+        return self._usage_page(cursor, limit)
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the documents stored before a date, *batch_size* documents
+        at a time.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which documents are
+             deleted
+           - `batch_size`: Amount of documents deleted at a time
+           - `downsample`: Optional list of summary hooks, or their names,
+             the documents are added to before they are deleted.
+
+        :Returns:
+           The amount of deleted documents.
+
+        .. versionadded:: 2.1.0
+        """
+        projection = None if downsample else {'_id': 1}
+        purged = 0
+        while True:
+            docs = list(self.collection.find(
+                {'date': {'$lt': older_than}}, projection).sort(
+                    'date', 1).limit(batch_size))
+            if not docs:
+                break
+            if downsample:
+                self._downsample(downsample, docs)
+            purged += self.collection.delete_many(
+                {'_id': {'$in': [doc['_id'] for doc in docs]}}).deleted_count
+            if len(docs) < batch_size:
+                break
+        return purged
+
+    @staticmethod
+    def _create_indexes(collection, ttl=None):
+        """
+        Creates the index used to find documents by date, newest first.
+        With *ttl* a TTL index is also created which makes MongoDB delete
+        documents *ttl* seconds after their date. An existing TTL index
+        of the date is changed to *ttl*.
+
+        :Parameters:
+           - `collection`: pymongo collection of the documents
+           - `ttl`: Optional seconds documents are kept.
+        """
+        collection.create_index([('date', -1), ('_id', 1)])
+        if ttl is None:
+            return
+        # TTL indexes must be single field indexes
+        for name, index in collection.index_information().items():
+            if index['key'] != [('date', 1)]:
+                continue
+            if 'expireAfterSeconds' not in index:
+                # A plain index of the date can not be given a TTL
+                collection.drop_index(name)
+                break
+            if index['expireAfterSeconds'] != ttl:
+                collection.database.command(
+                    'collMod', collection.name,
+                    index={'keyPattern': {'date': 1},
+                           'expireAfterSeconds': ttl})
+            return
+        collection.create_index('date', expireAfterSeconds=ttl)
+
+    def iter_usage(self, start_date=None, end_date=None, batch_size=1000):
+        """
+        Generates the usage information by criteria one item at a time,
+        reading *batch_size* documents per round trip.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `batch_size`: Amount of documents read per round trip
+
+        .. versionadded:: 2.1.0
+        """
+        cursor = self._find(start_date, end_date).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                yield doc
+        finally:
+            cursor.close()
+
+    def _find(self, start_date=None, end_date=None, position=None):
+        """
+        Returns a pymongo cursor of the matching documents, newest first.
+        Documents of the same date are in the order they were stored.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `position`: Optional additional criteria
+        """
         criteria = {}
 
         # Set up date based criteria
@@ -85,14 +227,25 @@ class _MongoStorage(Storage):
                 criteria['date']['$gte'] = start_date
             if end_date:
                 criteria['date']['$lte'] = end_date
+        if position:
+            criteria = {'$and': [criteria, position]}
 
-        cursor = []
-        if limit:
-            cursor = self.collection.find(criteria).skip(
-                limit * (page - 1)).limit(limit)
-        else:
-            cursor = self.collection.find(criteria)
-        return [x for x in cursor]
+        return self.collection.find(criteria).sort(
+            [('date', -1), ('_id', 1)])
+
+    def _usage_page(self, cursor, limit):
+        """
+        Returns the UsagePage of a pymongo cursor.
+
+        :Parameters:
+           - `cursor`: pymongo cursor
+           - `limit`: The max amount of results which were requested
+        """
+        usage_data = UsagePage(cursor)
+        if limit and len(usage_data) == limit:
+            last = usage_data[-1]
+            usage_data.next_cursor = encode_cursor(last['date'], last['_id'])
+        return usage_data
 
 
 class MongoPiggybackStorage(_MongoStorage):
@@ -100,14 +253,19 @@ class MongoPiggybackStorage(_MongoStorage):
     Uses a pymongo collection to store data.
     """
 
-    def set_up(self, collection, hooks=None):
+    def set_up(self, collection, hooks=None, ttl=None):
         """
         Sets the collection.
 
         :Parameters:
            - `collection`: A pymongo collection (not database or connection).
+           - `ttl`: Optional seconds after which MongoDB deletes documents.
+
+        .. versionchanged:: 2.1.0
+           ttl parameter added and the date index is created
         """
         self.collection = collection
+        self._create_indexes(self.collection, ttl)
 
 
 class MongoStorage(_MongoStorage):
@@ -117,7 +275,8 @@ class MongoStorage(_MongoStorage):
 
     def set_up(
             self, database, collection, host='127.0.0.1',
-            port=27017, username=None, password=None, hooks=None):
+            port=27017, username=None, password=None, hooks=None,
+            ttl=None):
         """
         Sets the collection.
 
@@ -128,6 +287,10 @@ class MongoStorage(_MongoStorage):
            - `port`: Port to connect to. Default: 27017
            - `username`: Optional username to authenticate with.
            - `password`: Optional password to authenticate with.
+           - `ttl`: Optional seconds after which MongoDB deletes documents.
+
+        .. versionchanged:: 2.1.0
+           ttl parameter added and the date index is created
         """
         import pymongo
         self.connection = pymongo.MongoClient(host, port)
@@ -135,6 +298,7 @@ class MongoStorage(_MongoStorage):
         if username and password:
             self.db.authenticate(username, password)
         self.collection = getattr(self.db, collection)
+        self._create_indexes(self.collection, ttl)
 
 
 class MongoEngineStorage(_MongoStorage):
@@ -149,7 +313,8 @@ class MongoEngineStorage(_MongoStorage):
     trackerDoc = MongoEngineStorage().collection
     """
 
-    def set_up(self, doc=None, website=None, apache_log=False, hooks=None):
+    def set_up(self, doc=None, website=None, apache_log=False, hooks=None,
+               ttl=None):
         import mongoengine as db
         """
         Sets the general settings.
@@ -161,9 +326,25 @@ class MongoEngineStorage(_MongoStorage):
            - 'apache_log': if set to True, then an attribute called
              'apache_combined_log' is set that mimics a line from a traditional
              apache webserver web log text file.
+           - `ttl`: Optional seconds after which MongoDB deletes documents.
+             Can not be used with `doc`, whose indexes are declared in its
+             own meta.
 
         .. versionchanged:: 2.0.0
+
+        .. versionchanged:: 2.1.0
+           ttl parameter added and the date index is declared
         """
+        if doc is not None and ttl is not None:
+            raise ValueError(
+                'ttl can not be used with doc; declare the index in the '
+                'meta of doc instead')
+        # Created by MongoEngine when the collection is first used so
+        # mongoengine.connect may still be called after the storage is
+        # created
+        indexes = [{'fields': ['-date', 'id']}]
+        if ttl is not None:
+            indexes.append({'fields': ['date'], 'expireAfterSeconds': ttl})
 
         class UserAgent(db.EmbeddedDocument):
             browser = db.StringField()
@@ -196,7 +377,8 @@ class MongoEngineStorage(_MongoStorage):
             track_var = db.DictField()
             apache_combined_log = db.StringField()
             meta = {
-                'collection': "usageTracking"
+                'collection': "usageTracking",
+                'indexes': indexes
             }
 
         self.collection = doc or UsageTracker
@@ -205,8 +387,39 @@ class MongoEngineStorage(_MongoStorage):
         self.apache_log = apache_log
 
     def store(self, data):
+        doc = self._make_document(data)
+        doc.save()
+        data['mongoengine_document'] = doc
+        return data
+
+    def store_many(self, records):
+        """
+        Stores multiple records with a single bulk insert.
+
+        :Parameters:
+           - `records`: List of data items to store.
+
+        .. versionadded:: 2.1.0
+        """
+        docs = [self._make_document(data) for data in records]
+        if docs:
+            # load_bulk=False skips reading the inserted documents back
+            ids = self.collection.objects.insert(docs, load_bulk=False)
+            for doc, pk in zip(docs, ids):
+                doc.pk = pk
+        for data, doc in zip(records, docs):
+            data['mongoengine_document'] = doc
+        return records
+
+    def _make_document(self, data):
+        """
+        Creates an unsaved document from data.
+
+        :Parameters:
+           - `data`: Data to store.
+        """
         doc = self.collection()
-        doc.date = datetime.datetime.fromtimestamp(data['date'])
+        doc.date = datetime.datetime.utcfromtimestamp(data['date'])
         doc.website = self.website
         doc.server_name = data['server_name']
         doc.blueprint = data['blueprint']
@@ -245,9 +458,7 @@ class MongoEngineStorage(_MongoStorage):
                 ua=str(data['user_agent'])
             )
             doc.apache_combined_log = t
-        doc.save()
-        data['mongoengine_document'] = doc
-        return data
+        return doc
 
     def _get_usage(self, start_date=None, end_date=None, limit=500, page=1):
         """
@@ -261,60 +472,125 @@ class MongoEngineStorage(_MongoStorage):
 
         .. versionchanged:: 2.0.0
         """
-        query = {}
-        if start_date:
-            query["date__gte"] = start_date
-        if end_date:
-            query["date__lte"] = end_date
+        logs = self._objects(start_date, end_date)
         if limit:
             first = limit * (page - 1)
             last = limit * page
-            logs = self.collection.objects(
-                **query
-            ).order_by('-date')[first:last]
-        else:
-            logs = self.collection.objects(**query).order_by('-date')
-        result = [log.to_mongo().to_dict() for log in logs]
-        return result
-
-    def get_sum(
-        self,
-        hook,
-        start_date=None,
-        end_date=None,
-        limit=500,
-        page=1,
-        target=None
-    ):
-        """
-        Queries a subtending hook for summarization data.
+            logs = logs[first:last]
+        return self._usage_page(logs, limit)
+
+    def _get_usage_after(self, start_date=None, end_date=None, limit=500,
+                         after=None):
+        """
+        Implements the usage information following a position.
 
         :Parameters:
-           - 'hook': the hook 'class' or it's name as a string
            - `start_date`: datetime.datetime representation of starting date
            - `end_date`: datetime.datetime representation of ending date
            - `limit`: The max amount of results to return
-           - `page`: Result page number limited by `limit` number in a page
-           - 'target': search string to limit results; meaning depend on hook
+           - `after`: (datetime.datetime, id) of the last document returned
 
+        .. versionadded:: 2.1.0
+        """
+        from bson.objectid import ObjectId
+        from mongoengine.queryset.visitor import Q
 
-        .. versionchanged:: 2.0.0
+        after_date, after_id = after
+        logs = self._objects(start_date, end_date).filter(
+            Q(date__lt=after_date) |
+            Q(date=after_date, id__gt=ObjectId(after_id)))
+        return self._usage_page(logs[:limit], limit)
+
+    def iter_usage(self, start_date=None, end_date=None, batch_size=1000):
+        """
+        Generates the usage information by criteria one item at a time,
+        reading *batch_size* documents per round trip. Documents are not
+        cached by the queryset.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `batch_size`: Amount of documents read per round trip
+
+        .. versionadded:: 2.1.0
+        """
+        logs = self._objects(start_date, end_date).no_cache().batch_size(
+            batch_size)
+        for log in logs:
+            yield log.to_mongo().to_dict()
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the documents stored before a date, *batch_size* documents
+        at a time.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which documents are
+             deleted
+           - `batch_size`: Amount of documents deleted at a time
+           - `downsample`: Optional list of summary hooks, or their names,
+             the documents are added to before they are deleted.
+
+        :Returns:
+           The amount of deleted documents.
+
+        .. versionadded:: 2.1.0
+        """
+        purged = 0
+        while True:
+            logs = self.collection.objects(
+                date__lt=older_than).order_by('date').limit(batch_size)
+            if not downsample:
+                logs = logs.only('id')
+            logs = list(logs)
+            if not logs:
+                break
+            if downsample:
+                self._downsample(downsample, logs)
+            purged += self.collection.objects(
+                id__in=[log.id for log in logs]).delete()
+            if len(logs) < batch_size:
+                break
+        return purged
+
+    def _downsample_data(self, log):
+        """
+        Returns the data summary hooks are called with for a document to
+        downsample. The summaries read the document itself.
+
+        :Parameters:
+           - `log`: Document to downsample
+        """
+        data = super(MongoEngineStorage, self)._downsample_data(
+            log.to_mongo().to_dict())
+        data['mongoengine_document'] = log
+        return data
+
+    def _objects(self, start_date=None, end_date=None):
+        """
+        Returns the queryset of the matching documents, newest first.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+        """
+        query = {}
+        if start_date:
+            query["date__gte"] = start_date
+        if end_date:
+            query["date__lte"] = end_date
+        return self.collection.objects(**query).order_by('-date', 'id')
+
+    def _usage_page(self, logs, limit):
+        """
+        Returns the UsagePage of a queryset.
+
+        :Parameters:
+           - `logs`: Queryset of the documents
+           - `limit`: The max amount of results which were requested
         """
-        if inspect.isclass(hook):
-            hook_name = hook.__name__
-        else:
-            hook_name = str(hook)
-        for h in self._post_storage_hooks:
-            if h.__class__.__name__ == hook_name:
-                return h.get_sum(
-                    start_date=start_date,
-                    end_date=end_date,
-                    limit=limit,
-                    page=page,
-                    target=target,
-                    _parent_class_name=self.__class__.__name__,
-                    _parent_self=self
-                )
-        raise NotImplementedError(
-            'Cannot find hook named "{}"'.format(hook_name)
-        )
+        usage_data = UsagePage(log.to_mongo().to_dict() for log in logs)
+        if limit and len(usage_data) == limit:
+            last = usage_data[-1]
+            usage_data.next_cursor = encode_cursor(last['date'], last['_id'])
+        return usage_data
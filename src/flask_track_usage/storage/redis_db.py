@@ -31,27 +31,146 @@
 """
 Simple redis storage.
 """
+import calendar
 import json
 
 from datetime import datetime
-from ast import literal_eval
 from flask_track_usage.storage import Storage
 
+#: Set of every day hash name
+KEYS_SET = "usage_data_keys"
+#: Sorted set of "<day hash>:<field>" members scored by their timestamp
+INDEX_ZSET = "usage_data_index"
+
+# Stores a record under the next field of the day's hash and indexes it by
+# time in a single atomic round trip. HLEN is O(1) and the fields are
+# numbered from 1 without gaps so HLEN + 1 is always the next free field.
+#
+# KEYS[1]: the set of all day hashes
+# KEYS[2]: the day hash
+# KEYS[3]: the time index
+# ARGV[1]: the JSON encoded record
+# ARGV[2]: the timestamp of the record
+# ARGV[3]: when the day hash expires, or an empty string
+# ARGV[4]: the timestamp before which the index only holds expired hashes
+_STORE_SCRIPT = """
+local field = redis.call('HLEN', KEYS[2]) + 1
+redis.call('SADD', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[2], field, ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[2], KEYS[2] .. ':' .. field)
+if ARGV[3] ~= '' then
+    redis.call('EXPIREAT', KEYS[2], ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', '(' .. ARGV[4])
+end
+return field
+"""
+
+_DAY = 24 * 60 * 60
+
+
+def _timestamp(date):
+    """
+    Converts a naive datetime into the score used by the time index.
+
+    :Parameters:
+       - `date`: datetime.datetime to convert.
+    """
+    return calendar.timegm(date.timetuple())
+
+
+def _text(value):
+    """
+    Returns a native string for a value returned by redis.
+
+    :Parameters:
+       - `value`: bytes or string returned by redis.
+    """
+    if not isinstance(value, str):
+        value = value.decode('utf-8')
+    return value
+
 
 class _RedisStorage(Storage):
     """
     Parent storage class for Redis storage.
     """
 
+    fields = (
+        'url', 'user_agent', 'blueprint', 'view_args', 'status', 'remote_addr',
+        'authorization', 'ip_info', 'path', 'speed', 'date', 'username',
+        'track_var',
+    )
+
+    _store_script = None
+    #: Seconds records are kept after the end of their day, or None
+    ttl = None
+
     def store(self, data):
         """
         Executed on "function call".
 
+        :Parameters:
+           - `data`: Data to store.
+
+        .. versionchanged:: 2.1.0
+           Stored with a single atomic round trip.
+        """
+        struct_name, value, score = self._prepare(data)
+        self._script()(
+            keys=[KEYS_SET, struct_name, INDEX_ZSET],
+            args=[value, score] + self._expire_args(score))
+
+    def store_many(self, records):
+        """
+        Stores multiple records with a single pipelined round trip.
+
+        :Parameters:
+           - `records`: List of data items to store.
+
+        .. versionadded:: 2.1.0
+        """
+        script = self._script()
+        pipe = self.db.pipeline(transaction=False)
+        for data in records:
+            struct_name, value, score = self._prepare(data)
+            script(
+                keys=[KEYS_SET, struct_name, INDEX_ZSET],
+                args=[value, score] + self._expire_args(score), client=pipe)
+        pipe.execute()
+        return records
+
+    def _expire_args(self, score):
+        """
+        Returns the arguments of the store script which expire day hashes
+        *ttl* seconds after the end of their day.
+
+        :Parameters:
+           - `score`: Timestamp of the stored record.
+        """
+        if self.ttl is None:
+            return ["", ""]
+        day = score - score % _DAY
+        expired = score - self.ttl
+        return [day + _DAY + self.ttl, expired - expired % _DAY]
+
+    def _script(self):
+        """
+        Returns the registered store script.
+        """
+        if self._store_script is None:
+            self._store_script = self.db.register_script(_STORE_SCRIPT)
+        return self._store_script
+
+    def _prepare(self, data):
+        """
+        Converts data into the name of the day hash, the JSON encoded
+        record stored in it and its timestamp.
+
         :Parameters:
            - `data`: Data to store.
         """
         user_agent = data['user_agent']
-        utcdatetime = datetime.fromtimestamp(data['date'])
+        utcdatetime = datetime.utcfromtimestamp(data['date'])
         d = {
             'url': data['url'],
             'ua_browser': user_agent.browser or "",
@@ -70,13 +189,12 @@ class _RedisStorage(Storage):
             'track_var': data["track_var"] or "",
             'datetime': str(utcdatetime) or ""
         }
-        struct_name = self._construct_struct_name(utcdatetime)
-        # create a set which will be used as an index, in order not to use
+        # the set of day hashes is used as an index, in order not to use
         # redis> keys <pattern>
-        # Always try to add to avoid a network call
-        self.db.sadd("usage_data_keys", struct_name)
-        previous = len(self.db.hkeys(struct_name))
-        self.db.hset(struct_name, previous + 1, json.dumps(d))
+        return (
+            self._construct_struct_name(utcdatetime),
+            json.dumps(d),
+            _timestamp(utcdatetime))
 
     def _get_usage(self, start_date=None, end_date=None, limit=500, page=1):
         """
@@ -87,6 +205,38 @@ class _RedisStorage(Storage):
            - `end_date`: datetime.datetime representation of ending date
            - `limit`: The max amount of results to return
            - `page`: Result page number limited by `limit` number in a page
+
+        .. versionchanged:: 2.1.0
+           Records are returned newest first using the time index and
+           fetched in a single pipelined round trip. Data stored before
+           2.1.0 is only found after running `reindex`.
+        """
+        if not self.db.exists(INDEX_ZSET):
+            return self._get_usage_unindexed(start_date, end_date, limit)
+        low = _timestamp(start_date) if start_date else "-inf"
+        high = _timestamp(end_date) if end_date else "+inf"
+        if limit:
+            members = self.db.zrevrangebyscore(
+                INDEX_ZSET, high, low,
+                start=limit * (max(1, page) - 1), num=limit)
+        else:
+            members = self.db.zrevrangebyscore(INDEX_ZSET, high, low)
+
+        pipe = self.db.pipeline(transaction=False)
+        for member in members:
+            struct_name, field = _text(member).rsplit(":", 1)
+            pipe.hget(struct_name, field)
+        return self._decode(pipe.execute())
+
+    def _get_usage_unindexed(self, start_date=None, end_date=None, limit=500):
+        """
+        Finds records by scanning the day hashes. Used when no time index
+        exists.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `limit`: The max amount of results to return
         """
         struct_name_start = self._construct_struct_name(
             start_date or datetime.now())
@@ -96,20 +246,111 @@ class _RedisStorage(Storage):
         # make a pattern that looks like usage_data:20160*
         stop = self._pattern_stop(struct_name_start, struct_name_end)
         pattern = self._pattern(struct_name_start, stop)
-        (response, keys) = self.db.sscan("usage_data_keys", 0, pattern,
-                                         count=limit)
+        (response, keys) = self.db.sscan(KEYS_SET, 0, pattern, count=limit)
+
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        values = []
+        for d in pipe.execute():
+            values.extend(d.values())
+        return self._decode(values)
 
-        data = [self.db.hgetall(key) for key in keys]
-        # TODO: pipeline data request
+    @staticmethod
+    def _decode(values):
+        """
+        Decodes JSON encoded records skipping any which can not be decoded.
+
+        :Parameters:
+           - `values`: List of JSON encoded records.
+        """
         items = []
-        for d in data:
-            for item in list(d.values()):
+        for value in values:
+            if value is None:
+                continue
+            try:
+                items.append(json.loads(_text(value)))
+            except ValueError:
+                continue
+        return items
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the records of the days before the day of a date. Records
+        are deleted *batch_size* at a time. Days are only deleted as a
+        whole as new records are numbered by the size of their day hash.
+
+        :Parameters:
+           - `older_than`: datetime.datetime whose day and later days are
+             kept
+           - `batch_size`: Amount of records deleted per round trip
+           - `downsample`: Not supported as there are no Redis summaries.
+
+        :Returns:
+           The amount of deleted records.
+
+        .. versionadded:: 2.1.0
+        """
+        if downsample:
+            raise NotImplementedError(
+                'downsample is not supported by this Storage.')
+        cutoff = datetime(older_than.year, older_than.month, older_than.day)
+        high = "({}".format(_timestamp(cutoff))
+        purged = 0
+        while True:
+            members = self.db.zrangebyscore(
+                INDEX_ZSET, "-inf", high, start=0, num=batch_size)
+            if not members:
+                break
+            pipe = self.db.pipeline(transaction=False)
+            for member in members:
+                struct_name, field = _text(member).rsplit(":", 1)
+                pipe.hdel(struct_name, field)
+            pipe.zrem(INDEX_ZSET, *members)
+            purged += sum(pipe.execute()[:-1])
+        # day hashes are named so that older days sort first
+        last = self._construct_struct_name(cutoff)
+        for struct_name in list(self.db.sscan_iter(KEYS_SET)):
+            struct_name = _text(struct_name)
+            if struct_name >= last:
+                continue
+            # records which were never indexed
+            while True:
+                _, values = self.db.hscan(struct_name, 0, count=batch_size)
+                if not values:
+                    break
+                purged += self.db.hdel(struct_name, *values)
+            self.db.srem(KEYS_SET, struct_name)
+        return purged
+
+    def reindex(self, batch_size=1000):
+        """
+        Adds records stored before 2.1.0 to the time index used by
+        `get_usage`.
+
+        :Parameters:
+           - `batch_size`: Amount of records read and indexed per round trip.
+
+        .. versionadded:: 2.1.0
+        """
+        for struct_name in self.db.sscan_iter(KEYS_SET):
+            struct_name = _text(struct_name)
+            scores = {}
+            for field, value in self.db.hscan_iter(
+                    struct_name, count=batch_size):
                 try:
-                    # skip items when errors occur
-                    items.append(literal_eval(item))
-                except:
+                    date = datetime.strptime(
+                        json.loads(_text(value))['datetime'][:19],
+                        "%Y-%m-%d %H:%M:%S")
+                except (ValueError, KeyError):
                     continue
-        return items
+                member = "{}:{}".format(struct_name, _text(field))
+                scores[member] = _timestamp(date)
+                if len(scores) >= batch_size:
+                    self.db.zadd(INDEX_ZSET, scores)
+                    scores = {}
+            if scores:
+                self.db.zadd(INDEX_ZSET, scores)
 
     @staticmethod
     def _construct_struct_name(date):
@@ -155,7 +396,8 @@ class RedisStorage(_RedisStorage):
     .. versionadded:: 1.1.1
     """
 
-    def set_up(self, host='127.0.0.1', port=6379, password=None, url=None):
+    def set_up(self, host='127.0.0.1', port=6379, password=None, url=None,
+               ttl=None):
         """
         Sets up redis and checks that you have connected to it.
 
@@ -163,7 +405,13 @@ class RedisStorage(_RedisStorage):
            - `host`: Host to conenct to. Default: 127.0.0.1
            - `port`: Port to connect to. Default: 27017
            - `password`: Optional password to authenticate with.
+           - `ttl`: Optional seconds after the end of their day after which
+             Redis deletes the records of a day.
+
+        .. versionchanged:: 2.1.0
+           ttl parameter added
         """
+        self.ttl = ttl
         from redis import Redis
         if url:
             self.db = Redis.from_url(url)
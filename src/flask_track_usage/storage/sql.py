@@ -32,9 +32,62 @@
 SQL storage based on SQLAlchemy
 """
 
-from . import Storage
+from . import Storage, UsagePage, encode_cursor
+from flask_track_usage.cache import LRUCache
 import json
 import datetime
+import re
+from collections import OrderedDict
+
+import six
+
+#: Periods the usage table can be partitioned by
+PARTITIONS = ('month', 'day')
+
+#: Columns whose values a normalized usage table stores in dimension tables
+#: by the length of the values
+DIMENSIONS = {
+    'url': 128,
+    'ua_browser': 16,
+    'ua_language': 16,
+    'ua_platform': 16,
+    'ua_version': 16,
+    'blueprint': 16,
+    'remote_addr': 24,
+    'path': 128,
+}
+
+#: Amount of ids of each dimension kept in memory
+DIMENSION_CACHE_SIZE = 4096
+
+
+def _period_start(date, partition):
+    """
+    Returns the start of the partition period containing a date.
+
+    :Parameters:
+       - `date`: datetime.datetime in the period
+       - `partition`: Either month or day
+    """
+    start = datetime.datetime(date.year, date.month, date.day)
+    if partition == 'month':
+        start = start.replace(day=1)
+    return start
+
+
+def _period_end(start, partition):
+    """
+    Returns the start of the partition period following another.
+
+    :Parameters:
+       - `start`: datetime.datetime start of a period
+       - `partition`: Either month or day
+    """
+    if partition == 'day':
+        return start + datetime.timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
 
 
 class SQLStorage(Storage):
@@ -53,8 +106,15 @@ class SQLStorage(Storage):
        A SQLAlchemy metadata instance can optionally be passed in.
     """
 
+    fields = (
+        'url', 'user_agent', 'blueprint', 'view_args', 'status', 'remote_addr',
+        'xforwardedfor', 'authorization', 'ip_info', 'path', 'speed', 'date',
+        'username', 'track_var',
+    )
+
     def set_up(self, engine=None, metadata=None, table_name="flask_usage",
-               db=None, hooks=None):
+               db=None, hooks=None, ingest="insert", summary_interval=0,
+               partition=None, normalize=False, indexes=()):
         """
         Sets the SQLAlchemy database. There are two ways to initialize the
         SQLStorage: 1) by passing the SQLAlchemy `engine` and `metadata`
@@ -70,12 +130,38 @@ class SQLStorage(Storage):
            - `db`: Instead of providing the engine, one can optionally
                    provide the Flask-SQLAlchemy's SQLALchemy object created as
                    SQLAlchemy(app).
+           - `ingest`: How `store_many` writes rows. `insert` uses a single \
+                       executemany insert. `copy` streams the rows with \
+                       PostgreSQL's COPY FROM STDIN when the psycopg2 \
+                       driver is used and falls back to `insert` otherwise.
+           - `summary_interval`: When set, summary hooks collect their \
+                                 counts in memory and write the merged \
+                                 counts every `summary_interval` seconds \
+                                 instead of on every request.
+           - `partition`: Either `month` or `day` to store the rows of each \
+                          period in their own table, such as \
+                          `flask_usage_2018_03`. PostgreSQL creates the \
+                          table with native range partitioning, other \
+                          databases get one table per period next to \
+                          `table_name`. Defaults to a single table.
+           - `normalize`: If True a new usage table stores the values of \
+                          the url, path, user agent, blueprint and \
+                          remote_addr columns once in dimension tables \
+                          such as `flask_usage_dim_url` and refers to \
+                          them by id.
+           - `indexes`: Columns such as `path` or `status` which a new \
+                        usage table gets an index of together with \
+                        `datetime`, for queries of a path or status over \
+                        time. `datetime` is always indexed.
 
         .. versionchanged:: 1.1.0
            xforwardfor column added directly after remote_addr
         .. versionchanged:: 2.0.0
            table is created if it does not already exist
            added summary tables
+        .. versionchanged:: 2.1.0
+           ingest, summary_interval, partition, normalize and indexes
+           parameters added. New tables get an index of datetime.
         """
 
         import sqlalchemy as sql
@@ -87,37 +173,136 @@ class SQLStorage(Storage):
                 raise ValueError("Both db and engine args cannot be None")
             self._eng = engine
             self._metadata = metadata or sql.MetaData()
+        if ingest not in ("insert", "copy"):
+            raise ValueError("ingest must be either insert or copy")
+        if partition is not None and partition not in PARTITIONS:
+            raise ValueError("partition must be one of {}".format(
+                ", ".join(PARTITIONS)))
+        self._use_copy = (
+            ingest == "copy" and
+            self._eng.dialect.name == "postgresql" and
+            self._eng.driver == "psycopg2")
         self.table_name = table_name
+        self.partition = partition
+        self.normalize = normalize
+        self.indexes = tuple(indexes)
         self.sum_tables = {}
+        self.summary_interval = summary_interval
+        self._sum_aggregator = None
         self._con = None
+        # Native partitioning is only used for tables created partitioned
+        self._native_partitions = False
         with self._eng.begin() as self._con:
             if not self._con.dialect.has_table(self._con, table_name):
+                self._native_partitions = (
+                    partition is not None and
+                    self._con.dialect.name == "postgresql")
+                kwargs = {}
+                if self._native_partitions:
+                    kwargs["postgresql_partition_by"] = "RANGE (datetime)"
                 self.track_table = sql.Table(
                     table_name, self._metadata,
-                    sql.Column('id', sql.Integer, primary_key=True),
-                    sql.Column('url', sql.String(128)),
-                    sql.Column('ua_browser', sql.String(16)),
-                    sql.Column('ua_language', sql.String(16)),
-                    sql.Column('ua_platform', sql.String(16)),
-                    sql.Column('ua_version', sql.String(16)),
-                    sql.Column('blueprint', sql.String(16)),
-                    sql.Column('view_args', sql.String(64)),
-                    sql.Column('status', sql.Integer),
-                    sql.Column('remote_addr', sql.String(24)),
-                    sql.Column('xforwardedfor', sql.String(24)),
-                    sql.Column('authorization', sql.Boolean),
-                    sql.Column('ip_info', sql.String(1024)),
-                    sql.Column('path', sql.String(128)),
-                    sql.Column('speed', sql.Float),
-                    sql.Column('datetime', sql.DateTime),
-                    sql.Column('username', sql.String(128)),
-                    sql.Column('track_var', sql.String(128))
-                )
+                    *self._columns() + self._indexes(table_name), **kwargs)
                 # Create the table if it does not exist
                 self.track_table.create(bind=self._eng)
             else:
                 self._metadata.reflect(bind=self._eng)
                 self.track_table = self._metadata.tables[table_name]
+                # the existing layout is kept
+                normalized = 'url_id' in self.track_table.c
+                if normalize and not normalized:
+                    raise ValueError(
+                        "{} exists and is not normalized".format(table_name))
+                self.normalize = normalized
+                if (partition is not None and
+                        self._con.dialect.name == "postgresql"):
+                    self._native_partitions = bool(self._con.execute(
+                        sql.text(
+                            "SELECT 1 FROM pg_partitioned_table p "
+                            "JOIN pg_class c ON c.oid = p.partrelid "
+                            "WHERE c.relname = :name"),
+                        name=table_name).scalar())
+        # Built once and reused for every insert
+        self._insert = self.track_table.insert()
+        self._dimensions = {}
+        self._dimension_ids = {}
+        if self.normalize:
+            for column, length in DIMENSIONS.items():
+                name = "{}_dim_{}".format(table_name, column)
+                dimension = self._metadata.tables.get(name)
+                if dimension is None:
+                    dimension = sql.Table(
+                        name, self._metadata,
+                        sql.Column('id', sql.Integer, primary_key=True),
+                        sql.Column('value', sql.String(length),
+                                   nullable=False, unique=True))
+                dimension.create(bind=self._eng, checkfirst=True)
+                self._dimensions[column] = dimension
+                self._dimension_ids[column] = LRUCache(DIMENSION_CACHE_SIZE)
+        # Partition tables by period start, with their insert statement
+        self._partitions = {}
+        self._partition_pattern = re.compile(
+            re.escape(table_name) + r"_(\d{4})_(\d{2})(?:_(\d{2}))?$")
+
+    def _columns(self):
+        """
+        Returns new columns of a usage table.
+
+        .. versionadded:: 2.1.0
+        """
+        import sqlalchemy as sql
+        columns = [
+            sql.Column('id', sql.Integer, primary_key=True,
+                       autoincrement=True),
+            sql.Column('url', sql.String(128)),
+            sql.Column('ua_browser', sql.String(16)),
+            sql.Column('ua_language', sql.String(16)),
+            sql.Column('ua_platform', sql.String(16)),
+            sql.Column('ua_version', sql.String(16)),
+            sql.Column('blueprint', sql.String(16)),
+            sql.Column('view_args', sql.String(64)),
+            sql.Column('status', sql.Integer),
+            sql.Column('remote_addr', sql.String(24)),
+            sql.Column('xforwardedfor', sql.String(24)),
+            sql.Column('authorization', sql.Boolean),
+            sql.Column('ip_info', sql.String(1024)),
+            sql.Column('path', sql.String(128)),
+            sql.Column('speed', sql.Float),
+            # the partition key must be part of the primary key
+            sql.Column('datetime', sql.DateTime,
+                       primary_key=self._native_partitions),
+            sql.Column('username', sql.String(128)),
+            sql.Column('track_var', sql.String(128))
+        ]
+        if self.normalize:
+            columns = [
+                sql.Column(c.name + '_id', sql.Integer)
+                if c.name in DIMENSIONS else c
+                for c in columns]
+        return columns
+
+    def _indexes(self, name):
+        """
+        Returns the indexes of a new usage table.
+
+        :Parameters:
+           - `name`: Name of the table
+
+        .. versionadded:: 2.1.0
+        """
+        import sqlalchemy as sql
+        # serves the range scans of _get_raw in both directions
+        indexes = [sql.Index('ix_{}_datetime'.format(name), 'datetime')]
+        names = [c.name for c in self._columns()]
+        for column in self.indexes:
+            if self.normalize and column in DIMENSIONS:
+                column += '_id'
+            if column not in names or column == 'datetime':
+                raise ValueError(
+                    "{} can not be indexed with datetime".format(column))
+            indexes.append(sql.Index(
+                'ix_{}_{}_datetime'.format(name, column), column, 'datetime'))
+        return indexes
 
     def store(self, data):
         """
@@ -129,8 +314,388 @@ class SQLStorage(Storage):
         .. versionchanged:: 1.1.0
            xforwardfor column added directly after remote_addr
         """
+        row = self._row(data)
+        if self.normalize:
+            self._intern([row])
+        for table, insert, rows in self._route([row]):
+            with self._eng.begin() as con:
+                con.execute(insert, row)
+        return data
+
+    def store_many(self, records):
+        """
+        Stores multiple records with a single executemany insert.
+
+        :Parameters:
+           - `records`: List of data items to store.
+
+        .. versionadded:: 2.1.0
+        """
+        if not records:
+            return records
+        rows = [self._row(data) for data in records]
+        if self.normalize:
+            self._intern(rows)
+        routes = self._route(rows)
+        with self._eng.begin() as con:
+            for table, insert, table_rows in routes:
+                if self._use_copy:
+                    self._copy(con, table_rows, table)
+                else:
+                    con.execute(insert, table_rows)
+        return records
+
+    def _intern(self, rows):
+        """
+        Replaces the values of dimension columns in rows with their ids.
+        Ids are looked up in memory first so that the database is only
+        queried for values not seen recently.
+
+        :Parameters:
+           - `rows`: List of column value dictionaries.
+
+        .. versionadded:: 2.1.0
+        """
+        for column, cache in self._dimension_ids.items():
+            ids = {}
+            missing = set()
+            for row in rows:
+                value = row[column]
+                if value is not None and value not in ids:
+                    id = cache.get(value)
+                    if id is None:
+                        missing.add(value)
+                    else:
+                        ids[value] = id
+            if missing:
+                ids.update(self._dimension_lookup(column, missing))
+            for row in rows:
+                value = row.pop(column)
+                row[column + '_id'] = None if value is None else ids[value]
+
+    def _dimension_lookup(self, column, values):
+        """
+        Returns the ids of dimension values by value, storing the values
+        which are not yet stored.
+
+        :Parameters:
+           - `column`: Name of the dimension column
+           - `values`: Set of values
+        """
+        import sqlalchemy as sql
+        dimension = self._dimensions[column]
+        ids = {}
+        with self._eng.begin() as con:
+            for value, id in con.execute(
+                    sql.select([dimension.c.value, dimension.c.id]).where(
+                        dimension.c.value.in_(values))):
+                ids[value] = id
+        for value in values - set(ids):
+            try:
+                with self._eng.begin() as con:
+                    ids[value] = con.execute(
+                        dimension.insert(), {'value': value}
+                    ).inserted_primary_key[0]
+            except sql.exc.IntegrityError:
+                # stored concurrently
+                with self._eng.begin() as con:
+                    ids[value] = con.execute(
+                        sql.select([dimension.c.id]).where(
+                            dimension.c.value == value)).scalar()
+        cache = self._dimension_ids[column]
+        for value, id in ids.items():
+            cache.set(value, id)
+        return ids
+
+    def _route(self, rows):
+        """
+        Groups rows by the table they are inserted into, creating missing
+        partitions. Returns a list of (table, insert, rows).
+
+        :Parameters:
+           - `rows`: List of column value dictionaries.
+
+        .. versionadded:: 2.1.0
+        """
+        if self.partition is None:
+            return [(self.track_table, self._insert, rows)]
+        groups = OrderedDict()
+        for row in rows:
+            start = _period_start(row['datetime'], self.partition)
+            groups.setdefault(start, []).append(row)
+        routes = []
+        for start, period_rows in groups.items():
+            try:
+                table, insert = self._partitions[start]
+            except KeyError:
+                table, insert = self._create_partition(start)
+            routes.append((table, insert, period_rows))
+        return routes
+
+    def _partition_table_name(self, start):
+        """
+        Returns the name of the partition of a period.
+
+        :Parameters:
+           - `start`: datetime.datetime start of the period
+        """
+        if self.partition == 'day':
+            return "{}_{:%Y_%m_%d}".format(self.table_name, start)
+        return "{}_{:%Y_%m}".format(self.table_name, start)
+
+    def _partition_table(self, name):
+        """
+        Returns the table object of a partition not natively partitioned.
+
+        :Parameters:
+           - `name`: Name of the partition
+        """
+        import sqlalchemy as sql
+        table = self._metadata.tables.get(name)
+        if table is None:
+            table = sql.Table(
+                name, self._metadata,
+                *self._columns() + self._indexes(name))
+        return table
+
+    def _create_partition(self, start):
+        """
+        Creates the partition of a period if it does not exist and returns
+        the table and insert statement rows of the period are stored with.
+
+        :Parameters:
+           - `start`: datetime.datetime start of the period
+        """
+        import sqlalchemy as sql
+        name = self._partition_table_name(start)
+        if self._native_partitions:
+            with self._eng.begin() as con:
+                preparer = con.dialect.identifier_preparer
+                stmt = (
+                    "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+                    "FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')"
+                ).format(
+                    preparer.quote(name),
+                    preparer.format_table(self.track_table),
+                    start, _period_end(start, self.partition))
+                con.execute(sql.text(stmt))
+            route = (self.track_table, self._insert)
+        else:
+            table = self._partition_table(name)
+            try:
+                with self._eng.begin() as con:
+                    table.create(bind=con, checkfirst=True)
+            except sql.exc.DBAPIError:
+                # created concurrently since it was checked for
+                with self._eng.connect() as con:
+                    if not con.dialect.has_table(con, name):
+                        raise
+            route = (table, table.insert())
+        # copy on write as requests may be routed concurrently
+        partitions = dict(self._partitions)
+        partitions[start] = route
+        self._partitions = partitions
+        return route
+
+    def _partition_starts(self, con):
+        """
+        Returns the existing partitions as a dictionary of names by the
+        start of their period.
+
+        :Parameters:
+           - `con`: Connection to read the table names with
+        """
+        import sqlalchemy as sql
+        if self._native_partitions:
+            names = [row[0] for row in con.execute(
+                sql.text(
+                    "SELECT c.relname FROM pg_inherits i "
+                    "JOIN pg_class c ON c.oid = i.inhrelid "
+                    "JOIN pg_class p ON p.oid = i.inhparent "
+                    "WHERE p.relname = :name"),
+                name=self.table_name)]
+        else:
+            names = con.dialect.get_table_names(con)
+        starts = {}
+        for name in names:
+            match = self._partition_pattern.match(name)
+            if match:
+                year, month, day = match.groups()
+                starts[datetime.datetime(
+                    int(year), int(month), int(day or 1))] = name
+        return starts
+
+    def drop_partitions(self, older_than):
+        """
+        Drops the partitions whose period ended before a date, which
+        removes their rows at once instead of deleting them row by row.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which data is dropped
+
+        :Returns:
+           The names of the dropped tables.
+
+        .. versionadded:: 2.1.0
+        """
+        import sqlalchemy as sql
+        if self.partition is None:
+            raise NotImplementedError(
+                'drop_partitions requires a partitioned SQLStorage')
+        dropped = []
+        with self._eng.begin() as con:
+            preparer = con.dialect.identifier_preparer
+            for start, name in sorted(self._partition_starts(con).items()):
+                if _period_end(start, self.partition) > older_than:
+                    continue
+                if self._native_partitions:
+                    con.execute(sql.text(
+                        "DROP TABLE {}".format(preparer.quote(name))))
+                else:
+                    table = self._partition_table(name)
+                    table.drop(bind=con)
+                    self._metadata.remove(table)
+                dropped.append(name)
+        partitions = dict(self._partitions)
+        for start in list(partitions):
+            if self._partition_table_name(start) in dropped:
+                del partitions[start]
+        self._partitions = partitions
+        return dropped
+
+    def purge(self, older_than, batch_size=1000, downsample=None):
+        """
+        Deletes the rows stored before a date, *batch_size* rows per
+        transaction. Partitions are emptied row by row as well, use
+        `drop_partitions` to remove whole periods at once.
+
+        :Parameters:
+           - `older_than`: datetime.datetime before which rows are deleted
+           - `batch_size`: Amount of rows deleted per transaction
+           - `downsample`: Optional list of summary hooks, or their names,
+             the rows are added to before they are deleted. The transfer
+             is not stored with the rows and is not summarized.
+
+        :Returns:
+           The amount of deleted rows.
+
+        .. versionadded:: 2.1.0
+        """
+        import sqlalchemy as sql
+        purged = 0
+        with self._eng.connect() as con:
+            tables = self._read_tables(
+                con, datetime.datetime(1970, 1, 1), older_than)
+        for _table in tables:
+            if downsample:
+                stmt = self._select_rows(_table)
+            else:
+                stmt = sql.select([_table.c.id])
+            stmt = stmt.where(
+                _table.c.datetime < older_than).order_by(
+                    _table.c.datetime).limit(batch_size)
+            while True:
+                with self._eng.connect() as con:
+                    rows = con.execute(stmt).fetchall()
+                if not rows:
+                    break
+                if downsample:
+                    self._downsample(downsample, self._usage_page(rows, None))
+                with self._eng.begin() as con:
+                    con.execute(_table.delete().where(
+                        _table.c.id.in_([r[0] for r in rows])))
+                purged += len(rows)
+                if len(rows) < batch_size:
+                    break
+        return purged
+
+    def _select_rows(self, _table):
+        """
+        Returns a select statement of the columns of a usage table. The
+        values of normalized columns are joined from their dimension
+        tables so rows always have the same columns.
+
+        :Parameters:
+           - `_table`: Usage table or partition
+
+        .. versionadded:: 2.1.0
+        """
+        import sqlalchemy as sql
+        if not self.normalize:
+            return sql.select([_table])
+        columns = []
+        from_obj = _table
+        for c in _table.columns:
+            dimension = self._dimensions.get(c.name[:-len('_id')])
+            if dimension is None or not c.name.endswith('_id'):
+                columns.append(c)
+                continue
+            from_obj = from_obj.outerjoin(dimension, c == dimension.c.id)
+            columns.append(dimension.c.value.label(c.name[:-len('_id')]))
+        return sql.select(columns).select_from(from_obj)
+
+    def _read_tables(self, con, start_date, end_date):
+        """
+        Returns the tables holding rows between two dates. Partitions
+        outside of the dates are not read.
+
+        :Parameters:
+           - `con`: Connection to read the table names with
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+        """
+        if self.partition is None or self._native_partitions:
+            # PostgreSQL prunes native partitions itself
+            return [self.track_table]
+        # rows stored before partitioning was enabled stay in the table
+        tables = [self.track_table]
+        for start, name in sorted(
+                self._partition_starts(con).items(), reverse=True):
+            if start <= end_date and \
+                    _period_end(start, self.partition) > start_date:
+                tables.append(self._partition_table(name))
+        return tables
+
+    def _copy(self, con, rows, table=None):
+        """
+        Streams rows into the table with PostgreSQL's COPY FROM STDIN.
+
+        :Parameters:
+           - `con`: Connection with an open transaction.
+           - `rows`: List of column value dictionaries.
+           - `table`: Table to copy into. Defaults to the usage table.
+        """
+        columns = sorted(rows[0])
+        buf = six.StringIO()
+        for row in rows:
+            # Every value is quoted so that only None is written as an
+            # unquoted empty field, which COPY reads as NULL
+            buf.write(u",".join(
+                u"" if row[column] is None else
+                u'"' + six.text_type(row[column]).replace(u'"', u'""') + u'"'
+                for column in columns))
+            buf.write(u"\n")
+        buf.seek(0)
+        preparer = con.dialect.identifier_preparer
+        stmt = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            preparer.format_table(
+                self.track_table if table is None else table),
+            ", ".join(preparer.quote(column) for column in columns))
+        cursor = con.connection.cursor()
+        try:
+            cursor.copy_expert(stmt, buf)
+        finally:
+            cursor.close()
+
+    def _row(self, data):
+        """
+        Converts data into the column values of a row.
+
+        :Parameters:
+           - `data`: Data to store.
+        """
         user_agent = data["user_agent"]
-        utcdatetime = datetime.datetime.fromtimestamp(data['date'])
+        utcdatetime = datetime.datetime.utcfromtimestamp(data['date'])
         if data["ip_info"]:
             t = {}
             for key in data["ip_info"]:
@@ -141,30 +706,74 @@ class SQLStorage(Storage):
             ip_info_str = json.dumps(t)
         else:
             ip_info_str = None
-        with self._eng.begin() as con:
-            stmt = self.track_table.insert().values(
-                url=data['url'],
-                ua_browser=user_agent.browser,
-                ua_language=user_agent.language,
-                ua_platform=user_agent.platform,
-                ua_version=user_agent.version,
-                blueprint=data["blueprint"],
-                view_args=json.dumps(
-                    data["view_args"], ensure_ascii=False
-                )[:64],
-                status=data["status"],
-                remote_addr=data["remote_addr"],
-                xforwardedfor=data["xforwardedfor"],
-                authorization=data["authorization"],
-                ip_info=ip_info_str,
-                path=data["path"],
-                speed=data["speed"],
-                datetime=utcdatetime,
-                username=data["username"],
-                track_var=json.dumps(data["track_var"], ensure_ascii=False)
-            )
-            con.execute(stmt)
-        return data
+        return dict(
+            url=data['url'],
+            ua_browser=user_agent.browser,
+            ua_language=user_agent.language,
+            ua_platform=user_agent.platform,
+            ua_version=user_agent.version,
+            blueprint=data["blueprint"],
+            view_args=json.dumps(
+                data["view_args"], ensure_ascii=False
+            )[:64],
+            status=data["status"],
+            remote_addr=data["remote_addr"],
+            xforwardedfor=data["xforwardedfor"],
+            authorization=data["authorization"],
+            ip_info=ip_info_str,
+            path=data["path"],
+            speed=data["speed"],
+            datetime=utcdatetime,
+            username=data["username"],
+            track_var=json.dumps(data["track_var"], ensure_ascii=False)
+        )
+
+    def get_sum(
+        self,
+        hook,
+        start_date=None,
+        end_date=None,
+        limit=500,
+        page=1,
+        target=None,
+        union=False
+    ):
+        """
+        Queries a subtending hook for summarization data. Each period is
+        read with one query using the primary key or, with `target`, the
+        key index of its table.
+
+        :Parameters:
+           - 'hook': the hook 'class' or it's name as a string
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `limit`: The max amount of results to return per period
+           - `page`: Result page number limited by `limit` number in a page
+           - 'target': search string to limit results; meaning depend on hook
+           - `union`: If True all periods are read with a single UNION ALL
+             query instead of one query per period.
+
+        .. versionadded:: 2.1.0
+        """
+        return super(SQLStorage, self).get_sum(
+            hook,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            page=page,
+            target=target,
+            union=union
+        )
+
+    def flush_summaries(self):
+        """
+        Writes the summary counts collected in memory when
+        `summary_interval` is set.
+
+        .. versionadded:: 2.1.0
+        """
+        if self._sum_aggregator is not None:
+            self._sum_aggregator.flush()
 
     def _get_usage(self, start_date=None, end_date=None, limit=500, page=1):
         """
@@ -180,7 +789,34 @@ class SQLStorage(Storage):
            xforwardfor column added directly after remote_addr
         """
         raw_data = self._get_raw(start_date, end_date, limit, page)
-        usage_data = [
+        return self._usage_page(raw_data, limit)
+
+    def _get_usage_after(self, start_date=None, end_date=None, limit=500,
+                         after=None):
+        """
+        Translates the raw data following a position into the proper
+        structure.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `limit`: The max amount of results to return
+           - `after`: (datetime.datetime, id) of the last row returned
+
+        .. versionadded:: 2.1.0
+        """
+        raw_data = self._get_raw(start_date, end_date, limit, after=after)
+        return self._usage_page(raw_data, limit)
+
+    def _usage_page(self, raw_data, limit):
+        """
+        Returns the UsagePage of raw rows.
+
+        :Parameters:
+           - `raw_data`: Rows returned by `_get_raw`
+           - `limit`: The max amount of results which were requested
+        """
+        usage_data = UsagePage(
             {
                 'url': r[1],
                 'user_agent': {
@@ -201,10 +837,14 @@ class SQLStorage(Storage):
                 'date': r[15],
                 'username': r[16],
                 'track_var': r[17] if r[17] != '{}' else None
-            } for r in raw_data]
+            } for r in raw_data)
+        if limit and len(raw_data) == limit:
+            last = raw_data[-1]
+            usage_data.next_cursor = encode_cursor(last[15], last[0])
         return usage_data
 
-    def _get_raw(self, start_date=None, end_date=None, limit=500, page=1):
+    def _get_raw(self, start_date=None, end_date=None, limit=500, page=1,
+                 after=None):
         """
         This is the raw getter from database
 
@@ -213,23 +853,83 @@ class SQLStorage(Storage):
            - `end_date`: datetime.datetime representation of ending date
            - `limit`: The max amount of results to return
            - `page`: Result page number limited by `limit` number in a page
+           - `after`: Optional (datetime.datetime, id) of the last row
+             already returned. Rows are then read from that position
+             instead of skipping *page* rows.
 
         .. versionchanged:: 1.1.0
            xforwardfor column added directly after remote_addr
+
+        .. versionchanged:: 2.1.0
+           The *after* parameter.
         """
-        import sqlalchemy as sql
         page = max(1, page)   # min bound
+        with self._eng.begin() as con:
+            stmt = self._select(con, start_date, end_date, after)
+            if after is None:
+                stmt = stmt.offset(limit * (page - 1))
+            res = con.execute(stmt.limit(limit))
+            result = res.fetchall()
+        return result
+
+    def _select(self, con, start_date=None, end_date=None, after=None):
+        """
+        Returns the select statement of the rows between two dates, newest
+        first. Rows of the same date are in the order they were stored.
+
+        :Parameters:
+           - `con`: Connection the statement is executed with
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `after`: Optional (datetime.datetime, id) of the last row
+             already returned
+        """
+        import sqlalchemy as sql
         if end_date is None:
             end_date = datetime.datetime.utcnow()
         if start_date is None:
             start_date = datetime.datetime(1970, 1, 1)
-        with self._eng.begin() as con:
+        selects = []
+        for _table in self._read_tables(con, start_date, end_date):
+            stmt = self._select_rows(_table).where(
+                _table.c.datetime.between(start_date, end_date))
+            if after is not None:
+                after_date, after_id = after
+                stmt = stmt.where(sql.or_(
+                    _table.c.datetime < after_date,
+                    sql.and_(_table.c.datetime == after_date,
+                             _table.c.id > after_id)))
+            selects.append(stmt)
+        if len(selects) == 1:
+            stmt = selects[0]
             _table = self.track_table
-            stmt = sql.select([self.track_table]).where(
-                _table.c.datetime.between(start_date, end_date)).limit(
-                    limit).offset(
-                    limit * (page - 1)).order_by(
-                        sql.desc(self.track_table.c.datetime))
-            res = con.execute(stmt)
-            result = res.fetchall()
-        return result
+        else:
+            _table = sql.union_all(*selects).alias("usage")
+            stmt = sql.select([_table])
+        return stmt.order_by(sql.desc(_table.c.datetime), _table.c.id)
+
+    def iter_usage(self, start_date=None, end_date=None, batch_size=1000):
+        """
+        Generates the usage information by criteria one item at a time.
+        Rows are streamed with a server side cursor where the database
+        supports it and fetched *batch_size* at a time.
+
+        :Parameters:
+           - `start_date`: datetime.datetime representation of starting date
+           - `end_date`: datetime.datetime representation of ending date
+           - `batch_size`: Amount of rows fetched at a time
+
+        .. versionadded:: 2.1.0
+        """
+        with self._eng.connect() as con:
+            stmt = self._select(con, start_date, end_date)
+            res = con.execution_options(stream_results=True).execute(stmt)
+            try:
+                while True:
+                    rows = res.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for item in self._usage_page(rows, None):
+                        yield item
+            finally:
+                res.close()
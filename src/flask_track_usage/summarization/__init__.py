@@ -1,5 +1,3 @@
-from flask_track_usage.summarization import mongoenginestorage, sqlstorage
-
 """
 Summarization routines.
 
@@ -8,6 +6,42 @@ that search for the correct storage support based on the class information
 passed.
 """
 
+import importlib
+
+#: Modules implementing the summaries by lower case storage class name.
+#: They are only imported once a storage of that class uses a summary.
+BACKENDS = {
+    'mongoenginestorage': 'flask_track_usage.summarization.mongoenginestorage',
+    'sqlstorage': 'flask_track_usage.summarization.sqlstorage',
+}
+
+
+def __getattr__(name):
+    # Python 3.7+ imports the backend modules on attribute access
+    if name in BACKENDS:
+        return importlib.import_module(BACKENDS[name])
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def _backend(parent_class_name):
+    """
+    Returns the module implementing the summaries of a storage class,
+    importing it on first use.
+    """
+    lib_name = parent_class_name.lower()
+    library = globals().get(lib_name)
+    if library is None:
+        try:
+            module_name = BACKENDS[lib_name]
+        except KeyError:
+            raise ImportError(
+                "the {} class does not currently support"
+                " summarization.".format(parent_class_name)
+            )
+        library = importlib.import_module(module_name)
+    return library
+
 
 def _set_up(sum_name, **kwargs):
     method_name = "{}_set_up".format(sum_name)
@@ -15,14 +49,7 @@ def _set_up(sum_name, **kwargs):
         raise NotImplementedError(
             "{} can only be used as a Storage class hook.".format(method_name)
         )
-    try:
-        lib_name = kwargs["_parent_class_name"].lower()
-        library = globals()[lib_name]
-    except KeyError:
-        raise ImportError(
-            "the {} class does not currently support"
-            " summarization.".format(kwargs["_parent_class_name"])
-        )
+    library = _backend(kwargs["_parent_class_name"])
     try:
         method = getattr(library, method_name)
     except AttributeError:
@@ -36,14 +63,7 @@ def _caller(method_name, **kwargs):
         raise NotImplementedError(
             "{} can only be used as a Storage class hook.".format(method_name)
         )
-    try:
-        lib_name = kwargs["_parent_class_name"].lower()
-        library = globals()[lib_name]
-    except KeyError:
-        raise ImportError(
-            "the {} class does not currently support"
-            " summarization.".format(kwargs["_parent_class_name"])
-        )
+    library = _backend(kwargs["_parent_class_name"])
     try:
         method = getattr(library, method_name)
     except AttributeError:
@@ -53,20 +73,34 @@ def _caller(method_name, **kwargs):
     method(**kwargs)
 
 
+def _bind(method_name, **kwargs):
+    """
+    Returns the backend function of a storage class. If the backend does
+    not implement it, the returned function raises NotImplementedError
+    when called, like `_caller` and `_get_sum` do.
+    """
+    library = _backend(kwargs["_parent_class_name"])
+    try:
+        return getattr(library, method_name)
+    except AttributeError:
+        def missing(**kwargs):
+            if method_name.endswith("_get_sum"):
+                raise NotImplementedError(
+                    '{}.get_sum missing for this Storage class.'.format(
+                        method_name[:-len("_get_sum")]))
+            raise NotImplementedError(
+                '{} not implemented for this Storage class.'.format(
+                    method_name))
+        return missing
+
+
 def _get_sum(sum_name, **kwargs):
     method_name = "{}_get_sum".format(sum_name)
     if "_parent_class_name" not in kwargs:
         raise NotImplementedError(
             "{} can only be used as a Storage class hook.".format(method_name)
         )
-    try:
-        lib_name = kwargs["_parent_class_name"].lower()
-        library = globals()[lib_name]
-    except KeyError:
-        raise ImportError(
-            "the {} class does not currently support"
-            " summarization.".format(kwargs["_parent_class_name"])
-        )
+    library = _backend(kwargs["_parent_class_name"])
     try:
         method = getattr(library, method_name)
     except AttributeError:
@@ -78,102 +112,98 @@ def _get_sum(sum_name, **kwargs):
     return method(**kwargs)
 
 
-class sumUrl(object):
+class _SummaryHook(object):
     """
-    Traffic is summarized for each full URL seen.
+    Base class of the summary hooks. The backend functions for the storage
+    class are looked up once in `set_up` and storages call the function
+    returned by `bind` directly.
+
+    .. versionadded:: 2.1.0
     """
+    #: Name used to find the backend functions, such as "sumUrl"
+    name = None
+    fields = None
+
     def __init__(self, *args, **kwargs):
-        pass
+        self._methods = {}
+        self._get_sums = {}
 
     def __call__(self, **kwargs):
-        _caller("sumUrl", **kwargs)
+        try:
+            method = self._methods[kwargs["_parent_class_name"]]
+        except KeyError:
+            # Not set up for this storage class
+            return _caller(self.name, **kwargs)
+        method(**kwargs)
 
     def set_up(self, **kwargs):
         self.init_kwargs = kwargs
-        _set_up("sumUrl", **kwargs)
+        _set_up(self.name, **kwargs)
+        parent_class_name = kwargs["_parent_class_name"]
+        self._methods[parent_class_name] = _bind(self.name, **kwargs)
+        self._get_sums[parent_class_name] = _bind(
+            "{}_get_sum".format(self.name), **kwargs)
         return
 
+    def bind(self, parent_class_name):
+        """
+        Returns the backend function called for each request stored by a
+        storage class.
+
+        :Parameters:
+           - `parent_class_name`: Class name of the storage.
+        """
+        return self._methods.get(parent_class_name, self)
+
     def get_sum(self, **kwargs):
-        return _get_sum("sumUrl", **kwargs)
+        try:
+            method = self._get_sums[kwargs["_parent_class_name"]]
+        except KeyError:
+            return _get_sum(self.name, **kwargs)
+        return method(**kwargs)
 
 
-class sumRemote(object):
+class sumUrl(_SummaryHook):
     """
-    Traffic is summarized for each remote IP address seen by the Flask server.
+    Traffic is summarized for each full URL seen.
     """
-    def __init__(self, *args, **kwargs):
-        pass
-
-    def __call__(self, **kwargs):
-        _caller("sumRemote", **kwargs)
+    name = "sumUrl"
+    fields = ('date', 'content_length', 'sample_weight', 'url')
 
-    def set_up(self, **kwargs):
-        self.init_kwargs = kwargs
-        _set_up("sumRemote", **kwargs)
-        return
 
-    def get_sum(self, **kwargs):
-        return _get_sum("sumRemote", **kwargs)
+class sumRemote(_SummaryHook):
+    """
+    Traffic is summarized for each remote IP address seen by the Flask server.
+    """
+    name = "sumRemote"
+    fields = ('date', 'content_length', 'sample_weight', 'remote_addr')
 
 
-class sumUserAgent(object):
+class sumUserAgent(_SummaryHook):
     """
     Traffic is summarized for each client (aka web browser) seen by the Flask
     server.
     """
-    def __init__(self, *args, **kwargs):
-        pass
+    name = "sumUserAgent"
+    fields = ('date', 'content_length', 'sample_weight', 'user_agent')
 
-    def __call__(self, **kwargs):
-        _caller("sumUserAgent", **kwargs)
 
-    def set_up(self, **kwargs):
-        self.init_kwargs = kwargs
-        _set_up("sumUserAgent", **kwargs)
-        return
-
-    def get_sum(self, **kwargs):
-        return _get_sum("sumUserAgent", **kwargs)
-
-
-class sumLanguage(object):
+class sumLanguage(_SummaryHook):
     """
     Traffic is summarized for each language seen in the requests sent to the
     Flask server.
     """
-    def __init__(self, *args, **kwargs):
-        pass
+    name = "sumLanguage"
+    fields = ('date', 'content_length', 'sample_weight', 'user_agent')
 
-    def __call__(self, **kwargs):
-        _caller("sumLanguage", **kwargs)
 
-    def set_up(self, **kwargs):
-        self.init_kwargs = kwargs
-        _set_up("sumLanguage", **kwargs)
-        return
-
-    def get_sum(self, **kwargs):
-        return _get_sum("sumLanguage", **kwargs)
-
-
-class sumServer(object):
+class sumServer(_SummaryHook):
     """
     Traffic is summarized for all requests sent to the Flask server. This
     metric is mostly useful for diagnosing performance.
     """
-    def __init__(self, *args, **kwargs):
-        pass
-
-    def __call__(self, **kwargs):
-        _caller("sumServer", **kwargs)
-
-    def set_up(self, **kwargs):
-        self.init_kwargs = kwargs
-        _set_up("sumServer", **kwargs)
-        return
-
-    def get_sum(self, **kwargs):
-        return _get_sum("sumServer", **kwargs)
+    name = "sumServer"
+    fields = ('date', 'content_length', 'sample_weight', 'server_name')
 
 # # TBD
 # class sumVisitor(object):
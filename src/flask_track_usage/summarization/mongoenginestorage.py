@@ -1,4 +1,7 @@
 import datetime
+
+from flask_track_usage.sampling import scale
+
 try:
     import mongoengine as db
     MONGOENGINE_MISSING = False
@@ -26,7 +29,7 @@ def trim_times_dict(date):
     return {"hour": h, "day": d, "month": m}
 
 
-def increment(class_dict, src, dest, target_list):
+def increment(class_dict, src, dest, target_list, weight=1):
     times = trim_times_dict(src.date)
     db_args = {}
     if dest:
@@ -34,16 +37,13 @@ def increment(class_dict, src, dest, target_list):
         for key in target_list:
             value = value[key]
         db_args[dest] = value
+    hits = scale(1, weight)
+    transfer = scale(src.content_length or 0, weight)
     for period in ["hour", "day", "month"]:
-        doc = class_dict[period].objects(date=times[period], **db_args).first()
-        if not doc:
-            doc = class_dict[period]()
-            doc.date = times[period]
-            if dest:
-                doc[dest] = value
-        doc.hits += 1
-        doc.transfer += src.content_length
-        doc.save()
+        # a single atomic upsert; concurrent workers can not lose counts
+        class_dict[period].objects(
+            date=times[period], **db_args
+        ).update_one(upsert=True, inc__hits=hits, inc__transfer=transfer)
 
 
 def generic_get_sum(
@@ -136,7 +136,9 @@ else:
             return
         src = kwargs['mongoengine_document']
         #
-        increment(sumUrlClasses, src, "url", ["url"])
+        increment(
+            sumUrlClasses, src, "url", ["url"],
+            kwargs.get("sample_weight", 1))
         return
 
     def sumUrl_get_sum(**kwargs):
@@ -193,7 +195,9 @@ else:
             return
         src = kwargs['mongoengine_document']
         #
-        increment(sumRemoteClasses, src, "remote_addr", ["remote_addr"])
+        increment(
+            sumRemoteClasses, src, "remote_addr", ["remote_addr"],
+            kwargs.get("sample_weight", 1))
         return
 
     def sumRemote_get_sum(**kwargs):
@@ -254,7 +258,8 @@ else:
             sumUserAgentClasses,
             src,
             "user_agent_string",
-            ["user_agent", "string"]
+            ["user_agent", "string"],
+            kwargs.get("sample_weight", 1)
         )
         return
 
@@ -322,7 +327,8 @@ else:
             sumLanguageClasses,
             src,
             "language",
-            ["user_agent", "language"]
+            ["user_agent", "language"],
+            kwargs.get("sample_weight", 1)
         )
         return
 
@@ -380,7 +386,9 @@ else:
             return
         src = kwargs['mongoengine_document']
         #
-        increment(sumServerClasses, src, "server_name", ["server_name"])
+        increment(
+            sumServerClasses, src, "server_name", ["server_name"],
+            kwargs.get("sample_weight", 1))
         return
 
     def sumServer_get_sum(**kwargs):
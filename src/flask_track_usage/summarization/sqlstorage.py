@@ -1,16 +1,36 @@
+import atexit
 import datetime
+import logging
+import threading
+import time
+
+import six
+
+from flask_track_usage.dispatch import ProcessThreads
+from flask_track_usage.sampling import scale
+
 try:
     import sqlalchemy as sql
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    from sqlalchemy.dialects.postgresql import insert as postgresql_insert
     HAS_SQLALCHEMY = True
 except ImportError:
     HAS_SQLALCHEMY = False
 
 try:
-    import psycopg2
-    from sqlalchemy.dialects.postgresql import insert
-    HAS_POSTGRES = True
+    # SQLAlchemy 1.4+
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 except ImportError:
-    HAS_POSTGRES = False
+    sqlite_insert = None
+
+
+log = logging.getLogger(__name__)
+
+#: Length of the key column of the summary tables
+KEY_LENGTH = 128
+
+#: Key stored for empty values; an empty string is never a real value
+EMPTY_KEY = ""
 
 
 def _check_environment(**kwargs):
@@ -19,40 +39,251 @@ def _check_environment(**kwargs):
     return True
 
 
-def _check_postgresql(**kwargs):
-    if not HAS_POSTGRES:
-        return False
-    if kwargs["_parent_self"]._eng.driver != 'psycopg2':
-        return False
-    return True
+def trim_times(unix_timestamp):
+    return trim_times_date(datetime.datetime.utcfromtimestamp(unix_timestamp))
 
 
-def trim_times(unix_timestamp):
-    date = datetime.datetime.fromtimestamp(unix_timestamp)
+def trim_times_date(date):
     hour = date.replace(minute=0, second=0, microsecond=0)
     day = date.replace(hour=0, minute=0, second=0, microsecond=0)
     month = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     return hour, day, month
 
 
-def increment(con, table, dt, data, **values):
-    stmt = insert(table).values(
+def _key(table, dt, values):
+    """
+    Returns the primary key values of a summary row.
+    """
+    row = dict(values, date=dt)
+    return dict((c.name, row.get(c.name)) for c in table.primary_key.columns)
+
+
+def _upsert_postgresql(con, table, dt, hits, transfer, **values):
+    stmt = postgresql_insert(table).values(
         date=dt,
-        hits=1,
-        transfer=data['content_length'],
+        hits=hits,
+        transfer=transfer,
         **values
     ).on_conflict_do_update(
-        index_elements=['date'],
+        index_elements=[c.name for c in table.primary_key.columns],
         set_=dict(
-            hits=table.c.hits + 1,
-            transfer=table.c.transfer + data['content_length']
+            hits=table.c.hits + hits,
+            transfer=table.c.transfer + transfer
         )
     )
     con.execute(stmt)
 
 
+def _upsert_sqlite(con, table, dt, hits, transfer, **values):
+    if con.dialect.dbapi.sqlite_version_info < (3, 24, 0):
+        # ON CONFLICT is not supported
+        return _upsert_generic(con, table, dt, hits, transfer, **values)
+    stmt = sqlite_insert(table).values(
+        date=dt,
+        hits=hits,
+        transfer=transfer,
+        **values
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key.columns],
+        set_=dict(
+            hits=table.c.hits + hits,
+            transfer=table.c.transfer + transfer
+        )
+    )
+    con.execute(stmt)
+
+
+def _upsert_mysql(con, table, dt, hits, transfer, **values):
+    stmt = mysql_insert(table).values(
+        date=dt,
+        hits=hits,
+        transfer=transfer,
+        **values
+    )
+    stmt = stmt.on_duplicate_key_update(
+        hits=table.c.hits + hits,
+        transfer=table.c.transfer + transfer
+    )
+    con.execute(stmt)
+
+
+def _upsert_generic(con, table, dt, hits, transfer, **values):
+    """
+    Adds to an existing row or inserts it. Used by databases without an
+    upsert statement; pass summary_interval to SQLStorage so increments
+    are merged in memory and applied in one transaction.
+    """
+    key = _key(table, dt, values)
+    stmt = table.update().values(
+        hits=table.c.hits + hits,
+        transfer=table.c.transfer + transfer
+    ).where(sql.and_(*[table.c[name] == value
+                       for name, value in key.items()]))
+    if con.execute(stmt).rowcount == 0:
+        try:
+            con.execute(table.insert().values(
+                date=dt,
+                hits=hits,
+                transfer=transfer,
+                **values
+            ))
+        except sql.exc.IntegrityError:
+            # Another writer inserted the row since the update
+            con.execute(stmt)
+
+
+#: Upsert implementation by SQLAlchemy dialect name
+UPSERTS = {
+    'postgresql': _upsert_postgresql,
+    'mysql': _upsert_mysql,
+}
+if sqlite_insert is not None:
+    UPSERTS['sqlite'] = _upsert_sqlite
+
+
+def increment(con, table, dt, hits, transfer, **values):
+    """
+    Adds hits and transfer to a summary row using the upsert statement of
+    the database if it has one.
+    """
+    upsert = UPSERTS.get(con.dialect.name, _upsert_generic)
+    upsert(con, table, dt, hits, transfer, **values)
+
+
+class Aggregator(ProcessThreads):
+    """
+    Collects summary increments in memory and writes the merged deltas for
+    every summary table in a single transaction once `interval` seconds
+    have passed. Every process collects and writes its own deltas.
+    """
+
+    def __init__(self, storage, interval):
+        self.storage = storage
+        self.interval = interval
+        #: Amount of flushes that failed and were retried later
+        self.failed = 0
+        atexit.register(self.close)
+
+    def _start(self):
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically,
+            name='flask-track-usage-summaries')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def add(self, table_name, dt, hits, transfer, **values):
+        self._ensure_started()
+        key = (table_name, dt, tuple(sorted(values.items())))
+        with self._lock:
+            self._add(key, hits, transfer)
+
+    def _add(self, key, hits, transfer):
+        delta = self._deltas.get(key)
+        if delta is None:
+            delta = self._deltas[key] = [0, 0]
+        delta[0] += hits
+        delta[1] += transfer
+
+    def _take(self):
+        with self._lock:
+            deltas = self._deltas
+            self._deltas = {}
+        return deltas
+
+    def _merge(self, deltas):
+        with self._lock:
+            for key, (hits, transfer) in deltas.items():
+                self._add(key, hits, transfer)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            log.exception('Unable to write summary counts')
+
+    def flush(self):
+        if not self._started():
+            # Nothing was collected in this process
+            return
+        deltas = self._take()
+        if not deltas:
+            return
+        x = self.storage
+        try:
+            with x._eng.begin() as con:
+                # A stable order keeps concurrent flushes from deadlocking
+                for (table_name, dt, values), (hits, transfer) in sorted(
+                        deltas.items(), key=lambda item: repr(item[0])):
+                    increment(
+                        con,
+                        x.sum_tables[table_name],
+                        dt,
+                        hits,
+                        transfer,
+                        **dict(values)
+                    )
+        except Exception:
+            # The transaction was rolled back; keep the counts for the
+            # next flush
+            self._merge(deltas)
+            with self._lock:
+                self.failed += 1
+            raise
+
+    def close(self):
+        if not self._started():
+            return
+        self._stopped.set()
+        self._safe_flush()
+
+
+def record(kwargs, base_name, **values):
+    """
+    Adds a hit to the hourly, daily and monthly tables of a summary.
+    """
+    # The key is part of the primary key; it can not be NULL or longer
+    # than the column
+    for name, value in values.items():
+        values[name] = \
+            EMPTY_KEY if value is None else six.text_type(value)[:KEY_LENGTH]
+    hour, day, month = trim_times(kwargs['date'])
+    x = kwargs["_parent_self"]
+    weight = kwargs.get('sample_weight', 1)
+    hits = scale(1, weight)
+    transfer = scale(kwargs['content_length'] or 0, weight)
+    periods = (
+        ("{}_hourly".format(base_name), hour),
+        ("{}_daily".format(base_name), day),
+        ("{}_monthly".format(base_name), month),
+    )
+    if x._sum_aggregator is not None:
+        for table_name, dt in periods:
+            x._sum_aggregator.add(table_name, dt, hits, transfer, **values)
+        return
+    with x._eng.begin() as con:
+        for table_name, dt in periods:
+            increment(
+                con,
+                x.sum_tables[table_name],
+                dt,
+                hits,
+                transfer,
+                **values
+            )
+
+
 def create_tables(table_list, **kwargs):
     self = kwargs["_parent_self"]
+    if self.summary_interval and self._sum_aggregator is None:
+        self._sum_aggregator = Aggregator(self, self.summary_interval)
     with self._eng.begin() as self._con:
         for base_sum_table_name in table_list:
             key_field, _ = base_sum_table_name.split("_")
@@ -60,13 +291,22 @@ def create_tables(table_list, **kwargs):
                 self.table_name, base_sum_table_name
             )
             if not self._con.dialect.has_table(self._con, sum_table_name):
+                # Keyed on (date, key) so time range scans use the primary
+                # key and the index serves lookups of a single key
                 self.sum_tables[base_sum_table_name] = sql.Table(
                     sum_table_name,
                     self._metadata,
-                    sql.Column('date', sql.DateTime, primary_key=True),
-                    sql.Column(key_field, sql.String(128)),
+                    sql.Column('date', sql.DateTime, nullable=False),
+                    sql.Column(
+                        key_field, sql.String(KEY_LENGTH), nullable=False),
                     sql.Column('hits', sql.Integer),
-                    sql.Column('transfer', sql.Integer)
+                    sql.Column('transfer', sql.Integer),
+                    sql.PrimaryKeyConstraint(
+                        'date', key_field,
+                        name='{}_pkey'.format(sum_table_name)),
+                    sql.Index(
+                        'ix_{}_{}_date'.format(sum_table_name, key_field),
+                        key_field, 'date')
                 )
             else:
                 self._metadata.reflect(bind=self._eng)
@@ -74,6 +314,79 @@ def create_tables(table_list, **kwargs):
                     self._metadata.tables[sum_table_name])
 
 
+PERIODS = (("hour", "hourly"), ("day", "daily"), ("month", "monthly"))
+
+
+def _period_select(table, base_name, date, start_date, end_date, limit,
+                   page, target):
+    """
+    Returns the query for the rows of one period of a summary.
+    """
+    key = table.c[base_name]
+    stmt = sql.select([table])
+    if date is not None:
+        stmt = stmt.where(table.c.date == date)
+    else:
+        if start_date:
+            stmt = stmt.where(table.c.date >= start_date)
+        if end_date:
+            stmt = stmt.where(table.c.date <= end_date)
+    if target is not None:
+        stmt = stmt.where(key == target)
+    stmt = stmt.order_by(table.c.date.desc(), key)
+    if limit:
+        stmt = stmt.limit(limit).offset(limit * (page - 1))
+    return stmt
+
+
+def generic_get_sum(
+        base_name,
+        start_date=None,
+        end_date=None,
+        limit=500,
+        page=1,
+        target=None,
+        union=False,
+        _parent_class_name=None,
+        _parent_self=None
+):
+    """
+    Returns the hourly, daily and monthly rows of a summary, newest first.
+    With only `start_date` the rows of the periods containing it are
+    returned, otherwise the rows between `start_date` and `end_date`.
+    With `union` all periods are read in a single round trip.
+    """
+    x = _parent_self
+    dates = dict((period, None) for period, _ in PERIODS)
+    if start_date and not end_date:
+        dates = dict(zip(("hour", "day", "month"), trim_times_date(
+            start_date)))
+    selects = []
+    for period, suffix in PERIODS:
+        table = x.sum_tables["{}_{}".format(base_name, suffix)]
+        selects.append((period, _period_select(
+            table, base_name, dates[period], start_date, end_date, limit,
+            page, target)))
+
+    final = dict((period, []) for period, _ in PERIODS)
+    with x._eng.connect() as con:
+        if not union:
+            for period, stmt in selects:
+                final[period] = [dict(row) for row in con.execute(stmt)]
+            return final
+        # Each select is wrapped so its ORDER BY and LIMIT apply to it alone
+        stmt = sql.union_all(*[
+            sql.select([
+                sql.literal(period).label("period"),
+                stmt.alias("{}_rows".format(period))
+            ]) for period, stmt in selects
+        ]).order_by(sql.desc(sql.column("date")), sql.column(base_name))
+        for row in con.execute(stmt):
+            row = dict(row)
+            final[row.pop("period")].append(row)
+    return final
+
+
 ######################################################
 #
 #   sumURL
@@ -87,6 +400,9 @@ if not HAS_SQLALCHEMY:
 
 else:
 
+    def sumUrl_get_sum(**kwargs):
+        return generic_get_sum("url", **kwargs)
+
     def sumUrl_set_up(*args, **kwargs):
         tables = ["url_hourly", "url_daily", "url_monthly"]
         create_tables(tables, **kwargs)
@@ -94,35 +410,7 @@ else:
     def sumUrl(**kwargs):
         if not _check_environment(**kwargs):
             return
-        if not _check_postgresql(**kwargs):
-            raise NotImplementedError("Only PostgreSQL currently supported")
-            return
-
-        hour, day, month = trim_times(kwargs['date'])
-        x = kwargs["_parent_self"]
-        with x._eng.begin() as con:
-            increment(
-                con,
-                x.sum_tables["url_hourly"],
-                hour,
-                kwargs,
-                url=kwargs['url']
-            )
-            increment(
-                con,
-                x.sum_tables["url_daily"],
-                day,
-                kwargs,
-                url=kwargs['url']
-            )
-            increment(
-                con,
-                x.sum_tables["url_monthly"],
-                month,
-                kwargs,
-                url=kwargs['url']
-            )
-
+        record(kwargs, "url", url=kwargs['url'])
         return
 
 
@@ -139,6 +427,9 @@ if not HAS_SQLALCHEMY:
 
 else:
 
+    def sumRemote_get_sum(**kwargs):
+        return generic_get_sum("remote", **kwargs)
+
     def sumRemote_set_up(*args, **kwargs):
         tables = ["remote_hourly", "remote_daily", "remote_monthly"]
         create_tables(tables, **kwargs)
@@ -146,35 +437,7 @@ else:
     def sumRemote(**kwargs):
         if not _check_environment(**kwargs):
             return
-        if not _check_postgresql(**kwargs):
-            raise NotImplementedError("Only PostgreSQL currently supported")
-            return
-
-        hour, day, month = trim_times(kwargs['date'])
-        x = kwargs["_parent_self"]
-        with x._eng.begin() as con:
-            increment(
-                con,
-                x.sum_tables["remote_hourly"],
-                hour,
-                kwargs,
-                remote=kwargs['remote_addr']
-            )
-            increment(
-                con,
-                x.sum_tables["remote_daily"],
-                day,
-                kwargs,
-                remote=kwargs['remote_addr']
-            )
-            increment(
-                con,
-                x.sum_tables["remote_monthly"],
-                month,
-                kwargs,
-                remote=kwargs['remote_addr']
-            )
-
+        record(kwargs, "remote", remote=kwargs['remote_addr'])
         return
 
 
@@ -191,6 +454,9 @@ if not HAS_SQLALCHEMY:
 
 else:
 
+    def sumUserAgent_get_sum(**kwargs):
+        return generic_get_sum("useragent", **kwargs)
+
     def sumUserAgent_set_up(*args, **kwargs):
         tables = ["useragent_hourly", "useragent_daily", "useragent_monthly"]
         create_tables(tables, **kwargs)
@@ -198,35 +464,8 @@ else:
     def sumUserAgent(**kwargs):
         if not _check_environment(**kwargs):
             return
-        if not _check_postgresql(**kwargs):
-            raise NotImplementedError("Only PostgreSQL currently supported")
-            return
-
-        hour, day, month = trim_times(kwargs['date'])
-        x = kwargs["_parent_self"]
-        with x._eng.begin() as con:
-            increment(
-                con,
-                x.sum_tables["useragent_hourly"],
-                hour,
-                kwargs,
-                useragent=str(kwargs['user_agent'])
-            )
-            increment(
-                con,
-                x.sum_tables["useragent_daily"],
-                day,
-                kwargs,
-                useragent=str(kwargs['user_agent'])
-            )
-            increment(
-                con,
-                x.sum_tables["useragent_monthly"],
-                month,
-                kwargs,
-                useragent=str(kwargs['user_agent'])
-            )
-
+        record(
+            kwargs, "useragent", useragent=str(kwargs['user_agent']))
         return
 
 
@@ -243,6 +482,9 @@ if not HAS_SQLALCHEMY:
 
 else:
 
+    def sumLanguage_get_sum(**kwargs):
+        return generic_get_sum("language", **kwargs)
+
     def sumLanguage_set_up(*args, **kwargs):
         tables = ["language_hourly", "language_daily", "language_monthly"]
         create_tables(tables, **kwargs)
@@ -250,35 +492,8 @@ else:
     def sumLanguage(**kwargs):
         if not _check_environment(**kwargs):
             return
-        if not _check_postgresql(**kwargs):
-            raise NotImplementedError("Only PostgreSQL currently supported")
-            return
-
-        hour, day, month = trim_times(kwargs['date'])
-        x = kwargs["_parent_self"]
-        with x._eng.begin() as con:
-            increment(
-                con,
-                x.sum_tables["language_hourly"],
-                hour,
-                kwargs,
-                language=kwargs['user_agent'].language
-            )
-            increment(
-                con,
-                x.sum_tables["language_daily"],
-                day,
-                kwargs,
-                language=kwargs['user_agent'].language
-            )
-            increment(
-                con,
-                x.sum_tables["language_monthly"],
-                month,
-                kwargs,
-                language=kwargs['user_agent'].language
-            )
-
+        record(
+            kwargs, "language", language=kwargs['user_agent'].language)
         return
 
 ######################################################
@@ -294,6 +509,9 @@ if not HAS_SQLALCHEMY:
 
 else:
 
+    def sumServer_get_sum(**kwargs):
+        return generic_get_sum("server", **kwargs)
+
     def sumServer_set_up(*args, **kwargs):
         tables = ["server_hourly", "server_daily", "server_monthly"]
         create_tables(tables, **kwargs)
@@ -301,33 +519,5 @@ else:
     def sumServer(**kwargs):
         if not _check_environment(**kwargs):
             return
-        if not _check_postgresql(**kwargs):
-            raise NotImplementedError("Only PostgreSQL currently supported")
-            return
-
-        hour, day, month = trim_times(kwargs['date'])
-        x = kwargs["_parent_self"]
-        with x._eng.begin() as con:
-            increment(
-                con,
-                x.sum_tables["server_hourly"],
-                hour,
-                kwargs,
-                server=kwargs["server_name"]
-            )
-            increment(
-                con,
-                x.sum_tables["server_daily"],
-                day,
-                kwargs,
-                server=kwargs["server_name"]
-            )
-            increment(
-                con,
-                x.sum_tables["server_monthly"],
-                month,
-                kwargs,
-                server=kwargs["server_name"]
-            )
-
+        record(kwargs, "server", server=kwargs["server_name"])
         return
@@ -0,0 +1,89 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Cached user agent parsing.
+"""
+
+from collections import namedtuple
+
+from flask_track_usage.cache import LRUCache
+
+#: Parsed user agents by user agent string.
+cache = LRUCache(maxsize=1024)
+
+
+class ParsedUserAgent(namedtuple(
+        'ParsedUserAgent',
+        ['string', 'platform', 'browser', 'version', 'language'])):
+    """
+    Immutable parsed user agent with the attributes of a werkzeug
+    UserAgent. Converts to the user agent string.
+
+    .. versionadded:: 2.1.0
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return self.string
+
+    def __bool__(self):
+        return bool(self.browser)
+
+    __nonzero__ = __bool__
+
+
+def parse_user_agent(request):
+    """
+    Returns the parsed user agent of a request. Parsing is done once per
+    distinct user agent string using the request's user agent class.
+
+    :Parameters:
+       - `request`: The request to parse the user agent of.
+
+    .. versionadded:: 2.1.0
+    """
+    string = request.headers.get('User-Agent', '')
+    parsed = cache.get(string)
+    if parsed is None:
+        user_agent_class = getattr(request, 'user_agent_class', None)
+        if user_agent_class is None:
+            # werkzeug < 2.0
+            user_agent_class = type(request.user_agent)
+        user_agent = user_agent_class(string)
+        parsed = ParsedUserAgent(
+            string,
+            user_agent.platform,
+            user_agent.browser,
+            user_agent.version,
+            user_agent.language)
+        cache.set(string, parsed)
+    return parsed
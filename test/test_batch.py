@@ -0,0 +1,214 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Test batching functionality.
+"""
+
+import os
+import time
+import unittest
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.storage import Writer
+from flask_track_usage.storage.batch import BatchStorage
+
+from . import FlaskTrackUsageTestCase
+
+
+class BulkWriter(Writer):
+    """
+    Writer which remembers every bulk write.
+    """
+
+    def set_up(self, hooks=None):
+        self.batches = []
+
+    def store_many(self, records):
+        self.batches.append(list(records))
+        return records
+
+
+class FailingWriter(BulkWriter):
+    """
+    Writer whose bulk writes fail.
+    """
+
+    def store_many(self, records):
+        raise RuntimeError('Storage is down')
+
+
+class RecordingHook(object):
+    """
+    Hook which remembers every call.
+    """
+
+    def __init__(self, **kwargs):
+        self.calls = []
+
+    def set_up(self, **kwargs):
+        pass
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+class FailingHook(RecordingHook):
+    """
+    Hook which fails every other call, starting with the first.
+    """
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        if len(self.calls) % 2:
+            raise RuntimeError('Hook failed')
+
+
+class TestBatchStorage(FlaskTrackUsageTestCase):
+    """
+    Tests the batching wrapper.
+    """
+
+    def setUp(self):
+        """
+        Set up an app to test with.
+        """
+        FlaskTrackUsageTestCase.setUp(self)
+        self.hook = RecordingHook()
+        self.hooked = self.hook.calls
+        self.writer = BulkWriter(hooks=[self.hook])
+
+    def test_flush_by_size(self):
+        """
+        Verify a batch is written once it is large enough.
+        """
+        storage = BatchStorage(self.writer, size=3, max_age=None)
+        TrackUsage(self.app, storage)
+        for i in range(4):
+            self.client.get('/')
+        assert len(self.writer.batches) == 1
+        assert len(self.writer.batches[0]) == 3
+        assert len(self.hooked) == 3
+        assert self.hooked[0]['_parent_self'] is self.writer
+        storage.flush()
+        assert len(self.writer.batches) == 2
+        assert len(self.writer.batches[1]) == 1
+        assert len(self.hooked) == 4
+
+    def test_flush_by_age(self):
+        """
+        Verify a batch is written once its oldest record is old enough.
+        """
+        storage = BatchStorage(self.writer, size=100, max_age=0.01)
+        TrackUsage(self.app, storage)
+        self.client.get('/')
+        for i in range(100):
+            if self.writer.batches:
+                break
+            time.sleep(0.01)
+        storage.close()
+        assert len(self.writer.batches) == 1
+        assert len(self.writer.batches[0]) == 1
+
+    def test_failed_write(self):
+        """
+        Verify failed writes and hooks are counted without reaching the
+        request or stopping the background writer.
+        """
+        writer = FailingWriter(hooks=[self.hook])
+        storage = BatchStorage(writer, size=2, max_age=0.01)
+        TrackUsage(self.app, storage)
+        for i in range(2):
+            assert self.client.get('/').status_code == 200
+        assert storage.failed == 2
+        self.client.get('/')
+        for i in range(100):
+            if storage.failed == 3:
+                break
+            time.sleep(0.01)
+        assert storage.failed == 3
+        assert storage._flusher.is_alive()
+        storage.close()
+        assert self.hooked == []
+
+        # A failing hook neither keeps the other records from their hooks
+        # nor stops the background writer
+        FlaskTrackUsageTestCase.setUp(self)
+        hook = FailingHook()
+        storage = BatchStorage(BulkWriter(hooks=[hook]), size=2, max_age=0.01)
+        TrackUsage(self.app, storage)
+        for i in range(2):
+            assert self.client.get('/').status_code == 200
+        assert len(hook.calls) == 2
+        assert storage.failed == 1
+        self.client.get('/')
+        for i in range(100):
+            if storage.failed == 2:
+                break
+            time.sleep(0.01)
+        assert storage.failed == 2
+        assert storage._flusher.is_alive()
+        storage.close()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Requires os.fork")
+    def test_fork(self):
+        """
+        Verify batches created before a fork are written by age in the
+        child.
+        """
+        storage = BatchStorage(self.writer, size=100, max_age=0.01)
+        storage({'parent': True})
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                storage({'child': True})
+                for i in range(100):
+                    batch = (self.writer.batches or [[{}]])[-1]
+                    if len(batch) == 1 and batch[0].get('child'):
+                        code = 0
+                        break
+                    time.sleep(0.01)
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        storage.close()
+        assert status == 0
+        assert len(self.writer.batches) == 1
+        assert self.writer.batches[0][0].get('parent')
+
+    def test_attribute_passthrough(self):
+        """
+        Verify unknown attributes come from the wrapped storage.
+        """
+        storage = BatchStorage(self.writer, max_age=None)
+        assert storage.batches is self.writer.batches
+        with self.assertRaises(AttributeError):
+            storage.missing
@@ -33,6 +33,7 @@ Basic data tests.
 """
 
 import datetime
+import time
 
 from flask_track_usage import TrackUsage
 
@@ -71,3 +72,71 @@ class TestData(FlaskTrackUsageTestCase):
         self.assertTrue(result['user_agent'].string.startswith('werkzeug'))
         self.assertEqual(type(result['date']), int)
         self.assertTrue(datetime.datetime.fromtimestamp(result['date']))
+        self.assertEqual(type(result['speed_ns']), int)
+        self.assertEqual(result['timestamp_ns'] // 1000000000, result['date'])
+        self.assertIsNone(result['timing'])
+
+    def test_speed_in_app_context(self):
+        """
+        Test that requests sharing an app context are timed on their own.
+        """
+        with self.app.app_context():
+            self.client.get('/')
+            time.sleep(0.2)
+            self.client.get('/')
+        self.assertLess(self.storage.get()['speed'], 0.2)
+        self.storage.get()
+
+
+class TestEarlyResponse(FlaskTrackUsageTestCase):
+    """
+    Tests requests ended early by a before_request function.
+    """
+
+    def test_before_request_response(self):
+        """
+        Test that a request ended before tracking started is stored.
+        """
+        app = self.app
+        storage = TestStorage()
+
+        @app.before_request
+        def maintenance():
+            return "Maintenance", 503
+
+        TrackUsage(app, storage)
+        response = app.test_client().get('/')
+        self.assertEqual(response.status_code, 503)
+        result = storage.get()
+        self.assertEqual(result['status'], 503)
+        self.assertEqual(result['track_var'], {})
+
+
+class TestTimingPhases(FlaskTrackUsageTestCase):
+    """
+    Tests the optional timing phases.
+    """
+
+    def test_phases(self):
+        """
+        Test that every phase is measured.
+        """
+        self.app.config['TRACK_USAGE_TIMING_PHASES'] = True
+        storage = TestStorage()
+        TrackUsage(self.app, storage)
+        self.client.get('/')
+        timing = storage.get()['timing']
+        for phase in ('before_request', 'view', 'after_request', 'storage'):
+            self.assertGreaterEqual(timing[phase], 0)
+
+    def test_fake_time(self):
+        """
+        Test that the fake time is treated as UTC.
+        """
+        fake_time = datetime.datetime(2018, 4, 15, 8, 45, 12)
+        storage = TestStorage()
+        TrackUsage(self.app, storage, _fake_time=fake_time)
+        self.client.get('/')
+        self.assertEqual(
+            datetime.datetime.utcfromtimestamp(storage.get()['date']),
+            fake_time)
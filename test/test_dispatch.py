@@ -0,0 +1,217 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Test background dispatch functionality.
+"""
+
+import os
+import threading
+import time
+import unittest
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.dispatch import BackgroundDispatcher
+
+from . import FlaskTrackUsageTestCase, TestStorage
+
+
+class TestBackgroundDispatch(FlaskTrackUsageTestCase):
+    """
+    Tests storing data through the background dispatcher.
+    """
+
+    def setUp(self):
+        """
+        Set up an app to test with.
+        """
+        FlaskTrackUsageTestCase.setUp(self)
+        self.storage = TestStorage()
+        self.app.config['TRACK_USAGE_DISPATCH'] = 'background'
+
+    def test_unknown_dispatch(self):
+        """
+        Verify that we fail when the dispatch type is unknown.
+        """
+        self.app.config['TRACK_USAGE_DISPATCH'] = 'later'
+        with self.assertRaises(NotImplementedError):
+            TrackUsage(self.app, self.storage)
+
+    def test_background_store(self):
+        """
+        Verify data reaches the storage once the queue is drained.
+        """
+        tu = TrackUsage(self.app, self.storage)
+        self.client.get('/')
+        tu.shutdown()
+        assert type(self.storage.get()) is dict
+        stats = tu.dispatcher.stats()
+        assert stats['enqueued'] == 1
+        assert stats['processed'] == 1
+        assert stats['queued'] == 0
+
+
+class TestBackgroundDispatcher(unittest.TestCase):
+    """
+    Tests the dispatcher overflow policies and counters.
+    """
+
+    def setUp(self):
+        """
+        Creates a handler which blocks on "first" until released.
+        """
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.handled = []
+
+        def handler(data):
+            if data == 'first':
+                self.started.set()
+                self.release.wait()
+            if data == 'fail':
+                raise ValueError(data)
+            self.handled.append(data)
+
+        self.handler = handler
+
+    def _fill(self, dispatcher):
+        """
+        Occupies the only worker and fills the queue.
+        """
+        dispatcher.dispatch('first')
+        self.started.wait()
+        dispatcher.dispatch('second')
+
+    def test_invalid_overflow(self):
+        """
+        Verify an unknown overflow policy is refused.
+        """
+        with self.assertRaises(ValueError):
+            BackgroundDispatcher(self.handler, overflow='explode')
+
+    def test_drop(self):
+        """
+        Verify items are dropped and counted when the queue is full.
+        """
+        dispatcher = BackgroundDispatcher(self.handler, queue_size=1)
+        self._fill(dispatcher)
+        dispatcher.dispatch('third')
+        self.release.set()
+        dispatcher.shutdown()
+        assert self.handled == ['first', 'second']
+        stats = dispatcher.stats()
+        assert stats['enqueued'] == 2
+        assert stats['dropped'] == 1
+
+    def test_block_timeout(self):
+        """
+        Verify blocking gives up after the timeout.
+        """
+        dispatcher = BackgroundDispatcher(
+            self.handler, queue_size=1, overflow='block', block_timeout=0.01)
+        self._fill(dispatcher)
+        dispatcher.dispatch('third')
+        self.release.set()
+        dispatcher.shutdown()
+        assert dispatcher.stats()['dropped'] == 1
+
+    def test_block_concurrent(self):
+        """
+        Verify blocked callers wait for the timeout at the same time.
+        """
+        dispatcher = BackgroundDispatcher(
+            self.handler, queue_size=1, overflow='block', block_timeout=0.2)
+        self._fill(dispatcher)
+        waits = []
+
+        def dispatch():
+            start = time.time()
+            dispatcher.dispatch('blocked')
+            waits.append(time.time() - start)
+
+        threads = [threading.Thread(target=dispatch) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.release.set()
+        dispatcher.shutdown()
+        assert dispatcher.stats()['dropped'] == 5
+        assert max(waits) < 0.6
+
+    def test_spill(self):
+        """
+        Verify spilled items are handled in the calling thread.
+        """
+        dispatcher = BackgroundDispatcher(
+            self.handler, queue_size=1, overflow='spill')
+        self._fill(dispatcher)
+        dispatcher.dispatch('third')
+        self.release.set()
+        dispatcher.shutdown()
+        assert sorted(self.handled) == ['first', 'second', 'third']
+        assert dispatcher.stats()['spilled'] == 1
+
+    def test_failed(self):
+        """
+        Verify handler failures are counted and do not stop the worker.
+        """
+        dispatcher = BackgroundDispatcher(self.handler)
+        dispatcher.dispatch('fail')
+        dispatcher.dispatch('ok')
+        dispatcher.shutdown()
+        assert self.handled == ['ok']
+        stats = dispatcher.stats()
+        assert stats['failed'] == 1
+        assert stats['processed'] == 1
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Requires os.fork")
+    def test_fork(self):
+        """
+        Verify a dispatcher created before a fork works in the child.
+        """
+        dispatcher = BackgroundDispatcher(self.handler, overflow='block')
+        dispatcher.dispatch('parent')
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                for i in range(10):
+                    dispatcher.dispatch(i)
+                dispatcher.shutdown()
+                if (dispatcher.stats()['processed'] == 10 and
+                        self.handled[-10:] == list(range(10))):
+                    code = 0
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        dispatcher.shutdown()
+        assert status == 0
+        assert self.handled == ['parent']
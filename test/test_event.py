@@ -0,0 +1,132 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests the lazy usage event.
+"""
+
+import unittest
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.event import FIELDS, UsageEvent
+from flask_track_usage.storage import Writer
+
+from . import FlaskTrackUsageTestCase
+
+
+class FakeRequest(object):
+    """
+    Request which counts how often its path is read.
+    """
+
+    def __init__(self):
+        self.reads = 0
+
+    @property
+    def path(self):
+        self.reads += 1
+        return '/path'
+
+
+class TestUsageEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.request = FakeRequest()
+        self.event = UsageEvent(self.request, None, status=200)
+
+    def test_lazy(self):
+        assert self.request.reads == 0
+        assert self.event['path'] == '/path'
+        assert self.event['path'] == '/path'
+        assert self.request.reads == 1
+        assert self.event['status'] == 200
+        # Eager fields which were not given are missing
+        assert 'speed' not in self.event
+        with self.assertRaises(KeyError):
+            self.event['speed']
+
+    def test_mapping(self):
+        self.event['extra'] = 1
+        self.event['status'] = 404
+        assert self.event.get('extra') == 1
+        assert self.event.get('missing', 2) == 2
+        del self.event['extra']
+        del self.event['status']
+        assert 'extra' not in self.event
+        assert 'status' not in self.event
+        assert set(self.event) <= set(FIELDS)
+
+    def test_select_and_detach(self):
+        self.event['_parent_self'] = None
+        assert self.event.select(['status']) == {
+            'status': 200, '_parent_self': None}
+        self.event.detach(['status'])
+        assert 'path' not in self.event
+        with self.assertRaises(KeyError):
+            self.event['path']
+        assert self.request.reads == 0
+
+
+class FieldsWriter(Writer):
+    """
+    Writer declaring the fields it reads.
+    """
+
+    fields = ('path', 'status')
+
+    def set_up(self):
+        self.events = []
+
+    def store(self, data):
+        self.events.append(data)
+        return data
+
+
+class TestTrackUsageFields(FlaskTrackUsageTestCase):
+
+    def test_declared_fields(self):
+        writer = FieldsWriter()
+        TrackUsage(self.app, [writer])
+        self.client.get('/?a=1')
+        event = writer.events.pop()
+        assert isinstance(event, UsageEvent)
+        assert event['path'] == '/'
+        assert event['status'] == 200
+        # Detached once the request finished, url_args was never computed
+        with self.assertRaises(KeyError):
+            event['url_args']
+
+    def test_background_detach(self):
+        self.app.config['TRACK_USAGE_DISPATCH'] = 'background'
+        writer = FieldsWriter()
+        tu = TrackUsage(self.app, [writer])
+        self.client.get('/')
+        tu.shutdown(5)
+        assert writer.events.pop()['path'] == '/'
@@ -0,0 +1,176 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests IP address resolution.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.cache import LRUCache
+from flask_track_usage.geoip import (
+    CachedResolver, CIDRResolver, HTTPResolver, ResolveError)
+
+from . import FlaskTrackUsageTestCase, TestStorage
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        # b was the least recently used
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert len(cache) == 2
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        assert 'a' in cache
+        time.sleep(0.02)
+        assert 'a' not in cache
+
+
+class TestCIDRResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ranges.db')
+        CIDRResolver.build(self.path, [
+            ('10.0.0.0/8', {'country': 'private'}),
+            ('192.0.2.0/24', {'country': 'test-net'}),
+            (('198.51.100.10', '198.51.100.20'), {'country': 'range'}),
+            ('127.0.0.1', {'country': 'localhost'}),
+        ])
+        self.resolver = CIDRResolver(self.path)
+
+    def tearDown(self):
+        self.resolver.close()
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        assert self.resolver('10.1.2.3') == {'country': 'private'}
+        assert self.resolver('192.0.2.255') == {'country': 'test-net'}
+        assert self.resolver('198.51.100.10') == {'country': 'range'}
+        assert self.resolver('198.51.100.20') == {'country': 'range'}
+        assert self.resolver('127.0.0.1') == {'country': 'localhost'}
+
+    def test_missing(self):
+        assert self.resolver('11.0.0.0') is None
+        assert self.resolver('198.51.100.21') is None
+        assert self.resolver('2001:db8::1') is None
+        assert self.resolver(None) is None
+
+    def test_overlap(self):
+        with self.assertRaises(ValueError):
+            CIDRResolver.build(self.path + '2', [
+                ('10.0.0.0/8', {}),
+                ('10.1.0.0/16', {}),
+            ])
+
+    def test_cached(self):
+        calls = []
+
+        def resolver(ip):
+            calls.append(ip)
+            return self.resolver(ip)
+
+        cached = CachedResolver(resolver)
+        assert cached('10.0.0.1') == {'country': 'private'}
+        assert cached('10.0.0.1') == {'country': 'private'}
+        assert cached('11.0.0.1') is None
+        assert cached('11.0.0.1') is None
+        assert calls == ['10.0.0.1', '11.0.0.1']
+
+    def test_failure_not_cached(self):
+        calls = []
+
+        def resolver(ip):
+            calls.append(ip)
+            if len(calls) == 1:
+                raise ResolveError('Service unavailable')
+            return self.resolver(ip)
+
+        cached = CachedResolver(resolver)
+        assert cached('10.0.0.1') is None
+        assert cached('10.0.0.1') == {'country': 'private'}
+        assert cached('10.0.0.1') == {'country': 'private'}
+        assert calls == ['10.0.0.1', '10.0.0.1']
+
+    def test_http_failure(self):
+        # Nothing listens on port 1
+        resolver = HTTPResolver('http://127.0.0.1:1/{ip}', timeout=1)
+        with self.assertRaises(ResolveError):
+            resolver('10.0.0.1')
+        assert CachedResolver(resolver)('10.0.0.1') is None
+
+
+class TestTrackUsageResolver(FlaskTrackUsageTestCase):
+
+    def setUp(self):
+        FlaskTrackUsageTestCase.setUp(self)
+        self.storage = TestStorage()
+
+    def test_custom_resolver(self):
+        calls = []
+
+        def resolver(ip):
+            calls.append(ip)
+            return {'ip': ip}
+
+        self.app.config['TRACK_USAGE_IP_RESOLVER'] = resolver
+        TrackUsage(self.app, self.storage)
+        self.client.get('/')
+        self.client.get('/')
+        assert self.storage.get()['ip_info'] == {'ip': '127.0.0.1'}
+        assert self.storage.get()['ip_info'] == {'ip': '127.0.0.1'}
+        assert calls == ['127.0.0.1']
+
+    def test_database(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ranges.db')
+            CIDRResolver.build(path, [('127.0.0.0/8', {'country': 'lo'})])
+            self.app.config['TRACK_USAGE_GEOIP_DATABASE'] = path
+            TrackUsage(self.app, self.storage)
+            self.client.get('/')
+            assert self.storage.get()['ip_info'] == {'country': 'lo'}
+        finally:
+            shutil.rmtree(directory)
@@ -111,3 +111,72 @@ class TestIncludeExclude(FlaskTrackUsageTestCase):
         self.client.get('/excluded')
         with self.assertRaises(IndexError):
             self.storage.get()
+
+    def test_exclude_in_app_context(self):
+        """
+        Test that each request of a shared app context is decided on its
+        own.
+        """
+        self.track_usage = TrackUsage(self.app, self.storage)
+
+        @self.track_usage.exclude
+        @self.app.route('/excluded')
+        def excluded():
+            return "EXCLUDED"
+
+        with self.app.app_context():
+            self.client.get('/')
+            assert type(self.storage.get()) is dict
+            self.client.get('/excluded')
+            with self.assertRaises(IndexError):
+                self.storage.get()
+
+    def test_include_endpoint_and_prefix(self):
+        """
+        Test that endpoint names and URL prefixes can be included.
+        """
+        self.app.config[
+            'TRACK_USAGE_INCLUDE_OR_EXCLUDE_VIEWS'] = 'include'
+        self.track_usage = TrackUsage(self.app, self.storage)
+
+        @self.app.route('/named')
+        def named():
+            return "NAMED"
+
+        @self.app.route('/api/<item>')
+        def api(item):
+            return item
+
+        self.client.get('/named')
+        with self.assertRaises(IndexError):
+            self.storage.get()
+
+        # Including after a request was seen must be honoured
+        self.track_usage.include_endpoint('named')
+        self.track_usage.include_prefix('/api/')
+        self.client.get('/named')
+        assert self.storage.get()['path'] == '/named'
+        self.client.get('/api/thing')
+        assert self.storage.get()['path'] == '/api/thing'
+        self.client.get('/')
+        with self.assertRaises(IndexError):
+            self.storage.get()
+
+    def test_exclude_endpoint_and_prefix(self):
+        """
+        Test that endpoint names and URL prefixes can be excluded.
+        """
+        self.app.config[
+            'TRACK_USAGE_INCLUDE_OR_EXCLUDE_VIEWS'] = 'exclude'
+        self.track_usage = TrackUsage(self.app, self.storage)
+        self.track_usage.exclude_endpoint('index')
+        self.track_usage.exclude_prefix('/api/')
+
+        @self.app.route('/api/<item>')
+        def api(item):
+            return item
+
+        self.client.get('/')
+        self.client.get('/api/thing')
+        with self.assertRaises(IndexError):
+            self.storage.get()
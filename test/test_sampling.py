@@ -0,0 +1,103 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests request sampling.
+"""
+
+import unittest
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.sampling import Sampler, scale
+
+from . import FlaskTrackUsageTestCase, TestStorage
+
+
+class TestSampler(unittest.TestCase):
+
+    def test_scale(self):
+        assert scale(3, 1) == 3
+        assert scale(1, 4.0) == 4
+        assert scale(1, 2.5) in (2, 3)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            Sampler(1.5)
+        with self.assertRaises(ValueError):
+            Sampler(1, {'index': -1})
+
+    def test_endpoint_rates(self):
+        sampler = Sampler(0.5, {
+            'index': 1, 'api.': 0.25, 'api.v2.': 0})
+        assert sampler.endpoint_rate('index') == 1
+        assert sampler.endpoint_rate('other') == 0.5
+        assert sampler.endpoint_rate(None) == 0.5
+        assert sampler.endpoint_rate('api.items') == 0.25
+        assert sampler.endpoint_rate('api.v2.items') == 0
+
+    def test_weight(self):
+        sampler = Sampler(0, keep_slower_than=1)
+        assert sampler.weight('index', 200, 0.1) is None
+        assert sampler.weight('index', 500, 0.1) == 1
+        assert sampler.weight('index', 200, 2) == 1
+        assert Sampler(0, keep_errors=False).weight(
+            'index', 500, 0.1) is None
+        assert Sampler(1).weight('index', 200, 0.1) == 1
+
+
+class TestTrackUsageSampling(FlaskTrackUsageTestCase):
+
+    def setUp(self):
+        FlaskTrackUsageTestCase.setUp(self)
+        self.storage = TestStorage()
+
+    def test_default_weight(self):
+        TrackUsage(self.app, self.storage)
+        self.client.get('/')
+        assert self.storage.get()['sample_weight'] == 1
+
+    def test_sampled_out(self):
+        self.app.config['TRACK_USAGE_SAMPLE_RATE'] = 0
+        TrackUsage(self.app, self.storage)
+        self.client.get('/')
+        with self.assertRaises(IndexError):
+            self.storage.get()
+        # Errors are always kept
+        self.client.get('/missing')
+        result = self.storage.get()
+        assert result['status'] == 404
+        assert result['sample_weight'] == 1
+
+    def test_endpoint_rate(self):
+        self.app.config['TRACK_USAGE_SAMPLE_RATE'] = 0
+        self.app.config['TRACK_USAGE_SAMPLE_RATES'] = {'index': 1}
+        TrackUsage(self.app, self.storage)
+        self.client.get('/')
+        assert self.storage.get()['path'] == '/'
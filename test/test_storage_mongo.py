@@ -151,6 +151,29 @@ class TestMongoStorage(FlaskTrackUsageTestCase):
         assert result['path'] == '/'
         assert type(result['date']) is datetime.datetime
 
+    def test_mongo_storage_indexes(self):
+        """
+        Verify the date index is created.
+        """
+        MongoStorage(database=DB, collection=COLL_NAME, ttl=60)
+        indexes = self.storage.collection.index_information()
+        keys = [index['key'] for index in indexes.values()]
+        assert [('date', -1), ('_id', 1)] in keys
+        assert [index.get('expireAfterSeconds') for index in indexes.values()
+                if index['key'] == [('date', 1)]] == [60]
+
+    def test_mongo_storage_ttl_change(self):
+        """
+        Verify an existing date index gets the new TTL.
+        """
+        self.storage.collection.create_index('date')
+        for ttl in (60, 120):
+            MongoStorage(database=DB, collection=COLL_NAME, ttl=ttl)
+            indexes = self.storage.collection.index_information()
+            assert [index.get('expireAfterSeconds')
+                    for index in indexes.values()
+                    if index['key'] == [('date', 1)]] == [ttl]
+
     def test_mongo_storage_get_usage(self):
         """
         Verify we can get usage information in expected ways.
@@ -175,6 +198,44 @@ class TestMongoStorage(FlaskTrackUsageTestCase):
         assert len(self.storage.get_usage(end_date=now)) == 3
         assert len(self.storage.get_usage(end_date=now, limit=2)) == 2
 
+    def test_mongo_storage_purge(self):
+        """
+        Verify old usage information is deleted in batches.
+        """
+        for day in (1, 2, 3):
+            self.track_usage._fake_time = datetime.datetime(2018, 1, day)
+            self.client.get('/')
+        purged = self.storage.purge(
+            datetime.datetime(2018, 1, 3), batch_size=1)
+        assert purged == 2
+        usage = self.storage.get_usage()
+        assert [x['date'] for x in usage] == [datetime.datetime(2018, 1, 3)]
+
+    def test_mongo_storage_iter_usage(self):
+        """
+        Verify we can stream usage information.
+        """
+        for i in range(5):
+            self.client.get('/')
+
+        ids = [x['_id'] for x in self.storage.iter_usage(batch_size=2)]
+        assert len(ids) == 5
+        assert ids == [x['_id'] for x in self.storage.get_usage()]
+
+    def test_mongo_storage_get_usage_cursor(self):
+        """
+        Verify we can page through usage information with cursors.
+        """
+        for i in range(5):
+            self.client.get('/')
+
+        usage = self.storage.get_usage(limit=2)
+        ids = [x['_id'] for x in usage]
+        while usage.next_cursor:
+            usage = self.storage.get_usage(limit=2, after=usage.next_cursor)
+            ids.extend(x['_id'] for x in usage)
+        assert ids == [x['_id'] for x in self.storage.get_usage()]
+
 
 @unittest.skipUnless(HAS_MONGOENGINE, "Requires MongoEngine")
 @unittest.skipUnless(COLLECTION, "Requires a running test MongoDB")
@@ -216,3 +277,53 @@ class TestMongoEngineStorage(FlaskTrackUsageTestCase):
         assert doc.path == '/'
         assert type(doc.date) is datetime.datetime
 
+    def test_mongoengine_storage_indexes(self):
+        """
+        Verify the indexes are created with the collection.
+        """
+        self.client.get('/')
+        indexes = self.storage.collection._get_collection().index_information()
+        keys = [index['key'] for index in indexes.values()]
+        assert [('date', -1), ('_id', 1)] in keys
+        with self.assertRaises(ValueError):
+            MongoEngineStorage(doc=self.storage.collection, ttl=60)
+
+    def test_mongoengine_storage_purge(self):
+        """
+        Verify old usage information is deleted in batches.
+        """
+        for day in (1, 2, 3):
+            self.track_usage._fake_time = datetime.datetime(2018, 1, day)
+            self.client.get('/')
+        purged = self.storage.purge(
+            datetime.datetime(2018, 1, 3), batch_size=1)
+        assert purged == 2
+        usage = self.storage.get_usage()
+        assert [x['date'] for x in usage] == [datetime.datetime(2018, 1, 3)]
+
+    def test_mongoengine_storage_iter_usage(self):
+        """
+        Verify we can stream usage information.
+        """
+        for i in range(5):
+            self.client.get('/')
+
+        ids = [x['_id'] for x in self.storage.iter_usage(batch_size=2)]
+        assert len(ids) == 5
+        assert ids == [x['_id'] for x in self.storage.get_usage()]
+
+    def test_mongoengine_storage_get_usage_cursor(self):
+        """
+        Verify we can page through usage information with cursors.
+        """
+        for i in range(5):
+            self.client.get('/')
+
+        usage = self.storage.get_usage(limit=2)
+        ids = [x['_id'] for x in usage]
+        while usage.next_cursor:
+            usage = self.storage.get_usage(limit=2, after=usage.next_cursor)
+            ids.extend(x['_id'] for x in usage)
+        assert len(ids) == 5
+        assert ids == [x['_id'] for x in self.storage.get_usage()]
+
@@ -0,0 +1,146 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests redis storage.
+"""
+
+import calendar
+import datetime
+import time
+import unittest
+
+try:
+    import fakeredis
+    HAS_FAKEREDIS = True
+except ImportError:
+    HAS_FAKEREDIS = False
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.storage.batch import BatchStorage
+from flask_track_usage.storage.redis_db import _RedisStorage
+
+from . import FlaskTrackUsageTestCase
+
+
+class FakeRedisStorage(_RedisStorage):
+    """
+    Redis storage using an in-process fake server.
+    """
+
+    def set_up(self, hooks=None):
+        self.db = fakeredis.FakeRedis()
+
+
+@unittest.skipUnless(HAS_FAKEREDIS, "Requires fakeredis")
+class TestRedisStorage(FlaskTrackUsageTestCase):
+
+    def setUp(self):
+        FlaskTrackUsageTestCase.setUp(self)
+
+        @self.app.route('/other')
+        def other():
+            return "Other"
+
+        self.storage = FakeRedisStorage()
+        self.track_usage = TrackUsage(self.app, self.storage)
+
+    def test_store(self):
+        self.client.get('/')
+        self.client.get('/other')
+        keys = self.storage.db.smembers("usage_data_keys")
+        assert len(keys) == 1
+        assert sorted(self.storage.db.hkeys(keys.pop())) == [b'1', b'2']
+        assert self.storage.db.zcard("usage_data_index") == 2
+
+    def test_store_many(self):
+        self.track_usage._storages = [
+            BatchStorage(self.storage, size=3, max_age=None)]
+        for i in range(3):
+            self.client.get('/')
+        assert len(self.storage.get_usage()) == 3
+
+    def test_get_usage(self):
+        for page in ('/', '/other', '/'):
+            self.client.get(page)
+        result = self.storage.get_usage()
+        assert len(result) == 3
+        assert result[0]['url'] == 'http://localhost/'
+        assert result[0]['status'] == 200
+        assert len(self.storage.get_usage(limit=2)) == 2
+        assert len(self.storage.get_usage(limit=2, page=2)) == 1
+
+    def test_iter_usage(self):
+        for page in ('/', '/other', '/', '/other', '/'):
+            self.client.get(page)
+        result = list(self.storage.iter_usage(batch_size=2))
+        assert result == self.storage.get_usage()
+
+    def test_purge(self):
+        for day in (1, 2, 3):
+            self.track_usage._fake_time = datetime.datetime(2018, 1, day)
+            self.client.get('/')
+            self.client.get('/other')
+        self.storage.db.zrem(
+            "usage_data_index", "usage_data:20180101:2")
+        purged = self.storage.purge(
+            datetime.datetime(2018, 1, 3, 12), batch_size=1)
+        assert purged == 4
+        assert self.storage.db.smembers("usage_data_keys") == set(
+            [b"usage_data:20180103"])
+        assert self.storage.db.zcard("usage_data_index") == 2
+        assert len(self.storage.get_usage()) == 2
+        self.assertRaises(
+            NotImplementedError, self.storage.purge,
+            datetime.datetime(2018, 1, 3), downsample=["sumUrl"])
+
+    def test_ttl(self):
+        self.storage.ttl = 2 * 24 * 60 * 60
+        today = datetime.datetime.utcnow().replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        self.track_usage._fake_time = today
+        self.client.get('/')
+        # expires two days after the end of the day
+        struct_name = "usage_data:{:%Y%m%d}".format(today)
+        expire_at = calendar.timegm(
+            (today + datetime.timedelta(days=3)).timetuple())
+        ttl = self.storage.db.ttl(struct_name)
+        assert abs(time.time() + ttl - expire_at) < 5
+        # records of expired days are removed from the index
+        self.track_usage._fake_time = today + datetime.timedelta(days=3)
+        self.client.get('/')
+        assert self.storage.db.zcard("usage_data_index") == 1
+
+    def test_reindex(self):
+        self.client.get('/')
+        self.storage.db.delete("usage_data_index")
+        self.storage.reindex()
+        assert self.storage.db.zcard("usage_data_index") == 1
+        assert len(self.storage.get_usage()) == 1
@@ -29,6 +29,7 @@ import json
 from flask import Blueprint
 from test import FlaskTrackUsageTestCase, FlaskTrackUsageTestCaseGeoIP
 from flask_track_usage import TrackUsage
+from flask_track_usage.storage.batch import BatchStorage
 from flask_track_usage.storage.sql import SQLStorage
 
 
@@ -72,6 +73,25 @@ class TestSQLiteStorage(FlaskTrackUsageTestCase):
         print(self.given_table_name, list(meta.tables.keys())[0])
         self.assertIn(self.given_table_name, meta.tables.keys())
 
+    def test_indexes(self):
+        engine = self.storage._eng
+        indexes = sql.inspect(engine).get_indexes(self.given_table_name)
+        assert [i['name'] for i in indexes] == ['ix_my_usage_datetime']
+        storage = SQLStorage(
+            engine=engine, table_name='other', indexes=['path', 'status'])
+        indexes = dict(
+            (i['name'], i['column_names'])
+            for i in sql.inspect(engine).get_indexes('other'))
+        assert indexes == {
+            'ix_other_datetime': ['datetime'],
+            'ix_other_path_datetime': [
+                'path_id' if storage.normalize else 'path', 'datetime'],
+            'ix_other_status_datetime': ['status', 'datetime'],
+        }
+        with self.assertRaises(ValueError):
+            SQLStorage(engine=engine, table_name='another',
+                       indexes=['missing'])
+
     def test_storage_data_basic(self):
         self.client.get('/')
         con = self.storage._eng.connect()
@@ -113,6 +133,42 @@ class TestSQLiteStorage(FlaskTrackUsageTestCase):
         assert result[14].__class__ is float
         assert type(result[15]) is datetime.datetime
 
+    def test_storage_store_many(self):
+        self.track_usage._storages = [
+            BatchStorage(self.storage, size=5, max_age=None)]
+        for i in range(4):
+            self.client.get('/')
+        assert len(self.storage._get_raw()) == 0
+        self.client.get('/blueprint')
+        rows = self.storage._get_raw()
+        assert len(rows) == 5
+        assert sorted(r[13] for r in rows) == ['/'] * 4 + ['/blueprint']
+
+    def test_storage_ingest_copy(self):
+        self.storage = SQLStorage(
+            engine=self.storage._eng,
+            table_name=self.given_table_name,
+            ingest='copy'
+        )
+        self.track_usage._storages = [
+            BatchStorage(self.storage, size=2, max_age=None)]
+        self.client.get('/')
+        self.client.get('/blueprint')
+        rows = self.storage._get_raw()
+        assert len(rows) == 2
+        result = [r for r in rows if r[13] == '/blueprint'][0]
+        assert result[1] == u'http://localhost/blueprint'
+        assert result[2] is None
+        assert result[6] == 'blueprint'
+        assert result[8] == 200
+        assert result[11] == False
+        assert result[12] is None
+        assert type(result[15]) is datetime.datetime
+
+    def test_storage_ingest_invalid(self):
+        with self.assertRaises(ValueError):
+            SQLStorage(engine=self.storage._eng, ingest='bulk')
+
     def test_storage__get_raw(self):
         # First check no blueprint case get_usage is correct
         self.client.get('/')
@@ -248,9 +304,230 @@ class TestSQLiteStorage(FlaskTrackUsageTestCase):
             track_var = result[i][17] if result[i][17] != '{}' else None
             assert track_var == result2[i]['track_var']
 
+    def test_storage_get_usage_cursor(self):
+        for i in range(25):
+            self.client.get('/')
+        expected = self.storage.get_usage(limit=100)
+        assert len(expected) == 25
+        assert expected.next_cursor is None
+
+        seen = []
+        usage = self.storage.get_usage(limit=10)
+        seen.extend(usage)
+        while usage.next_cursor:
+            usage = self.storage.get_usage(
+                limit=10, after=usage.next_cursor)
+            seen.extend(usage)
+        assert seen == list(expected)
+
+        # The cursor continues where page based results stop
+        second = self.storage.get_usage(limit=10, page=2)
+        usage = self.storage.get_usage(limit=10, after=second.next_cursor)
+        assert list(usage) == list(expected[20:])
+
+        self.assertRaises(
+            ValueError, self.storage.get_usage, after='not a cursor')
+
+    def test_storage_purge(self):
+        for day in (1, 2, 3):
+            self.track_usage._fake_time = datetime.datetime(2018, 1, day)
+            self.client.get('/')
+            self.client.get('/blueprint')
+        purged = self.storage.purge(
+            datetime.datetime(2018, 1, 3), batch_size=3)
+        assert purged == 4
+        dates = [x['date'] for x in self.storage.get_usage()]
+        assert dates == [datetime.datetime(2018, 1, 3)] * 2
+        assert self.storage.purge(datetime.datetime(2018, 1, 3)) == 0
+
+    def test_storage_iter_usage(self):
+        for i in range(25):
+            self.client.get('/')
+        self.client.get('/blueprint')
+        expected = self.storage.get_usage(limit=100)
+        assert list(self.storage.iter_usage(batch_size=10)) == expected
+        assert list(self.storage.iter_usage(batch_size=100)) == expected
+        now = datetime.datetime.utcnow()
+        assert list(self.storage.iter_usage(start_date=now)) == []
+
+
+
+
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+class TestSQLiteNormalizedStorage(TestSQLiteStorage):
+
+    def _create_storage(self):
+        engine = sql.create_engine("sqlite://")
+        self.storage = SQLStorage(
+            engine=engine,
+            table_name=self.given_table_name,
+            normalize=True
+        )
+
+    def _values(self, column):
+        table = self.storage._dimensions[column]
+        with self.storage._eng.connect() as con:
+            return dict(con.execute(
+                sql.select([table.c.value, table.c.id])).fetchall())
+
+    def test_storage_data_basic(self):
+        self.client.get('/')
+        self.client.get('/')
+        with self.storage._eng.connect() as con:
+            rows = con.execute(
+                sql.select([self.storage.track_table])).fetchall()
+        urls = self._values('url')
+        assert urls == {u'http://localhost/': rows[0]['url_id']}
+        assert rows[1]['url_id'] == rows[0]['url_id']
+        assert rows[0]['ua_browser_id'] is None
+        assert rows[0]['blueprint_id'] is None
+        assert self._values('path') == {u'/': rows[0]['path_id']}
 
+    def test_storage_data_blueprint(self):
+        self.client.get('/blueprint')
+        result = self.storage._get_raw()[0]
+        assert result[1] == u'http://localhost/blueprint'
+        assert result[6] == 'blueprint'
+        assert result[13] == '/blueprint'
+        assert list(self._values('blueprint')) == ['blueprint']
 
+    def test_storage_id_cache(self):
+        self.client.get('/')
+        statements = []
+
+        @sql.event.listens_for(self.storage._eng, "before_cursor_execute")
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        self.client.get('/')
+        sql.event.remove(
+            self.storage._eng, "before_cursor_execute", count)
+        assert len(statements) == 1
+        assert statements[0].startswith('INSERT INTO my_usage ')
+
+    def test_normalize_existing(self):
+        # an existing table keeps its layout
+        storage = SQLStorage(
+            engine=self.storage._eng, table_name=self.given_table_name)
+        assert storage.normalize
+        SQLStorage(engine=self.storage._eng, table_name='other')
+        with self.assertRaises(ValueError):
+            SQLStorage(engine=self.storage._eng, table_name='other',
+                       normalize=True)
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+class TestSQLitePartitionedStorage(FlaskTrackUsageTestCase):
+
+    def setUp(self):
+        FlaskTrackUsageTestCase.setUp(self)
+        self.engine = sql.create_engine("sqlite://")
+        self.storage = SQLStorage(
+            engine=self.engine,
+            table_name='my_usage',
+            partition='month'
+        )
+        self.track_usage = TrackUsage(self.app, self.storage)
+
+    def _get(self, *dates):
+        for date in dates:
+            self.track_usage._fake_time = date
+            self.client.get('/')
 
+    def _table_names(self):
+        return sorted(sql.inspect(self.engine).get_table_names())
+
+    def test_invalid_partition(self):
+        self.assertRaises(
+            ValueError, SQLStorage, engine=self.engine, partition='year')
+
+    def test_store(self):
+        self._get(datetime.datetime(2018, 1, 31, 23, 59),
+                  datetime.datetime(2018, 2, 1),
+                  datetime.datetime(2018, 2, 10))
+        assert self._table_names() == [
+            'my_usage', 'my_usage_2018_01', 'my_usage_2018_02']
+        with self.engine.connect() as con:
+            assert con.execute(
+                "SELECT count(*) FROM my_usage_2018_02").scalar() == 2
+            assert con.execute(
+                "SELECT count(*) FROM my_usage").scalar() == 0
+
+    def test_concurrent_partition(self):
+        # Another worker creates the partition after it was checked for
+        other = SQLStorage(
+            engine=self.engine, table_name='my_usage', partition='month')
+        start = datetime.datetime(2018, 1, 1)
+        table = self.storage._partition_table(
+            self.storage._partition_table_name(start))
+
+        def create_concurrently(target, connection, **kw):
+            other._create_partition(start)
+
+        sql.event.listen(table, 'before_create', create_concurrently)
+        self._get(datetime.datetime(2018, 1, 15))
+        assert len(self.storage.get_usage()) == 1
+
+    def test_store_many(self):
+        self.track_usage._storages = [
+            BatchStorage(self.storage, size=3, max_age=None)]
+        self._get(datetime.datetime(2018, 1, 1),
+                  datetime.datetime(2018, 3, 1),
+                  datetime.datetime(2018, 1, 2))
+        assert self._table_names() == [
+            'my_usage', 'my_usage_2018_01', 'my_usage_2018_03']
+        assert len(self.storage.get_usage()) == 3
+
+    def test_get_usage(self):
+        dates = [datetime.datetime(2018, m, d) for m in (1, 2, 3)
+                 for d in (1, 15)]
+        self._get(*dates)
+        usage = self.storage.get_usage()
+        assert [x['date'] for x in usage] == sorted(dates, reverse=True)
+
+        start, end = datetime.datetime(2018, 2, 1), dates[3]
+        with self.engine.connect() as con:
+            tables = self.storage._read_tables(con, start, end)
+        assert [t.name for t in tables] == ['my_usage', 'my_usage_2018_02']
+        usage = self.storage.get_usage(start_date=start, end_date=end)
+        assert [x['date'] for x in usage] == [dates[3], dates[2]]
+
+        # cursors and streaming continue across partitions
+        usage = self.storage.get_usage(limit=4)
+        usage = self.storage.get_usage(limit=4, after=usage.next_cursor)
+        assert [x['date'] for x in usage] == [dates[1], dates[0]]
+        streamed = list(self.storage.iter_usage(batch_size=4))
+        assert streamed == self.storage.get_usage()
+
+    def test_drop_partitions(self):
+        self._get(datetime.datetime(2018, 1, 15),
+                  datetime.datetime(2018, 2, 15),
+                  datetime.datetime(2018, 3, 15))
+        dropped = self.storage.drop_partitions(
+            datetime.datetime(2018, 3, 1))
+        assert dropped == ['my_usage_2018_01', 'my_usage_2018_02']
+        assert self._table_names() == ['my_usage', 'my_usage_2018_03']
+        assert len(self.storage.get_usage()) == 1
+        # a dropped partition is created again when needed
+        self._get(datetime.datetime(2018, 1, 20))
+        assert len(self.storage.get_usage()) == 2
+
+    def test_purge(self):
+        self._get(datetime.datetime(2018, 1, 15),
+                  datetime.datetime(2018, 2, 15),
+                  datetime.datetime(2018, 2, 20))
+        purged = self.storage.purge(datetime.datetime(2018, 2, 16))
+        assert purged == 2
+        usage = self.storage.get_usage()
+        assert [x['date'] for x in usage] == [datetime.datetime(2018, 2, 20)]
+
+    def test_drop_partitions_unpartitioned(self):
+        storage = SQLStorage(engine=self.engine, table_name='other')
+        self.assertRaises(
+            NotImplementedError, storage.drop_partitions,
+            datetime.datetime(2018, 1, 1))
 
 
 @unittest.skipUnless(HAS_POSTGRES, "Requires psycopg2 Postgres package")
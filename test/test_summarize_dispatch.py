@@ -0,0 +1,96 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests binding summary hooks to their storage backend.
+"""
+
+import os
+import subprocess
+import sys
+import types
+import unittest
+
+from flask_track_usage import summarization
+from flask_track_usage.storage import Writer
+from flask_track_usage.summarization import sumRemote, sumUrl
+
+
+class FakeSumStorage(Writer):
+    """
+    Storage class supported by the fake summary backend.
+    """
+
+    def store(self, data):
+        return data
+
+
+class TestSummaryDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        backend = types.ModuleType('fakesumstorage')
+        backend.sumUrl = lambda **kwargs: self.calls.append(kwargs['url'])
+        summarization.fakesumstorage = backend
+
+    def tearDown(self):
+        del summarization.fakesumstorage
+
+    def test_bound(self):
+        storage = FakeSumStorage(hooks=[sumUrl, sumRemote])
+        url_hook, remote_hook = storage._post_storage_hooks
+        assert url_hook.bind('FakeSumStorage') is \
+            summarization.fakesumstorage.sumUrl
+        # sumRemote is not implemented by the backend
+        with self.assertRaises(NotImplementedError):
+            storage({'url': '/', 'remote_addr': '127.0.0.1'})
+        assert self.calls == ['/']
+
+    def test_bound_call(self):
+        storage = FakeSumStorage(hooks=[sumUrl])
+        storage({'url': '/'})
+        assert self.calls == ['/']
+
+
+class TestLazyBackends(unittest.TestCase):
+
+    def test_not_imported(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, flask_track_usage.summarization as s; '
+            'print(sorted(m for m in s.BACKENDS if s.__name__ + "." + m '
+            'in sys.modules))'], env=env)
+        assert output.strip() == b'[]'
+
+    def test_unsupported(self):
+        with self.assertRaises(ImportError):
+            summarization._backend('UnknownStorage')
@@ -225,6 +225,25 @@ class TestMongoEngineSummarizeBasic(FlaskTrackUsageTestCase):
         assert month_doc.hits == 1
         assert month_doc.transfer > 1
 
+    def test_mongoengine_purge_downsample(self):
+        """
+        Test MongoEngine purge folds documents into the summaries.
+        """
+        UsageTrackerSumUrlHourly.drop_collection()
+        UsageTrackerSumUrlDaily.drop_collection()
+        UsageTrackerSumUrlMonthly.drop_collection()
+        purged = self.storage.purge(
+            self.now + datetime.timedelta(seconds=1), downsample=[sumUrl])
+        assert purged == 1
+        assert self.storage.collection.objects.count() == 0
+        hour_doc = UsageTrackerSumUrlHourly.objects.first()
+        assert hour_doc.url == 'http://localhost/'
+        assert hour_doc.date == self.hour
+        assert hour_doc.hits == 1
+        assert hour_doc.transfer > 1
+        assert UsageTrackerSumUrlDaily.objects.first().hits == 1
+        assert UsageTrackerSumUrlMonthly.objects.first().hits == 1
+
 
 @unittest.skipUnless(HAS_MONGOENGINE, "Requires MongoEngine")
 class TestMongoEngineSummarizeGetSum(FlaskTrackUsageTestCase):
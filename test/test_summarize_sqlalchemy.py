@@ -48,8 +48,18 @@ try:
 except ImportError:
     HAS_POSTGRES = False
 
+try:
+    import pymysql
+    HAS_MYSQL = True
+except ImportError:
+    HAS_MYSQL = False
+
 
 import datetime
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from flask import Blueprint
 from test import FlaskTrackUsageTestCase
@@ -65,13 +75,17 @@ from flask_track_usage.summarization import (
 
 
 
-@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
-@unittest.skipUnless(HAS_POSTGRES, "Requires psycopg2 Postgres package")
-class TestPostgreStorage(FlaskTrackUsageTestCase):
+class SQLSummaryTests(object):
+    """
+    Summary tests run against each database.
+    """
+    storage_kwargs = {}
+
+    def _create_engine(self):
+        raise NotImplementedError('_create_engine must be implemented.')
 
     def _create_storage(self):
-        engine = sql.create_engine(
-                "postgresql+psycopg2://postgres:@localhost/track_usage_test")
+        engine = self._create_engine()
         metadata = sql.MetaData(bind=engine)
         self.storage = SQLStorage(
             engine=engine,
@@ -83,7 +97,8 @@ class TestPostgreStorage(FlaskTrackUsageTestCase):
                 sumUserAgent,
                 sumLanguage,
                 sumServer
-            ]
+            ],
+            **self.storage_kwargs
         )
         metadata.create_all()
 
@@ -257,7 +272,7 @@ class TestPostgreStorage(FlaskTrackUsageTestCase):
         result = con.execute(s).fetchone()
         assert result is not None
         assert result[0] == self.fake_hour
-        assert result[1] is None  # the werkzeug test client does not have a language
+        assert result[1] == ""  # the werkzeug test client does not have a language
         assert result[2] == 3
         assert result[3] == 18
 
@@ -268,7 +283,7 @@ class TestPostgreStorage(FlaskTrackUsageTestCase):
         result = con.execute(s).fetchone()
         assert result is not None
         assert result[0] == self.fake_day
-        assert result[1] is None
+        assert result[1] == ""
         assert result[2] == 3
         assert result[3] == 18
 
@@ -280,7 +295,7 @@ class TestPostgreStorage(FlaskTrackUsageTestCase):
         result = con.execute(s).fetchone()
         assert result is not None
         assert result[0] == self.fake_month
-        assert result[1] is None
+        assert result[1] == ""
         assert result[2] == 3
         assert result[3] == 18
 
@@ -319,3 +334,208 @@ class TestPostgreStorage(FlaskTrackUsageTestCase):
         assert result[1] == self.app.name
         assert result[2] == 3
         assert result[3] == 18
+
+
+    def test_distinct_keys(self):
+        @self.app.route('/other')
+        def other():
+            return "other"
+
+        self.client.get('/')
+        self.client.get('/other')
+        self.client.get('/other')
+        self.storage.flush_summaries()
+        con = self.storage._eng.connect()
+        table = self.storage.sum_tables["url_hourly"]
+        rows = con.execute(
+            sql.select([table.c.url, table.c.hits]).order_by(table.c.url)
+        ).fetchall()
+        assert [tuple(row) for row in rows] == [
+            (u'http://localhost/', 1), (u'http://localhost/other', 2)]
+
+    def test_non_ascii_keys(self):
+        self.client.get('/', headers={'User-Agent': u'caf\xe9'})
+        self.storage.flush_summaries()
+        con = self.storage._eng.connect()
+        table = self.storage.sum_tables["useragent_hourly"]
+        assert con.execute(
+            sql.select([table.c.useragent])).scalar() == u'caf\xe9'
+
+    def test_get_sum(self):
+        self.client.get('/')
+        self.client.get('/')
+        self.storage.flush_summaries()
+        result = self.storage.get_sum(sumUrl, start_date=self.fake_time)
+        assert result["hour"] == [{
+            'date': self.fake_hour,
+            'url': u'http://localhost/',
+            'hits': 2,
+            'transfer': 12}]
+        assert result["month"][0]['date'] == self.fake_month
+        result = self.storage.get_sum(
+            "sumUrl",
+            start_date=self.fake_month,
+            end_date=self.fake_time,
+            target=u'http://localhost/missing')
+        assert result == {"hour": [], "day": [], "month": []}
+        with self.assertRaises(NotImplementedError):
+            self.storage.get_sum("sumVisitor")
+
+    def test_purge_downsample(self):
+        # rows stored before the summary hooks were added
+        hook_calls = self.storage._hook_calls
+        self.storage._hook_calls = []
+        self.client.get('/')
+        self.client.get('/')
+        self.storage._hook_calls = hook_calls
+        purged = self.storage.purge(
+            self.fake_time + datetime.timedelta(seconds=1), batch_size=1,
+            downsample=[sumUrl, "sumRemote"])
+        self.storage.flush_summaries()
+        assert purged == 2
+        assert self.storage.get_usage() == []
+        result = self.storage.get_sum(sumUrl, start_date=self.fake_time)
+        assert result["hour"] == [{
+            'date': self.fake_hour,
+            'url': u'http://localhost/',
+            'hits': 2,
+            'transfer': 0}]
+        result = self.storage.get_sum(sumServer, start_date=self.fake_time)
+        assert result["hour"] == []
+
+    def test_get_sum_union(self):
+        self.client.get('/')
+        self.storage.flush_summaries()
+        result = self.storage.get_sum(
+            sumServer, start_date=self.fake_month, end_date=self.fake_time)
+        union = self.storage.get_sum(
+            sumServer, start_date=self.fake_month, end_date=self.fake_time,
+            union=True)
+        assert union == result
+        assert [len(union[period]) for period in ("hour", "day", "month")] \
+            == [1, 1, 1]
+
+
+class AggregatedSQLSummaryTests(SQLSummaryTests):
+    """
+    Summary tests run against each database with summary_interval.
+    """
+    storage_kwargs = {'summary_interval': 3600}
+
+    def test_basic_suite(self):
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/')
+        con = self.storage._eng.connect()
+        table = self.storage.sum_tables["url_hourly"]
+        s = sql.select([table])
+        assert con.execute(s).fetchone() is None
+        self.storage.flush_summaries()
+        result = con.execute(s).fetchone()
+        assert result[0] == self.fake_hour
+        assert result[2] == 3
+        assert result[3] == 18
+        self.client.get('/')
+        self.storage.flush_summaries()
+        result = con.execute(s).fetchone()
+        assert result[2] == 4
+        assert result[3] == 24
+
+    def test_failed_flush(self):
+        self.client.get('/')
+        table = self.storage.sum_tables["url_hourly"]
+        table.drop(self.storage._eng)
+        with self.assertRaises(sql.exc.DBAPIError):
+            self.storage.flush_summaries()
+        assert self.storage._sum_aggregator.failed == 1
+        # The counts of the failed flush are written by the next one
+        table.create(self.storage._eng)
+        self.client.get('/')
+        self.storage.flush_summaries()
+        con = self.storage._eng.connect()
+        result = con.execute(sql.select([table])).fetchone()
+        assert result[2] == 2
+        assert result[3] == 12
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+@unittest.skipUnless(HAS_POSTGRES, "Requires psycopg2 Postgres package")
+class TestPostgreStorage(SQLSummaryTests, FlaskTrackUsageTestCase):
+
+    def _create_engine(self):
+        return sql.create_engine(
+            "postgresql+psycopg2://postgres:@localhost/track_usage_test")
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+@unittest.skipUnless(HAS_POSTGRES, "Requires psycopg2 Postgres package")
+class TestPostgreAggregatedStorage(
+        AggregatedSQLSummaryTests, FlaskTrackUsageTestCase):
+
+    def _create_engine(self):
+        return sql.create_engine(
+            "postgresql+psycopg2://postgres:@localhost/track_usage_test")
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+@unittest.skipUnless(HAS_MYSQL, "Requires PyMySQL package")
+class TestMySQLStorage(SQLSummaryTests, FlaskTrackUsageTestCase):
+
+    def _create_engine(self):
+        return sql.create_engine(
+            "mysql+pymysql://root:@localhost/track_usage_test")
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+class TestSQLiteStorage(SQLSummaryTests, FlaskTrackUsageTestCase):
+
+    def _create_engine(self):
+        return sql.create_engine("sqlite://")
+
+
+@unittest.skipUnless(HAS_SQLALCHEMY, "Requires SQLAlchemy")
+class TestSQLiteAggregatedStorage(
+        AggregatedSQLSummaryTests, FlaskTrackUsageTestCase):
+
+    def _create_engine(self):
+        return sql.create_engine("sqlite://")
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Requires os.fork")
+    def test_fork(self):
+        directory = tempfile.mkdtemp()
+        try:
+            engine = sql.create_engine(
+                "sqlite:///" + os.path.join(directory, "usage.db"))
+            metadata = sql.MetaData(bind=engine)
+            storage = SQLStorage(
+                engine=engine, metadata=metadata, hooks=[sumUrl],
+                summary_interval=0.01)
+            metadata.create_all()
+            aggregator = storage._sum_aggregator
+            table = storage.sum_tables["url_hourly"]
+            select = sql.select([table.c.hits]).where(table.c.url == "child")
+            aggregator.add("url_hourly", self.fake_hour, 1, 6, url="parent")
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    # Flushed periodically without the parent's deltas
+                    aggregator.add(
+                        "url_hourly", self.fake_hour, 1, 6, url="child")
+                    for i in range(100):
+                        with engine.connect() as con:
+                            if con.execute(select).scalar() == 1:
+                                code = 0
+                                break
+                        time.sleep(0.01)
+                finally:
+                    os._exit(code)
+            _, status = os.waitpid(pid, 0)
+            aggregator.close()
+            assert status == 0
+            with engine.connect() as con:
+                assert con.execute(
+                    sql.select([table.c.hits]).where(
+                        table.c.url == "parent")).scalar() == 1
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,61 @@
+# Copyright (c) 2013-2018 Steve Milner
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     (1) Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     (2) Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+#     (3)The name of the author may not be used to
+#     endorse or promote products derived from this software without
+#     specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+Tests cached user agent parsing.
+"""
+
+from flask_track_usage import TrackUsage
+from flask_track_usage.useragent import ParsedUserAgent, cache
+
+from . import FlaskTrackUsageTestCase, TestStorage
+
+
+class TestUserAgent(FlaskTrackUsageTestCase):
+
+    def setUp(self):
+        FlaskTrackUsageTestCase.setUp(self)
+        self.storage = TestStorage()
+        TrackUsage(self.app, self.storage)
+        cache.clear()
+
+    def test_cached(self):
+        headers = {'User-Agent': 'Agent/1.0'}
+        self.client.get('/', headers=headers)
+        first = self.storage.get()['user_agent']
+        self.client.get('/', headers=headers)
+        second = self.storage.get()['user_agent']
+        assert isinstance(first, ParsedUserAgent)
+        assert first is second
+        assert str(first) == 'Agent/1.0'
+        assert first.string == 'Agent/1.0'
+        assert len(cache) == 1
+        with self.assertRaises(AttributeError):
+            first.browser = 'other'